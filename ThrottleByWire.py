@@ -58,6 +58,7 @@
     #Pin A(F) is signal out, pin B(E) is ground, and pin C(D) is 5V in.
     #
     #The axle input shaft speed sensor was setup using pin 1 as power in, pin 2 as output signal, and pin 4 as ground.
+    #(Optional) For measuring speed from the sensor's tooth edges (axle_speed_source = 'edges'), sensor output signal to Pi GPIO 23 (Physical Pin 16) (3.3 V max on the pin)
 #####
     
 #####ADS1115 Pin Layout ---(and Placement)
@@ -66,7 +67,7 @@
     #SCL----To SCL1 Pin (physical pin 5) on RPi
     #SDA----To SDA1 Pin (physical pin 7) on RPi
     #ADDR---(Not used)
-    #ALRT---(Not used)
+    #ALRT---(Optional) Conversion ready signal to a Pi GPIO pin, see ADS_RDY below (Not used for now)
     #A0-----Signal Channel 0 (Pedal Position Sensor)
     #A1-----Signal Channel 1 (Axle Input Shaft Speed Sensor)
     #A2-----Signal Channel 2 (Throttle Position Sensor)
@@ -77,50 +78,47 @@
 
 #####Library Imports
 import time
-from time import sleep
-import RPi.GPIO as GPIO
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
-import board
-import busio
 import math
 import numpy as np
+import hal #sensor/stepper driver access, real hardware or simulated (see hal.py)
+from telemetry_window import SpeedWindow, HistoryWindow #ring buffer windows for accel rate and step/tps history (see telemetry_window.py)
+import calibration #sensor calibration values and lookup tables (see calibration.py)
+import profiles #cart profiles and the calibration table cache (see profiles.py)
+from adc_filters import ChannelFilters #median/low pass/decimate/hysteresis filters on the raw ADC samples (see adc_filters.py)
+from sensor_frame import capture_frame, frame_from_snapshot, step_mode_for_pedal_up, delay_FullStep, STEP_DELAY, RESOLUTION #one set of sensor readings per loop (see sensor_frame.py)
+from step_planner import StepBatchPlanner #how many steps to issue per loop (see step_planner.py)
+from axle_speed import EdgeSpeedSensor #axle speed from sensor tooth edge times (see axle_speed.py)
+from throttle_control import ThrottleAngleController #target throttle opening for the 'angle' control mode (see throttle_control.py)
+from stepper_motion import ticks_per_pulse #1/64 steps moved by one STEP pulse in a microstep mode (see stepper_motion.py)
+from position_observer import observer_for #throttle opening from the steps issued, fewer TPS reads, stall detection (see position_observer.py)
+import gpio_shadow #skips GPIO writes that would not change a pin (see gpio_shadow.py)
+import timing #fixed rate loop tick, accurate short sleeps, real time priority (see timing.py)
+import loop_trace #event ring buffer, printing/saving is done on a separate thread (see loop_trace.py)
+#Note: the Pi hardware libraries (RPi.GPIO, busio, adafruit_ads1x15) are imported by hal.RealBackend, so this file can be imported and run against the simulator (plant_sim.py) without a Pi
 #####
 
 
 
-#####ADS1115 channel voltage input code (use 'channel_name.voltage' to get voltage):
-#Create the I2C bus
-i2c = busio.I2C(board.SCL, board.SDA)
-#Create the ADC object using the I2C bus
-ads = ADS.ADS1115(i2c)
-ads.gain = 1 #GAIN
-#Create single ended input on channel 0 (A0)
-pps = AnalogIn(ads, ADS.P0) #Pedal Position Sensor
-axle_spd_sens = AnalogIn(ads, ADS.P1) #Axle Shaft Speed Sensor
-tps = AnalogIn(ads, ADS.P2) #Throttle Position Sensor
-pedalswitch = AnalogIn(ads, ADS.P3) #Pedal Switch
-#Note: To install the package necessary for using the ads module, try 'sudo pip3 install adafruit-circuitpython-ads1x15'
-#####
-
+#####Setup
 
+#ADS1115 channel numbers
+PPS_CH = 0 #Pedal Position Sensor
+AXLE_CH = 1 #Axle Shaft Speed Sensor
+TPS_CH = 2 #Throttle Position Sensor
+PSW_CH = 3 #Pedal Switch
 
-#####Setup
+#Sensor calibration values (tps/pps voltage limits, axle ratio, pedal map etc.). Edit DEFAULT_CALIBRATION in calibration.py to change these, or use a cart profile (see profiles.py).
+cal = dict(calibration.DEFAULT_CALIBRATION)
+profile = None #name of the cart profile applied (apply_profile(), or '--profile' on the command line)
+table_cache_dir = profiles.CACHE_DIR #calibration lookup tables are saved here once built and loaded at the next start, None to build them every start
+ads_gain = 1 #GAIN
 
 #Motor Info
 #NEMA17 Stepper Motor (PN: 17HS19-2004S1)
 Step_deg = 1.8 #degrees for each step
 
-#Setting up Microstepping dictionary 
-#Microstepping Resolution Setup for DRV8825 [From DRV8825 datasheet]
-#This will later be used to allow motor to more finely tune vs move quickly, depending on speed conditions. See step_mode() function.
-RESOLUTION = {'Full': (0,0,0),
-             'Half': (1,0,0),
-             '1/4':  (0,1,0),
-             '1/8':  (1,1,0),
-             '1/16': (0,0,1),
-             '1/32': (1,0,1),
-             '1/64': (1,1,1)}
+#Microstepping Resolution Setup for DRV8825 (M0/M1/M2 levels for each mode) is RESOLUTION in sensor_frame.py, imported above
+#This is used to allow motor to more finely tune vs move quickly, depending on speed conditions. See step_mode_for_error() in sensor_frame.py.
 
 
 #Setup for RPi pin being high/low depending on motor direction desired
@@ -132,15 +130,129 @@ DIR = 20 #Direction --- GPIO Pin Label
 STEP = 21 #Step --- GPIO Pin Label
 MODE = (14,15,18) #Microstep Resolution Mode --GPIO Labels for M0, M1, and M2.
 SLEEP = 17 #Sleep --- GPIO Pin Label
-
-#GPIO Setup
-GPIO.setmode(GPIO.BCM) #Set Pins to use the GPIO labels/broadcom labeling system instead of physical pin assignment
-GPIO.setup(DIR, GPIO.OUT) #Direction Pin on Pi is set to an output pin
-GPIO.setup(STEP, GPIO.OUT) #Step Pin on Pi is set to an output pin
-GPIO.setup(MODE, GPIO.OUT) #Set mode pin on Pi as an output.
-GPIO.setup(SLEEP, GPIO.OUT) #Set sleep pin on Pi as an output pin.
-GPIO.output(DIR, CW) #Direction set to CW initially (Rpi pulls DIR pin high?) 
-GPIO.output(SLEEP, 1) #enable stepper motor
+AXLE_EDGE_PIN = 23 #Axle input shaft speed sensor tooth edges --- GPIO Pin Label (only used if axle_speed_source is 'edges')
+
+#Axle speed source
+#'adc' ----- sensor voltage on ADS1115 channel P1 (see ax_spd_sens_v_to_veh_spd)
+#'edges' --- sensor tooth edges on AXLE_EDGE_PIN, timed by GPIO edge interrupts (see axle_speed.py). P1 is then not read, so the other channels are sampled more often.
+axle_speed_source = 'adc'
+
+#ADS1115 acquisition engine settings
+#With the engine, a background thread keeps converting the channels in continuous mode and the loop only reads the latest samples (never waits on the I2C bus).
+#Without it, every '.voltage'/'.value' is a blocking single shot conversion through the adafruit library. (Simulator always reads the channels directly.)
+use_acquisition_engine = True
+ads_data_rate = 860 #ADS1115 samples per second (8, 16, 32, 64, 128, 250, 475 or 860), shared between the channels in the schedule
+ads_schedule = (PPS_CH, AXLE_CH, TPS_CH, PSW_CH) #round robin order the channels are sampled in (list a channel more than once to sample it more often)
+ADS_RDY = None #GPIO pin wired to ADS1115 ALRT pin (used as conversion ready signal), None if not wired
+
+#ADC filters (see adc_filters.py)
+#Filter stages for each channel, run on every raw sample before it is converted (on the acquisition engine thread, or on each blocking read without it).
+#The pedal switch hysteresis thresholds are in volts, either side of psw_v_threshold in calibration.py.
+adc_filters_enabled = False
+adc_filters = {PPS_CH: (('median', 3), ('one_pole', 0.3)),
+               AXLE_CH: (('median', 5), ('one_pole', 0.15)),
+               TPS_CH: (('median', 3), ('biquad', 0.05)),
+               PSW_CH: (('hysteresis', 1.2, 1.8),)}
+
+#DRV8825 wake up time after SLEEP goes high, before the first step (needs up to 1.7 ms [From DRV8825 datasheet])
+driver_wake_time = 0.002
+
+#Stepper motion engine settings
+#With the engine, step_open()/step_close() only move the target position and a separate thread makes the STEP pulses (with acceleration ramps), so the loop does not wait on the motor.
+#Without it, each step pulses STEP and sleeps for the step delay in the loop, like before.
+use_motion_engine = True
+motor_max_velocity = 1/delay_FullStep #full steps per second (same top speed the step delays gave before)
+motor_acceleration = 8000 #full steps per second per second, lower this if the motor still loses steps
+
+#GPIO write coalescing (see gpio_shadow.py)
+#Keeps a copy of the pin levels and skips writes that would not change a pin (the MODE pins every loop, DIR on every step).
+#M0/M1/M2 and DIR changes are held and written together just before the next STEP pulse, in one banked register write if use_gpio_bank and the Pi has one (Pi 1-4).
+shadow_gpio = True
+use_gpio_bank = True
+
+#Control variables
+cruise_spd = 12 #desired cruising speed in mph
+accel_rate_cap = 2.5 #mph/s --- This is the maximum acceleration rate desired. If going beyond this, throttle should be limited
+tps_deg_max_pedal_up = 0.5 #maximum amount of degrees the throttle can have when pedal is up. This may not be needed if TRS is strong enough, but stepper motor is not strong enough to guarantee to hold against TRS all the time unfortunately
+#psw_loop_allow = True #defining before while loop, used to cancel out of a loop where pedal switch is up and tps value is not changing after so many iterations of stepping the motor
+step_stop = 0 #direction the throttle is stalled in (1 opening, -1 closing), no steps are made that way while set. Set from the position observer, 0 without it
+tps_deg_stop_min = 0.2 #degrees of tps. This is used later to say if below this value, assume TPS is closed, because the TRS may not always be able to close completely due to unwinding to allow stepper motor to function.
+tps_deg_stop_max = 78 #degrees of tps. This is used later to say if above this value ,assume TPS is opened fully, because of tolerances of sensors etc. do not want to attempt to keep opening already fully open throttle
+use_step_batches = True #True: issue several steps per loop when far from desired speed (see step_planner.py). False: one step per loop
+throttle_deg_per_motor_deg = 1.0 #throttle degrees per motor degree, depends on pulley sizes (measure on the car)
+
+#Throttle position observer (see position_observer.py)
+#Predicts the throttle opening from the steps issued, so the TPS is only read when a reading is due (every loop after a surprise, up to observer_max_interval apart when
+#the readings keep agreeing), and flags a stall (steps issued, throttle not moving) or lost steps when the readings and the prediction do not agree.
+position_observer_enabled = True
+observer_tolerance_deg = 1.0 #TPS readings this close to the prediction agree with it
+observer_max_interval = 0.1 #seconds, longest time between TPS readings while the motor is still (0.02 while it moves)
+throttle_lag = 0.02 #seconds for the throttle plate to follow the cable
+
+#Control mode
+#'step' --- steps the throttle open or closed every loop depending on whether des_spd is above or below act_spd (step size from step_mode())
+#'angle' --- works out the throttle opening that should hold des_spd (feedforward map plus PI on speed error) and moves the throttle to it (see throttle_control.py)
+control_mode = 'step'
+angle_kp = 3.0 #throttle degrees per mph of speed error
+angle_ki = 0.3 #throttle degrees per mph of speed error per second
+angle_kd = 0.0 #throttle degrees per mph/s, 0 for PI control
+angle_deadband_deg = 0.3 #motor is not moved if the TPS is within this many degrees of the target angle
+
+#variables needed for printing and accel rate calculations
+print_enabled = True #print values to screen every 'print_itr_reset_count' loops (printed by the trace consumer thread, so a slow terminal does not hold up the loop)
+print_itr_reset_count = 25 #number of iterations before iterations reset for print loop, controls how often values print to screen, if that section of code not commented out
+mov_avg_itr_window = 25 #controls how many iterations are used for the moving average calculations (can be made much larger now, window updates do not slow down as it grows)
+accel_rate_method = 'endpoint' #'endpoint' uses oldest/newest values in window, 'slope' uses a least squares fit through every value in window
+step_history_max_count = 50
+
+#Loop timing (see timing.py)
+#With a loop_period every loop starts on a fixed tick, so the accel rate window gets evenly spaced samples. Loops that run over a period are counted as deadline misses.
+loop_period = None #seconds per loop (e.g. 0.002 for 500 Hz), None runs the loop as fast as it goes
+realtime_priority = None #SCHED_FIFO priority (1 to 99) for the loop, needs root. None leaves the priority alone
+cpu_affinity = None #CPUs the program may run on, e.g. {3}. None leaves it alone
+pause_gc = False #freeze the garbage collector and turn it off while the loop runs (no collection pauses in the loop)
+
+#Tracing (see loop_trace.py)
+#Records timestamped events (sensor read, conversion, step decision, GPIO write, sleep) into a preallocated ring buffer, drained by a separate thread.
+#The status lines (print_enabled) also go through the ring, so a tracer is used whenever printing is on (recording only the status/warning events unless trace_enabled),
+#otherwise tracing costs nothing when off.
+trace_enabled = False
+trace_size = 8192 #events kept in the ring buffer (about 5 per loop)
+trace_file = None #csv file to save the trace events to, None to not save
+
+#Telemetry recording (see telemetry_recorder.py)
+#Saves a record of every loop (time, raw ADC codes, act_spd, des_spd, tps_deg, psw, accel_rate, step mode and steps) to .npy files, read back with telemetry_recorder.read_telemetry()
+record_telemetry = False
+telemetry_dir = 'telemetry' #folder the files are saved in
+telemetry_records_per_file = 2**18 #records per file before a new file is started (about 10 MB per file)
+
+#Settings a cart profile may change (see apply_profile()), the others are wiring, or are set up by the program itself. A profile's value must have the setting's type.
+#Step_deg reaches the step planner, the observer and mp_runtime through setup(), plant_sim.py and replay.py read it when they are made/run, not at import.
+PROFILE_SETTINGS = ('Step_deg', 'throttle_deg_per_motor_deg', 'axle_speed_source', 'use_acquisition_engine', 'ads_data_rate', 'ads_schedule', 'ADS_RDY',
+                    'adc_filters_enabled', 'driver_wake_time', 'use_motion_engine', 'motor_max_velocity', 'motor_acceleration', 'shadow_gpio', 'use_gpio_bank',
+                    'cruise_spd', 'accel_rate_cap', 'tps_deg_max_pedal_up', 'tps_deg_stop_min', 'tps_deg_stop_max', 'use_step_batches',
+                    'position_observer_enabled', 'observer_tolerance_deg', 'observer_max_interval', 'throttle_lag',
+                    'control_mode', 'angle_kp', 'angle_ki', 'angle_kd', 'angle_deadband_deg',
+                    'print_enabled', 'print_itr_reset_count', 'mov_avg_itr_window', 'accel_rate_method', 'step_history_max_count',
+                    'loop_period', 'realtime_priority', 'pause_gc', 'trace_enabled', 'trace_size', 'record_telemetry', 'telemetry_dir', 'telemetry_records_per_file')
+
+#Set by setup() from the backend (real hardware or simulator)
+backend = None
+GPIO = None
+ADC_CHANNELS = None #ADS1115 channel objects, in channel number order
+filters = None #adc_filters.ChannelFilters, if adc_filters_enabled
+acq = None #AcquisitionEngine (background ADS1115 sampling thread, see ads_acquisition.py), if used
+motion = None #MotionEngine (stepper pulses on their own thread with acceleration ramps, see stepper_motion.py), if used
+tables = None #calibration.CalibrationTables
+planner = None #StepBatchPlanner
+controller = None #ThrottleAngleController, for the 'angle' control mode
+axle_sensor = None #EdgeSpeedSensor, if axle_speed_source is 'edges'
+observer = None #PositionObserver, if position_observer_enabled
+tracer = loop_trace.NullTracer() #loop_trace.Tracer if tracing/printing is on
+trace_consumer = None #loop_trace.TraceConsumer, prints/saves the trace events
+recorder = None #TelemetryRecorder (saves a record of every loop to binary files, see telemetry_recorder.py), if used
+ticker = None #timing.Ticker, if loop_period is set
+startup_marks = [('imports', time.perf_counter())] #(stage, time) from the start of the program to the first throttle command, see startup_report()
 #####
 
 
@@ -150,175 +262,272 @@ GPIO.output(SLEEP, 1) #enable stepper motor
 #also only if the desired speed is higher than actual speed, and also only if acceleration rate is not too high.
 
 #Functions
-def ax_spd_sens_v_to_veh_spd(): #convert axle speed sensor voltage to vehicle speed in mph
-    decimal_places = 2 #used at end to round returned value
-    rounding_integer = 5 #used at end to round returned value
-    #n_teeth = 32 #number of teeth per revolution of axle input shaft 
-    axle_speed_sensor_v_in = 3.3 #Sensor Supply Voltage
-    axle_spd_sens_volt_per_rpm = axle_speed_sensor_v_in/5500 #volts per 5500 rpm (25mph with 18" tires)
-    axle_input_rpm = axle_spd_sens.voltage/axle_spd_sens_volt_per_rpm #This line takes the input from the speed sensor
-    axle_ratio = 11.47
-    tire_dia = 18 #inch
-    f_roll_rad = 0.965 #rolling radius factor
-    tire_circ = tire_dia*math.pi*f_roll_rad 
-    tire_rpm = (axle_input_rpm)/axle_ratio
-    veh_spd_inchpermin = tire_rpm*tire_circ
-    veh_spd = veh_spd_inchpermin*((60/1)*(1/12)*(1/5280))
-    if veh_spd < 0:
-        veh_spd = 0
-    return np.around(veh_spd/rounding_integer, decimal_places)*rounding_integer #round according to first two values in function
-    
-def pps_v_to_des_spd(): #convert pedal position sensor voltage to desired speed, in mph
-    decimal_places = 2 #used at end to round returned value
-    rounding_integer = 5 #used at end to round returned value
-    pps_v_in = 3.3 #3.3 or 5 (ECU delivers 5V)
-    pps_mode = "potentiometer" #"potentiometer" or "pedal"
-    if pps_mode == "potentiometer":
-        pps_v_min = 0
-        if pps_v_in == 3.3:
-            pps_v_max = 3.3
-        elif pps_v_in == 5:
-            pps_v_max = 5
-    elif pps_mode == "pedal":
-        if pps_v_in == 3.3:
-            pps_v_min = 0.724 #measured value with HPC
-            pps_v_max = 2.81 #measured value with HPC
-        elif pps_v_in == 5:
-            pps_v_min = 1.15 #measured value with HPC
-            pps_v_max = 3.876 #measured value with HPC
+def setup(hw): #set up the pins, engines and tables for a backend (hal.RealBackend() on the Pi, hal.SimBackend() for the simulator)
+    global backend, GPIO, ADC_CHANNELS, filters, acq, motion, tables, planner, controller, axle_sensor, observer, tracer, trace_consumer, recorder, ticker
+    backend = hw
+    GPIO = hw.gpio #the backend opens the hardware the first time it is used
+    if shadow_gpio:
+        GPIO = gpio_shadow.ShadowGPIO(hw.gpio, MODE + (DIR,), (STEP,), hw.gpio_bank() if use_gpio_bank else None)
+    #GPIO Setup
+    GPIO.setmode(GPIO.BCM) #Set Pins to use the GPIO labels/broadcom labeling system instead of physical pin assignment
+    GPIO.setup(DIR, GPIO.OUT) #Direction Pin on Pi is set to an output pin
+    GPIO.setup(STEP, GPIO.OUT) #Step Pin on Pi is set to an output pin
+    GPIO.setup(MODE, GPIO.OUT) #Set mode pin on Pi as an output.
+    GPIO.setup(SLEEP, GPIO.OUT) #Set sleep pin on Pi as an output pin.
+    GPIO.output(DIR, CW) #Direction set to CW initially (Rpi pulls DIR pin high?) 
+    GPIO.output(SLEEP, 1) #enable stepper motor
+    #Axle speed from tooth edges
+    if axle_speed_source not in ('adc', 'edges'):
+        raise ValueError("axle_speed_source must be 'adc' or 'edges'")
+    axle_sensor = None
+    schedule = ads_schedule
+    if axle_speed_source == 'edges':
+        axle_sensor = EdgeSpeedSensor(cal, clock = hw.now)
+        axle_sensor.attach(GPIO, AXLE_EDGE_PIN)
+        schedule = tuple(ch for ch in ads_schedule if ch != AXLE_CH) #axle channel no longer needs sampling
+    filter_config = adc_filters
+    if position_observer_enabled and not (use_acquisition_engine and hw.realtime): #the observer only reads the TPS now and then, and smooths the readings itself
+        filter_config = {ch: specs for ch, specs in adc_filters.items() if ch != TPS_CH}
+    filters = ChannelFilters(filter_config, hw.adc_gain) if adc_filters_enabled else None
+    #ADS1115 acquisition engine (needs real time, so not used with the simulator)
+    acq = None
+    if use_acquisition_engine and hw.realtime:
+        acq = hw.acquisition(schedule, ads_data_rate, ADS_RDY, filters) #engine runs the filters on every sample
+    ADC_CHANNELS = hw.adc_channels if acq is None else None #channels for blocking reads, only opened if the engine is not used
+    #Stepper motion engine (simulator makes its pulses as simulated time passes, instead of on a thread)
+    motion = None
+    if use_motion_engine:
+        motion = hw.motion_engine(GPIO, STEP, DIR, MODE, motor_max_velocity, motor_acceleration, CW, CCW)
+    observer = None
+    if position_observer_enabled:
+        observer = observer_for(Step_deg, throttle_deg_per_motor_deg, 0.0, cal['deg_throttle_max'], lag = throttle_lag, tolerance_deg = observer_tolerance_deg, max_interval = observer_max_interval)
+    planner = StepBatchPlanner(STEP_DELAY, Step_deg, tps_deg_stop_min, tps_deg_stop_max, accel_rate_cap, throttle_deg_per_motor_deg)
+    if control_mode not in ('step', 'angle'):
+        raise ValueError("control_mode must be 'step' or 'angle'")
+    controller = None
+    if control_mode == 'angle':
+        controller = ThrottleAngleController(cal['ff_spd_mph'], cal['ff_throttle_deg'], angle_kp, angle_ki, angle_kd, tps_deg_stop_min, tps_deg_stop_max, accel_rate_cap)
+    #lookup tables from raw ADS1115 code to speed/degrees, so the loop does not redo the conversion math every time (loaded from the cache if they were built before)
+    if table_cache_dir is not None:
+        tables = profiles.cached_tables(cal, cruise_spd, hw.adc_gain, table_cache_dir)
+    else:
+        tables = calibration.CalibrationTables(cal, cruise_spd, hw.adc_gain)
+    mark_startup('tables')
+    #Tracing, the consumer thread does the printing/saving
+    handlers = []
+    if print_enabled:
+        handlers.append(loop_trace.StatusPrinter())
+    if trace_enabled and trace_file is not None:
+        handlers.append(loop_trace.CsvTraceWriter(trace_file))
+    if trace_enabled:
+        tracer = loop_trace.Tracer(trace_size, hw.now)
+    elif print_enabled:
+        tracer = loop_trace.Tracer(trace_size, hw.now, loop_trace.PRINT_KINDS) #per loop events are not needed just for printing
     else:
-        print ("Error with pps_v_to_des_spd function")
-    #This next section creates a non-linear map for pedal position vs speed desired
-    pps_percent = (pps.voltage - pps_v_min) / (pps_v_max - pps_v_min) * 100
-    pedalspeedmap_pedalpos=np.arange(0,101,5) #create an array from 0 to 100
-    #pedalspeedmap_speed=[0,.25,.6,1,1.5,2.1,2.7,3.35,4,4.65,5.4,6.1,6.9,7.7,8.5,9.3,10.1,10.8,11.4,11.8,12]
-    pedalspeedmap_speed_percentage=[0,0.02,0.05,0.085,0.125,0.175,0.225,0.28,0.333,0.3875,0.45,0.51,0.575,0.64,0.71,0.775,0.84,0.9,0.95,0.98,1]
-    pedalspeedmap_speed = np.multiply(pedalspeedmap_speed_percentage, cruise_spd)
-    des_spd = np.interp(pps_percent, pedalspeedmap_pedalpos, pedalspeedmap_speed) #linear interpolation of speed map
+        tracer = loop_trace.NullTracer()
+    trace_consumer = loop_trace.TraceConsumer(tracer, handlers) if handlers else None
+    recorder = hw.telemetry_recorder(telemetry_dir, telemetry_records_per_file) if record_telemetry else None
+    ticker = timing.Ticker(loop_period, hw.now, hw.sleep) if loop_period else None #uses the backend's time, so it works with the simulator too
+    mark_startup('setup')
+
+def shutdown(): #stop engines, disable stepper motor and cleanup GPIO pins
+    if trace_consumer is not None:
+        trace_consumer.stop() #prints/saves whatever is left in the trace ring
+    if recorder is not None:
+        recorder.close() #saves the last records and closes the file
+    if acq is not None:
+        acq.stop() #stop background sampling thread
+    if motion is not None:
+        motion.stop() #stop stepper pulse thread before disabling motor
+    GPIO.output(SLEEP, GPIO.LOW) #disable stepper motor (to keep from getting hot unneccesarily)
+    if axle_sensor is not None:
+        axle_sensor.detach(GPIO, AXLE_EDGE_PIN)
+    GPIO.cleanup() #reset GPIO pins to inputs to protect against shorting accidentally
+    backend.close()
+
+def profile_changes(name, directory = profiles.PROFILE_DIR): #a cart profile's (calibration changes, settings changes), checked against PROFILE_SETTINGS and the types of the settings they replace
+    cal_changes, settings = profiles.load_profile(name, directory)
+    names = globals()
+    for key, value in settings.items():
+        if key not in PROFILE_SETTINGS:
+            raise KeyError("setting can not be changed by a profile (see PROFILE_SETTINGS), in profile " + name + ": " + key)
+        if not _same_type(value, names[key]):
+            raise TypeError("wrong type for setting " + key + " in profile " + name + ": " + repr(value) + " (setting is " + repr(names[key]) + ")")
+    return cal_changes, settings
+
+def _same_type(value, default): #profile value can replace the default: same type, an int for a float, a number for a setting that is None until set, a tuple of the same types
+    if isinstance(default, bool) or isinstance(value, bool):
+        return isinstance(value, bool) and isinstance(default, bool)
+    if default is None:
+        return value is None or isinstance(value, (int, float))
+    if isinstance(default, float):
+        return isinstance(value, (int, float))
+    if isinstance(default, tuple):
+        return isinstance(value, tuple) and (not default or all(_same_type(v, default[0]) for v in value))
+    return type(value) is type(default)
+
+def apply_profile(name, directory = profiles.PROFILE_DIR): #use a cart profile's calibration values and settings (see profiles.py)
+    global profile
+    cal_changes, settings = profile_changes(name, directory)
+    globals().update(settings)
+    cal.update(cal_changes)
+    profile = name
+
+def mark_startup(stage): #note the time a startup stage finished
+    startup_marks.append((stage, time.perf_counter()))
+
+def startup_report(): #list of (stage, seconds since the program started) up to the first throttle command
+    start = timing.process_start()
+    if start is None:
+        start = startup_marks[0][1] #process start not known, count from the end of the imports
+    return [(stage, t - start) for stage, t in startup_marks]
+
+def read_code(ch): #raw ADS1115 code of a channel (latest sample from acquisition engine, or a blocking read if engine not used), filtered if adc_filters_enabled
+    if acq is not None:
+        return acq.code(ch)
+    if filters is not None:
+        return filters.read(ch, ADC_CHANNELS[ch])
+    return ADC_CHANNELS[ch].value
+
+#Voltage conversions, how the loop used to read every sensor (a voltage read per call, then the math in calibration.py).
+#The loop does not use these, it reads a frame through the lookup tables (read_frame). They are kept as the baseline loop_bench.py times the tables against.
+def read_voltage(ch): #voltage of an ADS1115 channel (latest sample from acquisition engine, or a blocking read if engine not used)
+    if acq is not None:
+        return acq.voltage(ch)
+    return ADC_CHANNELS[ch].voltage
+
+def ax_spd_sens_v_to_veh_spd(): #convert axle speed sensor voltage to vehicle speed in mph (see calibration.py for the math and calibration values)
+    if axle_sensor is not None:
+        return axle_sensor.veh_spd() #speed from tooth edges instead
+    return calibration.axle_v_to_veh_spd(read_voltage(AXLE_CH), cal)
+    
+def pps_v_to_des_spd(): #convert pedal position sensor voltage to desired speed, in mph (non-linear pedal map, see calibration.py)
+    return calibration.pps_v_to_des_spd(read_voltage(PPS_CH), cruise_spd, cal)
 #   #The below method uses a curve fit instead of linear interpolation
 #     x=pedalspeedmap_pedalpos
 #     y=pedalspeedmap_speed
 #     curve=np.polyfit(x,y,3)
 #     poly = np.poly1d(curve)
 #     des_spd = poly(pps_percent)
-#
-    if des_spd < 0:
-        des_spd = 0
-    else:
-        des_spd = np.around(des_spd/rounding_integer, decimal_places)*rounding_integer #round according to first two values in function
-    #
-    return des_spd
 
 def tps_v_to_deg_throttle(): #convert throttle position sensor voltage to deg of opening
-    tps_voltage = tps.voltage #Storing TPS voltage as variable so that everything is evalauted from same value within this function
-    tps_v_in = 5 #volts --- Input either 3.3 or 5. On Vehicle, ECU delivers 5 V
-    deg_throttle_min = 0
-    deg_throttle_max = 80 #may be 82, see variation here from throttle body to throttle body
-    if tps_v_in == 3.3: #3.3V Input to Throttle Body
-        tps_v_min = 0.41 #Fully Closed throttle signal reading
-        tps_v_max = 2.53 #Fully Open Throttle signal reading
-    elif tps_v_in == 5: #5V Input to Throttle Body
-        tps_v_min = 0.652 #Fully Closed throttle signal reading 
-        tps_v_max = 3.865 #Fully Open Throttle signal reading
-    else:
-        print("Error with tps_v_to_deg_throttle function")
-    #
-    if tps_voltage < tps_v_min: #in case tps signal is slightly lower from throttle body, round to tps_v_min for now
-        tps_voltage = tps_v_min
-    elif tps_voltage > tps_v_max: #in case tps signal is slightly higher from throttle body to throttle body, round to tps_v_max value for now
-        tps_voltage = tps_v_max
-    #
-    deg_throttle = 0+(tps_voltage-tps_v_min)*(deg_throttle_max-deg_throttle_min)/(tps_v_max-tps_v_min) #linear interpolation
-    if deg_throttle == -0: #was seeing negative zero sometimes, did not want to see negative zero. did not want to use abs() in case it goes below negative zero I would want to see it in testing.
-        deg_throttle = 0
-    #
-    return deg_throttle
-
-def spd_error(): #calculates the difference between desired speed and actual speed
-    diff = des_spd - act_spd #Positive Value indicates user commanding to go faster
-    return diff
-
-def step_mode(): #Allows the motor driver to control microstepping, depending upon how close actual and desired speeds are, in order for throttle control to be more precise vs quick
-    diff = abs(spd_error())
-    if diff < 1:
-        step_mode = '1/64'
-    elif diff < 2.5:
-        step_mode = '1/32'
-    elif diff < 3:
-        step_mode = '1/16'
-    elif diff < 3.5:
-        step_mode = '1/8'
-    elif diff < 4:
-        step_mode = '1/4'
-    elif diff < 5:
-        step_mode = 'Half'
-    else:
-        step_mode = 'Full'
-    return step_mode
-
-def step_mode_pedal_up(): #function to control speed at which throttle closes when pedal up/throttle open loop is active
-    tps_deg = tps_v_to_deg_throttle()
-    diff = tps_deg - tps_deg_max_pedal_up
-    if diff < 0.1:
-        step_mode = '1/64'
-    elif diff < 0.25:
-        step_mode = '1/32'
-    elif diff < 0.5:
-        step_mode = '1/16'
-    elif diff < 1:
-        step_mode = '1/8'
-    elif diff < 3:
-        step_mode = '1/4'
-    elif diff < 5:
-        step_mode = 'Half'
+    return calibration.tps_v_to_deg(read_voltage(TPS_CH), cal)
+
+def pedalswitchstate(): #returns the pedal switch state (Pedal Up = 0 ; Pedal Down = 1)
+    return calibration.psw_v_to_state(read_voltage(PSW_CH), cal)
+
+def read_frame(): #capture every sensor exactly once for this loop (see sensor_frame.py). Everything else in the loop works from this frame.
+    now = backend.now()
+    act_spd = axle_sensor.veh_spd(now) if axle_sensor is not None else None #speed from tooth edges, axle channel is then not read
+    tps_deg = None
+    if observer is not None:
+        if motion is not None:
+            observer.set_position(motion.position, now) #pulses the engine has made so far
+        if not observer.due(now):
+            tps_deg = observer.predict(now) #TPS channel is then not read
+    if acq is not None:
+        frame = frame_from_snapshot(acq.snapshot(), now, tables, tps_deg_max_pedal_up, PPS_CH, AXLE_CH, TPS_CH, PSW_CH, act_spd, tps_deg)
     else:
-        step_mode = 'Full'
-    return step_mode  
+        frame = capture_frame(read_code, now, tables, tps_deg_max_pedal_up, PPS_CH, AXLE_CH, TPS_CH, PSW_CH, act_spd, tps_deg)
+    if observer is not None and tps_deg is None:
+        observer.correct(now, frame.tps_deg)
+    return frame
+
+def spd_error(frame): #calculates the difference between desired speed and actual speed
+    return frame.spd_error #Positive Value indicates user commanding to go faster
+
+def step_mode(frame): #Allows the motor driver to control microstepping, depending upon how close actual and desired speeds are, in order for throttle control to be more precise vs quick (see step_mode_for_error in sensor_frame.py)
+    return frame.step_mode
 
-def delay(arg = None): #Controls the delay between steps of stepper motor (optional 'pedal_up' argument)
-    delay_FullStep = 0.00125 #Time to dealay between each step, if full stepping
-    if arg == None: #Assign STEP_MODE to variable so it does not iterate through function each time below
-        STEP_MODE = step_mode()
+def step_mode_pedal_up(frame): #function to control speed at which throttle closes when pedal up/throttle open loop is active (uses the frame's tps reading, no new read)
+    return frame.step_mode_pedal_up
+
+def delay(frame, arg = None): #Controls the delay between steps of stepper motor (optional 'pedal_up' argument)
+    if arg == None:
+        return frame.step_delay
     elif arg == 'pedal_up':
-        STEP_MODE = step_mode_pedal_up()
-    else:
-        print("delay function error, enter no arguments, or enter 'pedal_up' as argument")
-    if STEP_MODE == 'Full':
-        delay = delay_FullStep
-    elif STEP_MODE == 'Half':
-        delay = delay_FullStep/2
-    elif STEP_MODE == '1/4':
-        delay = delay_FullStep/4
-    elif STEP_MODE == '1/8':
-        delay = delay_FullStep/8
-    elif STEP_MODE == '1/16':
-        delay = delay_FullStep/16
-    elif STEP_MODE == '1/32':
-        delay = delay_FullStep/32
-    elif STEP_MODE == '1/64':
-        delay = delay_FullStep/64
-    if delay < 0.000002:
-        delay = 0.000002 #min delay of 2 microseconds
-    return delay
+        return frame.step_delay_pedal_up
+    raise ValueError("delay function error, enter no arguments, or enter 'pedal_up' as argument")
 
-def pedalswitchstate(): #returns the pedal switch state (Pedal Up = 0 ; Pedal Down = 1)
-    if pedalswitch.voltage > 1.5: #Check voltage from pedal switch
-        psw = 1
+def set_step_mode(mode): #sets full/microstepping mode pins (see 'RESOLUTION' dictionary)
+    tracer.event(loop_trace.GPIO_WRITE, mode)
+    if motion is not None:
+        motion.set_mode(mode) #engine changes the pins between pulses
     else:
-        psw = 0
-    return psw
-    
-def step_open(): #moves the stepper motor 'forward' one step
+        GPIO.output(MODE, RESOLUTION[mode])
+
+def step_count(frame, direction, mode, accel_rate, move_queued = False): #number of steps to issue this loop (1 per loop unless step batches are used, see step_planner.py)
+    if not use_step_batches or move_queued: #move_queued: a batch is still being stepped out, the TPS has not caught up with it yet, so only the one step per loop until it is done
+        return 1
+    tps_deg = frame.tps_deg
+    if motion is not None:
+        tps_deg += (motion.target - motion.position)*planner.deg_per_pulse('1/64') #plan from where the queued steps leave the throttle
+    return abs(planner.plan(direction, tps_deg, frame.spd_error, mode, accel_rate).steps)
+
+def limit_travel(frame): #keeps the motion engine target between tps_deg_stop_min and tps_deg_stop_max (worked out from this loop's TPS reading)
+    deg_per_tick = planner.deg_per_pulse('1/64')
+    position = motion.position
+    motion.set_limits(min(position, position - int((frame.tps_deg - tps_deg_stop_min)/deg_per_tick)), #never past the current position, the cable can be slack below closed
+                      max(position, position + int((tps_deg_stop_max - frame.tps_deg)/deg_per_tick)))
+
+def step_open(frame, steps = 1): #moves the stepper motor 'forward' by a number of steps (1 by default)
+    tracer.event(loop_trace.STEP_DECISION, steps)
+    if motion is not None:
+        motion.move_steps(steps) #steps in the current mode, engine makes the pulses
+        return
     GPIO.output(DIR, CW)
-    GPIO.output(STEP, GPIO.HIGH)
-    GPIO.output(STEP, GPIO.LOW)
-    sleep(delay())
-
-def step_close(): #moves the stepper motor 'backward' one step
+    for i in range(steps):
+        GPIO.output(STEP, GPIO.HIGH)
+        GPIO.output(STEP, GPIO.LOW)
+        start = tracer.begin()
+        backend.sleep(delay(frame))
+        tracer.end(loop_trace.SLEEP, start)
+
+def step_close(frame, steps = 1): #moves the stepper motor 'backward' by a number of steps (1 by default)
+    tracer.event(loop_trace.STEP_DECISION, -steps)
+    if motion is not None:
+        motion.move_steps(-steps)
+        return
     GPIO.output(DIR, CCW)
-    GPIO.output(STEP, GPIO.HIGH)
-    GPIO.output(STEP, GPIO.LOW)
-    sleep(delay())
+    for i in range(steps):
+        GPIO.output(STEP, GPIO.HIGH)
+        GPIO.output(STEP, GPIO.LOW)
+        start = tracer.begin()
+        backend.sleep(delay(frame))
+        tracer.end(loop_trace.SLEEP, start)
+
+def check_stall(): #stall check: the position observer compares the steps issued against the TPS readings (the history windows could not tell a stall from TPS noise), sets step_stop
+    global step_stop
+    if observer is not None and observer.stalled != step_stop:
+        step_stop = observer.stalled
+        if step_stop:
+            tracer.event(loop_trace.WARNING, "Throttle not following the stepper motor, steps " + ("opening" if step_stop > 0 else "closing") + " the throttle stopped")
+            if motion is not None:
+                motion.halt() #drop the rest of the move (slowing down to a stop, inside this loop's travel limits), MotionEngine or the mp_runtime.py proxy
+
+def drive_to_angle(frame, accel_rate): #'angle' control mode: moves the throttle toward the controller's target opening, returns (steps issued, step mode)
+    if frame.psw == 0: #pedal switch open, close the throttle
+        controller.reset()
+        target = tps_deg_stop_min
+    else:
+        target = controller.update(frame.des_spd, frame.act_spd, frame.timestamp, frame.tps_deg, accel_rate)
+    error = target - frame.tps_deg
+    if abs(error) < angle_deadband_deg or (frame.psw == 0 and frame.tps_deg <= tps_deg_stop_min) or (step_stop and (error > 0) == (step_stop > 0)):
+        tracer.event(loop_trace.STEP_DECISION, 0)
+        return 0, frame.step_mode
+    if motion is not None and motion.is_moving(): #the TPS lags behind the motor while it moves, so the next move is worked out once this one is done
+        tracer.event(loop_trace.STEP_DECISION, 0)
+        return 0, motion.requested_mode
+    mode = 'Full' if frame.psw == 0 else step_mode_for_pedal_up(abs(error)) #coarsest mode for the degrees to go
+    set_step_mode(mode)
+    steps = max(int(abs(error)/planner.deg_per_pulse(mode)), 1)
+    if motion is None: #steps are made in the loop, keep them within one loop's time
+        steps = min(steps, planner.max_steps_per_cycle, max(int(planner.cycle_budget/STEP_DELAY[mode]), 1))
+    if error > 0:
+        step_open(frame, steps)
+        return steps, mode
+    step_close(frame, steps)
+    return -steps, mode
 
 #End of functions
 
@@ -326,98 +535,135 @@ def step_close(): #moves the stepper motor 'backward' one step
 
 
 
-#enter a forever while loop, until 'CTRL+c' keyboard interrupt occurs, then cleanup GPIO pins
-try:   
-    print("Program Begun ; Press 'CNRL+c' to stop program and cleanup GPIO Pins")
-    
-    #variables
-    cruise_spd = 12 #desired cruising speed in mph
-    accel_rate_cap = 2.5 #mph/s --- This is the maximum acceleration rate desired. If going beyond this, throttle should be limited
-    tps_deg_max_pedal_up = 0.5 #maximum amount of degrees the throttle can have when pedal is up. This may not be needed if TRS is strong enough, but stepper motor is not strong enough to guarantee to hold against TRS all the time unfortunately
-    #psw_loop_allow = True #defining before while loop, used to cancel out of a loop where pedal switch is up and tps value is not changing after so many iterations of stepping the motor
-    step_stop = False
-    tps_deg_stop_min = 0.2 #degrees of tps. This is used later to say if below this value, assume TPS is closed, because the TRS may not always be able to close completely due to unwinding to allow stepper motor to function.
-    tps_deg_stop_max = 78 #degrees of tps. This is used later to say if above this value ,assume TPS is opened fully, because of tolerances of sensors etc. do not want to attempt to keep opening already fully open throttle
-    
-    #variables needed for printing and accel rate calculations
-    accel_rate = 0 # setting initial acceleration rate, in mph/s, set to 0 until enough data to change
-    itr = 0 #counter of iterations of while loop below, setting to 0 initially
-    print_itr_reset_count = 25 #number of iterations before iterations reset for print loop, controls how often values print to screen, if that section of code not commented out
-    mov_avg_itr_window = 25 #controls how many iterations are used for the moving average calculations
-    veh_spd_list = [] #creates an empty list of vehicle speeds, to be used later to find average accel rate
-    time_list = [] #creates an empty list of times, to be used later for caclulating accel rates
-    step_history = [] #creates an empty list of what the stepper motor steps have been, to be used later for making sure later if lots of steps occur, throttle actually moves
-    step_history_max_count = 50
-    tps_history = [] #creates an empty list of what the tps value has been, to be used later for making sure later if lots of steps occur, throttle actually moves
-    
-    sleep(0.1) #wait some time to be sure sleep pin is activated
-    
-    while True:
-        #get the current values of the sensors, and convert to useful numbers
-        act_spd = ax_spd_sens_v_to_veh_spd()#gets voltage reading from axle input shaft speed sensor and converts to vehicle speed in mph
-        des_spd = pps_v_to_des_spd() #Converts voltage reading to desired vehicle speed in mph
-        tps_deg = tps_v_to_deg_throttle() #throttle opening in degrees, used to determine if throttle already at max/min limits before moving stepper motor further             
-        psw = pedalswitchstate() #pedal switch position (Pedal Up = 0; Pedal Down = 1)
-        
-        #Setup microstepping mode
-        GPIO.output(MODE, RESOLUTION[step_mode()]) #Sets full/microstepping up. See 'RESOLUTION' dictionary. This is used in order to change the speed at which the throttle will move, so that near cruising speeds it can be more fine tuned, etc.
+def run(hw, max_cycles = None, duration = None): #runs the control loop until 'CTRL+c' keyboard interrupt occurs (or max_cycles loops / duration seconds have passed), then cleanup GPIO pins
+    global step_stop
+    setup(hw)
+    gc_state = None
+    step_stop = 0
+    try:   
+        if print_enabled:
+            print("Program Begun ; Press 'CNRL+c' to stop program and cleanup GPIO Pins")
         
-        #Calculate acceleration rate (the time period is controlled by the iterations 'mov_avg_itr_window' size now, but can change to wait for difference to be over some value...
-        veh_spd_list.append(act_spd)  #add current vehicle speed to vehicle speed list
-        time_list.append(time.perf_counter()) #add current time to time list
-        #the following if statement can probably be removed once program seems finalized
-        if len(veh_spd_list) != len(time_list): #warn if lists are not equal length
-             print("vehicle speed list length does not match time list length")
-             break
-        if des_spd > 1 and psw == 0: #checks for non-agreeing pedal switch/sensor values. Not set to zero because of sensor/switch/pedal tolerances.
-            print("Pedal switch open but desired speed not near zero")
-        if len(veh_spd_list) >= mov_avg_itr_window:  #allow list length to build before removing old data
-            veh_spd_list = veh_spd_list[1:] #remove the oldest speed in list
-            time_list = time_list[1:] #remove the oldest time in list        
-            accel_rate = (veh_spd_list[-1]-veh_spd_list[0])/(time_list[-1]-time_list[0]) #calculate accel rate from oldest and newest speed and time values in lists
-            # confirmed accel rate calculated correctly, but need to look into the time delta of this.
-            # may want to have statement to only calculate if time difference is a certain delta or greater? perhaps 5 Hz?      
+        #variables needed for printing and accel rate calculations
+        accel_rate = 0 # setting initial acceleration rate, in mph/s, set to 0 until enough data to change
+        itr = 0 #counter of iterations of while loop below, setting to 0 initially
+        cycles = 0 #total loops, for max_cycles
+        spd_window = SpeedWindow(mov_avg_itr_window - 1) #window of vehicle speeds and times, to be used later to find average accel rate (window keeps the newest 'mov_avg_itr_window - 1' values, same as the old lists did)
+        step_history = HistoryWindow(step_history_max_count - 1, np.int8) #what the stepper motor steps have been, to be used later for making sure later if lots of steps occur, throttle actually moves
+        tps_history = HistoryWindow(step_history_max_count - 1) #what the tps value has been, to be used later for making sure later if lots of steps occur, throttle actually moves
+        tps_history_same = False
+        step_history_same = False
         
+        if acq is not None:
+            acq.start() #start background sampling, returns once every channel has a sample
+        if motion is not None and hw.realtime:
+            motion.start() #start stepper pulse thread
+        if trace_consumer is not None:
+            trace_consumer.start() #start printing/saving trace events
+        if recorder is not None:
+            recorder.start() #start telemetry writer thread
+        hw.sleep(driver_wake_time) #wait to be sure sleep pin is activated
+        if hw.realtime and (realtime_priority is not None or cpu_affinity is not None):
+            failed = timing.set_realtime(realtime_priority, cpu_affinity)
+            if failed and print_enabled:
+                print("Could not set:", ", ".join(failed), "(real time priority needs root)")
+        gc_state = timing.gc_pause() if pause_gc else None
+        mark_startup('engines')
+        end_time = None if duration is None else hw.now() + duration
         
-        
-        #This section for moving stepper motor --- steps motor forward or backward by 1 step (or does nothing if delta beteen des_deg & act_deg are less than the degrees per step, as to eliminate cycling back and forth 1 step constantly)
-        if des_spd > act_spd and tps_deg < tps_deg_stop_max and accel_rate < accel_rate_cap and psw == 1:  #want to go faster, not hitting max throttle or accel rate cap
-            step_open()
-            step_history.append(1)  #1 indicates movement forward
-            tps_history.append(round(tps_deg,1))
-        elif des_spd > act_spd and tps_deg > tps_deg_stop_min and accel_rate > accel_rate_cap and psw == 1: #want to go faster, but hitting acccel rate cap
-            step_close()
-            step_history.append(-1) #-1 indicates movement backwards
-            tps_history.append(round(tps_deg,1))
-        elif des_spd < act_spd and tps_deg > tps_deg_stop_min and psw == 1: #vehicle going faster than desired, close throttle
-            step_close()
-            step_history.append(-1) #-1 indicates movement backwards
-            tps_history.append(round(tps_deg,1))
-        elif psw == 0 and tps_deg > tps_deg_stop_min: #if pedal switch is open, close throttle
-            GPIO.output(MODE, RESOLUTION['Full']) #changes the stepping mode to full to close the throttle as quickly as possible, as there may be an issue.
-            step_close()
-            step_history.append(-1)#-1 indicates movement backwards
-            tps_history.append(round(tps_deg,1))
-        else: #do not move throttle, but need to update step history list etc.
-            step_history.append(0) #0 indicates no movement
-            tps_history.append(round(tps_deg,1))
-            #now we have a list of the movements of the stepper motor over a recent short amount of time
-        
-        if len(step_history) >= step_history_max_count: #make sure step history list does not get too long
-            step_history = step_history[1:]
-            tps_history = tps_history[1:]
-            if tps_history.count(tps_history[0]) >= len(tps_history):
-                tps_history_same = True
-            else:
-                tps_history_same = False
-            if step_history.count(step_history[0]) >= len(step_history): #if the first element in step history list exist for all of the elements (length of) the list
-                step_history_same = True
-#Have not been able to get the step_stop to operate correctly for some reason...need to see if can fix or find alternate method              
-             
+        while True:
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+            if end_time is not None and hw.now() >= end_time:
+                break
+            if ticker is not None:
+                ticker.wait() #wait for the next tick
+            cycles += 1
+            hw.cycle()
+            tracer.event(loop_trace.CYCLE, cycles)
+            
+            #get the current values of the sensors (each channel read once), and convert to useful numbers (raw ADC codes are looked up in the calibration tables, same results as the conversion functions above)
+            tables.set_cruise_spd(cruise_spd) #only rebuilds the pedal table if cruise_spd was changed
+            start = tracer.begin()
+            frame = read_frame()
+            tracer.end(loop_trace.SENSOR_READ, start)
+            start = tracer.begin()
+            act_spd = frame.act_spd #axle input shaft speed sensor converted to vehicle speed in mph
+            des_spd = frame.des_spd #pedal position converted to desired vehicle speed in mph
+            tps_deg = frame.tps_deg #throttle opening in degrees, used to determine if throttle already at max/min limits before moving stepper motor further             
+            psw = frame.psw #pedal switch position (Pedal Up = 0; Pedal Down = 1)
+            tracer.end(loop_trace.CONVERSION, start)
+            
+            #Setup microstepping mode
+            mode = step_mode(frame)
+            if control_mode == 'step':
+                set_step_mode(mode) #Sets full/microstepping up. See 'RESOLUTION' dictionary. This is used in order to change the speed at which the throttle will move, so that near cruising speeds it can be more fine tuned, etc.
+            
+            #Calculate acceleration rate (the time period is controlled by the iterations 'mov_avg_itr_window' size now, but can change to wait for difference to be over some value...
+            spd_window.push(frame.timestamp, act_spd) #add current time and vehicle speed to window (oldest pair is dropped once window is full)
+            if des_spd > 1 and psw == 0: #checks for non-agreeing pedal switch/sensor values. Not set to zero because of sensor/switch/pedal tolerances.
+                tracer.event(loop_trace.WARNING, "Pedal switch open but desired speed not near zero") #printed by the trace consumer
+            if spd_window.rolled:  #allow window to fill before calculating (from the 'mov_avg_itr_window'th loop on, the old lists appended that speed then dropped the oldest)
+                accel_rate = spd_window.rate(accel_rate_method) #calculate accel rate from speed and time values in window
+                # confirmed accel rate calculated correctly, but need to look into the time delta of this.
+                # may want to have statement to only calculate if time difference is a certain delta or greater? perhaps 5 Hz?      
+            
+            
+            
+            #This section for moving stepper motor --- steps motor forward or backward (1 step, or a batch of steps if use_step_batches) (or does nothing if delta beteen des_deg & act_deg are less than the degrees per step, as to eliminate cycling back and forth 1 step constantly)
+            steps = 0 #steps issued this loop (positive opens, negative closes), for the telemetry recorder
+            move_queued = False #motion engine still stepping out an earlier move (recorded, so the replay can tell why there was no batch)
+            if motion is not None:
+                limit_travel(frame) #queued steps can not take the throttle past its stops
+                move_queued = motion.is_moving()
+            if control_mode == 'angle': #move the throttle toward the target opening (see drive_to_angle)
+                steps, mode = drive_to_angle(frame, accel_rate)
+                step_history.push((steps > 0) - (steps < 0))
+                tps_history.push(round(tps_deg,1))
+            elif des_spd > act_spd and tps_deg < tps_deg_stop_max and accel_rate < accel_rate_cap and psw == 1 and step_stop != 1:  #want to go faster, not hitting max throttle or accel rate cap
+                steps = step_count(frame, 1, mode, accel_rate, move_queued)
+                step_open(frame, steps)
+                step_history.push(1)  #1 indicates movement forward
+                tps_history.push(round(tps_deg,1))
+            elif des_spd > act_spd and tps_deg > tps_deg_stop_min and accel_rate > accel_rate_cap and psw == 1 and step_stop != -1: #want to go faster, but hitting acccel rate cap
+                steps = -step_count(frame, -1, mode, accel_rate, move_queued)
+                step_close(frame, -steps)
+                step_history.push(-1) #-1 indicates movement backwards
+                tps_history.push(round(tps_deg,1))
+            elif des_spd < act_spd and tps_deg > tps_deg_stop_min and psw == 1 and step_stop != -1: #vehicle going faster than desired, close throttle
+                steps = -step_count(frame, -1, mode, accel_rate, move_queued)
+                step_close(frame, -steps)
+                step_history.push(-1) #-1 indicates movement backwards
+                tps_history.push(round(tps_deg,1))
+            elif psw == 0 and tps_deg > tps_deg_stop_min and step_stop != -1: #if pedal switch is open, close throttle
+                mode = 'Full'
+                set_step_mode(mode) #changes the stepping mode to full to close the throttle as quickly as possible, as there may be an issue.
+                steps = -step_count(frame, -1, mode, accel_rate, move_queued)
+                step_close(frame, -steps)
+                step_history.push(-1)#-1 indicates movement backwards
+                tps_history.push(round(tps_deg,1))
+            else: #do not move throttle, but need to update step history list etc.
+                tracer.event(loop_trace.STEP_DECISION, 0)
+                step_history.push(0) #0 indicates no movement
+                tps_history.push(round(tps_deg,1))
+                #now we have a list of the movements of the stepper motor over a recent short amount of time
+            
+            if observer is not None and motion is None:
+                observer.move(steps*ticks_per_pulse(mode), backend.now()) #steps made in the loop (the engine's pulses are counted in read_frame)
+            if recorder is not None:
+                recorder.record_frame(cycles, frame, accel_rate, mode, steps, step_stop, move_queued) #one struct copy, the recorder thread writes it to disk
+            if cycles == 1:
+                mark_startup('first_command') #first throttle decision made, the loop is in control
             
+            if step_history.full(): #window only holds the newest values, so it can not get too long
+                tps_history_same = tps_history.all_same()
+                step_history_same = step_history.all_same() #if the first element in step history exists for all of the elements of the window
+            check_stall()
+                 
+                
 
 
-        
+            
 #         #Loop to check if pedal is up, and then close throttle if not already closed
 # #The following section I have not been able to figure out yet. I want only x iterations to occur, but not to jump back into the loop after it has been broken, unless the throttle has went past a certain degree since then
 #        psw_loop_cancel = False #used to make sure not cycling in/out of below while loop continually
@@ -428,50 +674,93 @@ try:
 #        while (psw == 0) and (tps_deg > tps_deg_max_pedal_up) and (psw_loop_allow == True): #if the pedal switch is open, and throttle is still open, close throttle (did not make 0 in case reading is not exactly 0 when at throttle stop)
 #            if psw_loop_itr >= psw_loop_itr_max:
 #                psw_loop_allow = False
-#            GPIO.output(MODE, RESOLUTION[step_mode_pedal_up()]) #changes the stepping mode according to the step_mode_pedal_up function
+#            GPIO.output(MODE, RESOLUTION[step_mode_pedal_up(frame)]) #changes the stepping mode according to the step_mode_pedal_up function
 #            GPIO.output(DIR, CCW)
 #            GPIO.output(STEP, GPIO.HIGH)
 #            GPIO.output(STEP, GPIO.LOW)
-#            sleep(delay('pedal_up'))
+#            sleep(delay(frame, 'pedal_up'))
 #            psw_loop_itr += 1 #add iteration to psw loop iteration counter
-#            tps_deg = tps_v_to_deg_throttle()
+#            frame = read_frame()
+#            tps_deg = frame.tps_deg
 #            print('itr is',psw_loop_itr)
 #            if tps_deg <= tps_deg_max_pedal_up: # this loop used to make sure the throttle position sensor voltage bouncing around does not cause it to go in/out of the while loop
 #                #do two extra steps, to make less likely to approach tps limit when tps value bounces around
 #                GPIO.output(STEP, GPIO.HIGH) 
 #                GPIO.output(STEP, GPIO.LOW)
-#                sleep(delay('pedal_up'))
+#                sleep(delay(frame, 'pedal_up'))
 #                GPIO.output(STEP, GPIO.HIGH) 
 #                GPIO.output(STEP, GPIO.LOW)
-#                sleep(delay('pedal_up'))
+#                sleep(delay(frame, 'pedal_up'))
 #                psw_loop_cancel = True
-#            print("newloop, tps is: ",tps_deg," psw state is:",psw, "delay is:",delay('pedal_up'))
+#            print("newloop, tps is: ",tps_deg," psw state is:",psw, "delay is:",delay(frame, 'pedal_up'))
            
                 
                                    
         
 #         #This next portion for testing only
-#         print("speeds:",veh_spd_list[0:4],"...",veh_spd_list[-4:])
-#         print("time:",time_list[0:4],"...",time_list[-4:])
+#         print("speeds:",spd_window.speeds.values()[0:4],"...",spd_window.speeds.values()[-4:])
+#         print("time:",spd_window.times.values()[0:4],"...",spd_window.times.values()[-4:])
 #         print("accel_rate:",accel_rate)
 #         print("")
-#         if len(time_list) > 5:
-#                print("time_delta:",(time_list[-1]-time_list[-2]))
+#         if len(spd_window) > 5:
+#                print("time_delta:",(spd_window.times.values()[-1]-spd_window.times.values()[-2]))
              
-        itr += 1 #add 1 to while loop iteration counter    
-    
-        #this next if statement/section for testing program only
-        #may need to change above itr line or reset if removing this section
-        if itr >= print_itr_reset_count: #print desired and actual throttle position once every 75 iterations (to make easier to read) (modulo)
-            print("tps_deg:",round(tps_deg,2),"deg  ","act_spd:",round(act_spd,2)," Des_veh_spd:",round(des_spd,2),"  accel_rate:",round(accel_rate,2)," mph/s","  step mode is: ",step_mode(),"min delay is:",round(delay(),7),"  psw is: ",psw)
-            #print(step_history)
-            itr = 0 #reset iterations
-            
+            itr += 1 #add 1 to while loop iteration counter    
+        
+            #this next if statement/section for testing program only
+            #may need to change above itr line or reset if removing this section
+            if itr >= print_itr_reset_count: #print desired and actual throttle position once every 75 iterations (to make easier to read) (modulo)
+                #values go into the trace ring, the trace consumer thread does the printing (see loop_trace.StatusPrinter)
+                tracer.event(loop_trace.STATUS, (tps_deg, act_spd, des_spd, accel_rate, frame.step_mode, frame.step_delay, psw))
+                #print(step_history.values())
+                itr = 0 #reset iterations
+                
 
-except KeyboardInterrupt:
-    GPIO.output(SLEEP, GPIO.LOW) #disable stepper motor (to keep from getting hot unneccesarily)
-    GPIO.cleanup() #reset GPIO pins to inputs to protect against shorting accidentally
-    print("Program Ended; GPIO pins cleaned up")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if gc_state is not None:
+            timing.gc_resume(gc_state)
+        shutdown()
+        if print_enabled:
+            if ticker is not None:
+                stats = ticker.stats()
+                print("Loop ticks:", stats['ticks'], " deadline misses:", stats['misses'], " ticks skipped:", stats['skipped'], " latest:", round(stats['late_max']*1000, 3), "ms")
+            report = startup_report()
+            if report[-1][0] == 'first_command':
+                print("Key-on to first throttle command:", round(report[-1][1], 3), "s  (" + ", ".join(stage + " " + str(round(t, 3)) for stage, t in report[:-1]) + ")",
+                      " tables from cache" if getattr(tables, 'from_cache', False) else "")
+            print("Program Ended; GPIO pins cleaned up")
+
+
+
+def main(argv = None): #command line, 'python3 ThrottleByWire.py --profile cart2' (or '--sim 60' to run against the simulated golf car)
+    global table_cache_dir
+    import argparse
+    parser = argparse.ArgumentParser(description = "Golf car throttle by wire control loop")
+    parser.add_argument('--profile', help = "cart profile in profiles/ to use (calibration values and settings of one cart, see profiles.py)")
+    parser.add_argument('--list-profiles', action = 'store_true', help = "print the profile names and exit")
+    parser.add_argument('--sim', type = float, default = None, metavar = 'SECONDS', help = "run against the simulated golf car (plant_sim.py) instead of the Pi")
+    parser.add_argument('--no-cache', action = 'store_true', help = "build the calibration tables instead of loading them from the cache")
+    args = parser.parse_args(argv)
+    if args.list_profiles:
+        print("\n".join(profiles.list_profiles()))
+        return
+    if args.profile is not None:
+        apply_profile(args.profile)
+    if args.no_cache:
+        table_cache_dir = None
+    mark_startup('profile')
+    if args.sim is not None:
+        import plant_sim
+        run(hal.SimBackend(plant_sim.GolfCarPlant(cal, throttle_deg_per_motor_deg = throttle_deg_per_motor_deg)), duration = args.sim)
+    else:
+        run(hal.RealBackend(ads_gain))
+
+
+
+if __name__ == "__main__":
+    main()
 
 #General Comments on things to do:
 #May want to look into accel rate time and make a minimum time delta before it overrides the accel rate calc? Since RPi time does not seem consistent...
@@ -0,0 +1,237 @@
+#Streaming filters for the ADS1115 channels, for ThrottleByWire.py
+#The raw pedal, axle speed and tps readings went straight into the control decisions, so sensor noise turned into steps: the TPS "bouncing around" near
+#tps_deg_stop_min made the loop step back and forth, and a noisy speed reading flips des_spd > act_spd from one loop to the next.
+#Each channel gets its own chain of filter stages here, run on every raw sample (raw ADS1115 codes in, filtered codes out, so the calibration tables still work):
+#    MovingMedian --- median of the last n samples, removes spikes shorter than half the window
+#    OnePole -------- one pole low pass, y += alpha*(x - y)
+#    Biquad --------- second order (Butterworth) low pass, steeper than OnePole for the same lag
+#    Decimate ------- oversample and decimate: averages every 'factor' samples into one (list the channel 'factor' times in ads_schedule to keep its rate)
+#    Hysteresis ----- two thresholds for an on/off signal (pedal switch), the output only changes once the input is past the other threshold
+#Every stage keeps a fixed amount of state made up front, so each sample costs the same no matter how long the drive is.
+#With the acquisition engine the filters run on its thread for every sample. Without it (and in the simulator) they run on each blocking read in the loop,
+#and a Decimate stage then makes 'factor' reads per loop.
+#'python3 adc_filters.py' runs the simulated golf car with noisy sensors, with and without filters, and prints how often the stepper changed direction.
+
+
+#####Library Imports
+import math
+from bisect import bisect_left, insort
+import calibration
+#####
+
+
+
+class MovingMedian:
+    def __init__(self, n = 5):
+        self.n = n
+        self.reset()
+
+    def reset(self):
+        self.ring = [None]*self.n #last n samples in arrival order
+        self.sorted = [] #the same samples, sorted
+        self.i = 0
+
+    def update(self, x):
+        old = self.ring[self.i]
+        if old is not None:
+            del self.sorted[bisect_left(self.sorted, old)]
+        insort(self.sorted, x)
+        self.ring[self.i] = x
+        self.i += 1
+        if self.i == self.n:
+            self.i = 0
+        return self.sorted[len(self.sorted)//2]
+
+
+class OnePole:
+    #alpha --- 0 to 1, smaller is smoother (and slower). For a cutoff frequency fc at sample rate fs, alpha = 1 - exp(-2*pi*fc/fs) (see one_pole_alpha)
+    def __init__(self, alpha = 0.2):
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.y = None
+
+    def update(self, x):
+        if self.y is None: #start from the first sample, not from 0
+            self.y = float(x)
+        else:
+            self.y += self.alpha*(x - self.y)
+        return self.y
+
+def one_pole_alpha(cutoff_hz, sample_rate):
+    return 1 - math.exp(-2*math.pi*cutoff_hz/sample_rate)
+
+
+class Biquad: #second order filter (transposed direct form II), coefficients normalised so a0 = 1
+    def __init__(self, b0, b1, b2, a1, a2):
+        self.b0, self.b1, self.b2, self.a1, self.a2 = b0, b1, b2, a1, a2
+        self.dc_gain = (b0 + b1 + b2)/(1 + a1 + a2)
+        self.reset()
+
+    def reset(self):
+        self.z1 = None
+        self.z2 = 0.0
+
+    def update(self, x):
+        if self.z1 is None: #start as if the input had always been this sample, not from 0
+            y = x*self.dc_gain
+            self.z2 = self.b2*x - self.a2*y
+            self.z1 = self.b1*x - self.a1*y + self.z2
+        y = self.b0*x + self.z1
+        self.z1 = self.b1*x - self.a1*y + self.z2
+        self.z2 = self.b2*x - self.a2*y
+        return y
+
+def lowpass_biquad(cutoff_ratio, q = 0.7071): #low pass Biquad, cutoff_ratio is cutoff frequency/sample rate (below 0.5), q = 0.7071 is Butterworth [From RBJ audio EQ cookbook]
+    w0 = 2*math.pi*cutoff_ratio
+    alpha = math.sin(w0)/(2*q)
+    cos_w0 = math.cos(w0)
+    a0 = 1 + alpha
+    return Biquad((1 - cos_w0)/2/a0, (1 - cos_w0)/a0, (1 - cos_w0)/2/a0, -2*cos_w0/a0, (1 - alpha)/a0)
+
+
+class Decimate:
+    #factor --- samples averaged into each output, every other call returns None (no output yet)
+    #Averaging n samples of noise that changes from sample to sample cuts it by about sqrt(n), and gives finer steps than one code.
+    def __init__(self, factor = 4):
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+        self.count = 0
+
+    def update(self, x):
+        self.total += x
+        self.count += 1
+        if self.count < self.factor:
+            return None
+        y = self.total/self.count
+        self.total = 0.0
+        self.count = 0
+        return y
+
+
+class Hysteresis:
+    #low/high --- input below low turns the output off, above high turns it on, in between it stays as it was
+    #The output is 'high' when on and 'low' when off, so anything comparing it against a threshold between the two (like the pedal switch table) sees a clean signal.
+    def __init__(self, low, high, on = False):
+        if low >= high:
+            raise ValueError("Hysteresis low threshold must be below the high threshold")
+        self.low = low
+        self.high = high
+        self.start_on = on
+        self.reset()
+
+    def reset(self):
+        self.on = self.start_on
+
+    def update(self, x):
+        if self.on:
+            if x < self.low:
+                self.on = False
+        elif x > self.high:
+            self.on = True
+        return self.high if self.on else self.low
+
+
+
+class FilterChain: #filter stages run one after the other on each sample
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def update(self, x): #filtered value, or None if a Decimate stage has no output this sample
+        for stage in self.stages:
+            x = stage.update(x)
+            if x is None:
+                return None
+        return x
+
+
+def volts_to_code(volts, gain = 1):
+    return int(round(volts/calibration.ADS1115_FSR[gain]*32767))
+
+def make_stage(spec, gain = 1): #filter stage from a settings entry
+    #('median', n) / ('one_pole', alpha) / ('biquad', cutoff_ratio) or ('biquad', cutoff_ratio, q) / ('decimate', factor) / ('hysteresis', low_volts, high_volts)
+    kind = spec[0]
+    if kind == 'median':
+        return MovingMedian(*spec[1:])
+    if kind == 'one_pole':
+        return OnePole(*spec[1:])
+    if kind == 'biquad':
+        return lowpass_biquad(*spec[1:])
+    if kind == 'decimate':
+        return Decimate(*spec[1:])
+    if kind == 'hysteresis':
+        return Hysteresis(volts_to_code(spec[1], gain), volts_to_code(spec[2], gain))
+    raise ValueError("unknown filter stage: " + str(kind))
+
+
+class ChannelFilters: #a FilterChain for each ADS1115 channel
+    #config --- dict of channel number to a list of stage settings (see make_stage), channels not in it are not filtered
+    def __init__(self, config, gain = 1):
+        self.chains = [None, None, None, None]
+        for ch, specs in config.items():
+            if specs:
+                self.chains[ch] = FilterChain(make_stage(spec, gain) for spec in specs)
+
+    def reset(self):
+        for chain in self.chains:
+            if chain is not None:
+                chain.reset()
+
+    def update(self, ch, code): #filtered code for a new raw sample, or None if the channel is decimating and has no output this sample
+        chain = self.chains[ch]
+        if chain is None:
+            return code
+        y = chain.update(code)
+        return None if y is None else int(round(y))
+
+    def read(self, ch, channel): #blocking reads of an ADS1115 channel ('.value') until the chain has an output
+        code = None
+        while code is None:
+            code = self.update(ch, channel.value)
+        return code
+
+
+
+def count_reversals(steps): #number of times the stepper direction changed (moves that stay still in between are skipped)
+    last = 0
+    reversals = 0
+    for s in steps:
+        if s:
+            direction = 1 if s > 0 else -1
+            if last and direction != last:
+                reversals += 1
+            last = direction
+    return reversals
+
+
+
+#Noisy simulated sensors with and without the filters: direction reversals of the stepper (step_history), steps and speed error
+#One step per loop, so each reversal is a loop that acted on noise (a step batch is planned from a single TPS reading and would hide how many loops did)
+#Run with 'python3 adc_filters.py'
+if __name__ == "__main__":
+    import tempfile
+    import numpy as np
+    import plant_sim
+    from telemetry_recorder import read_telemetry
+    duration = 30.0
+    print("simulated golf car, step control mode, one step per loop (use_step_batches = False), sensor noise 0.02 V on every channel,", duration, "s")
+    print("filters  loops  reversals  reversals_per_s  stepper_pulses  speed_error_rms_mph")
+    for filtered in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            plant = plant_sim.GolfCarPlant(noise = 0.02)
+            backend, trace = plant_sim.simulate(duration, plant, {'adc_filters_enabled': filtered, 'use_step_batches': False, 'record_telemetry': True, 'telemetry_dir': directory})
+            records = read_telemetry(directory)
+        reversals = count_reversals(records['steps'].tolist())
+        t = np.array([row[0] for row in trace])
+        speed = np.array([row[2] for row in trace])
+        des_spd = np.array(plant_sim.desired_speed(trace, plant))
+        rms = float(np.sqrt(np.mean((speed - des_spd)**2)))
+        print(str(filtered).ljust(7), str(backend.cycles).rjust(6), str(reversals).rjust(10), str(round(reversals/duration, 1)).rjust(16), str(plant.pulses).rjust(15), str(round(rms, 2)).rjust(20))
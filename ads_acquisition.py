@@ -0,0 +1,301 @@
+#ADS1115 acquisition engine for ThrottleByWire.py
+#Reading 'channel.voltage' from the adafruit library starts a single shot conversion and waits for it, so the control loop stalls for a full conversion time on every channel it reads.
+#This file runs the ADS1115 in continuous conversion mode from a background thread instead. The thread steps through the channels (round robin),
+#and publishes the latest timestamped sample for each channel. The control loop only takes a snapshot of the latest samples and never waits on the I2C bus.
+#If the ALRT pin of the ADS1115 is wired to a GPIO pin, it can be used as a conversion ready signal instead of waiting a fixed amount of time.
+#There is also a fake I2C backend (FakeADS1115Bus) so this can be run and timed on a normal computer: 'python3 ads_acquisition.py'
+
+
+#####Library Imports
+import time
+import threading
+from collections import namedtuple
+from calibration import ADS1115_FSR, volts_from_code
+#####
+
+
+
+#####ADS1115 registers and config bits [From ADS1115 datasheet]
+ADS1115_ADDRESS = 0x48 #ADDR pin not used (tied to ground) gives address 0x48
+REG_CONVERSION = 0x00
+REG_CONFIG = 0x01
+REG_LO_THRESH = 0x02
+REG_HI_THRESH = 0x03
+
+CONFIG_OS_SINGLE = 0x8000 #start a single conversion (single shot mode only)
+CONFIG_MUX_SINGLE = {0: 0x4000, 1: 0x5000, 2: 0x6000, 3: 0x7000} #AINx compared to GND
+CONFIG_GAIN = {2/3: 0x0000, 1: 0x0200, 2: 0x0400, 4: 0x0600, 8: 0x0800, 16: 0x0A00}
+CONFIG_MODE_CONTINUOUS = 0x0000
+CONFIG_MODE_SINGLE = 0x0100
+CONFIG_DATA_RATE = {8: 0x0000, 16: 0x0020, 32: 0x0040, 64: 0x0060, 128: 0x0080, 250: 0x00A0, 475: 0x00C0, 860: 0x00E0} #samples per second
+CONFIG_COMP_QUE_1 = 0x0000 #ALRT asserts after one conversion (needed for conversion ready signal)
+CONFIG_COMP_QUE_DISABLE = 0x0003 #ALRT pin not used
+
+OSCILLATOR_TOLERANCE = 1.1 #internal oscillator can be up to 10% slow, so wait a bit longer than 1/data rate
+BUS_LOCK_BACKOFF_MAX = 0.0001 #longest sleep (s) between tries for a busy I2C bus lock (about one register transfer at 400 kHz)
+#####
+
+
+
+Sample = namedtuple('Sample', ['channel', 'code', 'voltage', 'timestamp', 'seq']) #one published reading, timestamp is time.perf_counter() when the conversion was seen to be done (before the I2C read)
+
+def signed_code(raw): #conversion register is a 16 bit two's complement number
+    if raw & 0x8000:
+        return raw - 0x10000
+    return raw
+
+
+
+#####Bus backends (both have write_register/read_register)
+class BusioBackend: #real ADS1115 on a busio.I2C bus (the same 'i2c' object made in ThrottleByWire.py)
+    def __init__(self, i2c, address = ADS1115_ADDRESS):
+        self.i2c = i2c
+        self.address = address
+        self.buf = bytearray(3)
+
+    def _lock(self): #wait for the bus lock (another thread may be using the bus), yielding the CPU to the thread that holds it instead of spinning
+        wait = 0.0
+        while not self.i2c.try_lock():
+            time.sleep(wait) #the first retry only yields, then the sleeps double up to BUS_LOCK_BACKOFF_MAX
+            wait = min(wait*2 or 0.00001, BUS_LOCK_BACKOFF_MAX)
+
+    def write_register(self, reg, value):
+        self.buf[0] = reg
+        self.buf[1] = (value >> 8) & 0xFF
+        self.buf[2] = value & 0xFF
+        self._lock()
+        try:
+            self.i2c.writeto(self.address, self.buf)
+        finally:
+            self.i2c.unlock()
+
+    def read_register(self, reg):
+        self.buf[0] = reg
+        self._lock()
+        try:
+            self.i2c.writeto_then_readfrom(self.address, self.buf, self.buf, out_end = 1, in_start = 1)
+        finally:
+            self.i2c.unlock()
+        return (self.buf[1] << 8) | self.buf[2]
+
+
+class FakeADS1115Bus: #pretend ADS1115, for running the acquisition engine without a Pi
+    #'sources' is a dict of channel number to a function of time that returns volts, e.g. {0: lambda t: 1.5}
+    #Conversions finish every 1/data rate seconds after the config register is written (the ADS1115 restarts the conversion when the config is written).
+    #'transaction_time' is how long each register read/write takes (about 0.0001-0.0003 s at 400 kHz on a Pi), so bus time is counted in the results.
+    def __init__(self, sources = None, transaction_time = 0.0):
+        self.sources = sources if sources is not None else {}
+        self.transaction_time = transaction_time
+        self.registers = {REG_CONVERSION: 0, REG_CONFIG: 0x8583, REG_LO_THRESH: 0x8000, REG_HI_THRESH: 0x7FFF} #power on defaults
+        self.config_time = time.perf_counter()
+        self.transactions = 0
+
+    def _bus_time(self):
+        self.transactions += 1
+        if self.transaction_time:
+            time.sleep(self.transaction_time) #sleep (not spin) so other threads can run, same as a real I2C transfer
+
+    def _settings(self):
+        config = self.registers[REG_CONFIG]
+        channel = (config >> 12) - 4 if config & 0x4000 else 0
+        gain = [g for g, bits in CONFIG_GAIN.items() if bits == config & 0x0E00][0]
+        rate = [r for r, bits in CONFIG_DATA_RATE.items() if bits == config & 0x00E0][0]
+        return channel & 0x3, gain, rate
+
+    def conversion_period(self):
+        return 1/self._settings()[2]
+
+    def last_conversion_end(self, now = None): #time the most recent conversion finished (None if none finished since config was written)
+        now = time.perf_counter() if now is None else now
+        period = self.conversion_period()
+        n = int((now - self.config_time)/period)
+        if n < 1:
+            return None
+        return self.config_time + n*period
+
+    def wait_ready(self, timeout): #acts like the ALRT/RDY pin: returns at the end of the next conversion
+        end = self.last_conversion_end()
+        if end is None:
+            end = self.config_time
+        ready = end + self.conversion_period()
+        remaining = ready - time.perf_counter()
+        if remaining > timeout:
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def write_register(self, reg, value):
+        self._bus_time()
+        self.registers[reg] = value
+        if reg == REG_CONFIG:
+            self.config_time = time.perf_counter()
+
+    def read_register(self, reg):
+        self._bus_time()
+        if reg == REG_CONVERSION:
+            end = self.last_conversion_end()
+            if end is not None:
+                channel, gain, rate = self._settings()
+                source = self.sources.get(channel)
+                volts = source(end) if source is not None else 0.0
+                code = int(round(volts/ADS1115_FSR[gain]*32767))
+                code = max(-32768, min(32767, code))
+                self.registers[REG_CONVERSION] = code & 0xFFFF
+        return self.registers[reg]
+#####
+
+
+
+def gpio_ready_waiter(gpio, pin): #returns a function that waits for the ADS1115 ALRT/RDY pin (active low) using RPi.GPIO
+    gpio.setup(pin, gpio.IN, pull_up_down = gpio.PUD_UP)
+    def wait_ready(timeout):
+        return gpio.wait_for_edge(pin, gpio.FALLING, timeout = max(1, int(timeout*1000))) is not None
+    return wait_ready
+
+
+
+class AcquisitionEngine: #background thread that keeps the latest sample of every channel up to date
+    #bus ---------- BusioBackend or FakeADS1115Bus
+    #schedule ----- order the channels are converted in, repeated forever (a channel can be listed more than once to sample it more often)
+    #data_rate ---- ADS1115 samples per second (8, 16, 32, 64, 128, 250, 475 or 860)
+    #wait_ready --- optional function(timeout) that returns when the ALRT/RDY pin signals a conversion is done (see gpio_ready_waiter). If None, waits a fixed time.
+    #filters ------ optional adc_filters.ChannelFilters, run on every sample before it is published (a decimating channel publishes once every 'factor' samples)
+    def __init__(self, bus, schedule = (0, 1, 2, 3), data_rate = 860, gain = 1, wait_ready = None, filters = None):
+        if data_rate not in CONFIG_DATA_RATE:
+            raise ValueError("data_rate must be one of " + str(sorted(CONFIG_DATA_RATE)))
+        if gain not in CONFIG_GAIN:
+            raise ValueError("gain must be one of " + str(sorted(CONFIG_GAIN)))
+        if not schedule:
+            raise ValueError("schedule must have at least one channel")
+        self.bus = bus
+        self.schedule = tuple(schedule)
+        self.data_rate = data_rate
+        self.gain = gain
+        self.wait_ready = wait_ready
+        self.filters = filters
+        self.conversion_time = OSCILLATOR_TOLERANCE/data_rate
+        self.latest = [None, None, None, None] #latest Sample for each channel (replaced as a whole, so readers never see half a sample)
+        self.counts = [0, 0, 0, 0] #number of samples published per channel
+        self.errors = 0
+        self.seq = 0
+        self._running = False
+        self._thread = None
+
+    def _config(self, channel):
+        config = CONFIG_MUX_SINGLE[channel] | CONFIG_GAIN[self.gain] | CONFIG_MODE_CONTINUOUS | CONFIG_DATA_RATE[self.data_rate]
+        if self.wait_ready is not None:
+            config |= CONFIG_COMP_QUE_1
+        else:
+            config |= CONFIG_COMP_QUE_DISABLE
+        return config
+
+    def _setup_ready_pin(self): #Hi_thresh MSB = 1 and Lo_thresh MSB = 0 turns the ALRT pin into a conversion ready signal
+        self.bus.write_register(REG_HI_THRESH, 0x8000)
+        self.bus.write_register(REG_LO_THRESH, 0x0000)
+
+    def _wait_conversion(self, start):
+        if self.wait_ready is not None:
+            return self.wait_ready(self.conversion_time*4)
+        remaining = start + self.conversion_time - time.perf_counter()
+        if remaining > 0: #sleep the whole wait, no spinning (a spin holds the GIL and takes the interpreter away from the control loop)
+            time.sleep(remaining) #waking a little late only makes the sample a little older, the conversion is done either way
+        return True
+
+    def _run(self):
+        if self.wait_ready is not None:
+            self._setup_ready_pin()
+        configs = [self._config(channel) for channel in self.schedule]
+        i = 0
+        n = len(self.schedule)
+        while self._running:
+            channel = self.schedule[i]
+            try:
+                self.bus.write_register(REG_CONFIG, configs[i]) #switch the multiplexer to this channel, conversion restarts
+                start = time.perf_counter()
+                if self._wait_conversion(start):
+                    done = time.perf_counter() #end of conversion (as near as it is known), before the I2C read
+                    code = signed_code(self.bus.read_register(REG_CONVERSION))
+                    if self.filters is not None:
+                        code = self.filters.update(channel, code)
+                    if code is not None:
+                        self.seq += 1
+                        self.latest[channel] = Sample(channel, code, volts_from_code(code, self.gain), done, self.seq)
+                        self.counts[channel] += 1
+                else:
+                    self.errors += 1
+            except OSError: #I2C errors (loose wire etc.), keep the last good sample and try again after a conversion time (a tight retry loop would hold the GIL)
+                self.errors += 1
+                time.sleep(self.conversion_time)
+            i += 1
+            if i == n:
+                i = 0
+
+    def start(self, timeout = 1.0): #start the background thread, and wait until every scheduled channel has a sample (RuntimeError if they do not all get one in 'timeout' seconds)
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target = self._run, name = "ads1115-acquisition", daemon = True)
+        self._thread.start()
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline and any(self.latest[ch] is None for ch in self.schedule):
+            time.sleep(self.conversion_time)
+        missing = sorted(set(ch for ch in self.schedule if self.latest[ch] is None))
+        if missing:
+            self.stop()
+            raise RuntimeError("no samples from ADS1115 channel(s) " + ", ".join(str(ch) for ch in missing) + " after " + str(timeout) + " s (" + str(self.errors) + " bus errors), check the wiring/address")
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout = 1)
+            self._thread = None
+        try: #put the ADS1115 back into single shot (power down) mode
+            self.bus.write_register(REG_CONFIG, self._config(self.schedule[0]) | CONFIG_MODE_SINGLE)
+        except OSError:
+            pass
+
+    def snapshot(self): #latest Sample for every channel (None for channels not in schedule), never waits on the bus
+        return tuple(self.latest)
+
+    def sample(self, channel):
+        return self.latest[channel]
+
+    def voltage(self, channel):
+        return self.latest[channel].voltage
+
+    def code(self, channel):
+        return self.latest[channel].code
+
+    def stats(self): #number of samples per channel, errors
+        return {'counts': list(self.counts), 'errors': self.errors, 'data_rate': self.data_rate, 'schedule': self.schedule}
+
+
+
+#Run the engine against the fake ADS1115 and print throughput and sample age
+#Run with 'python3 ads_acquisition.py'
+if __name__ == "__main__":
+    import math
+    sources = {0: lambda t: 1.65 + 1.5*math.sin(t), #pedal
+               1: lambda t: 0.8, #axle speed sensor
+               2: lambda t: 2.0 + 0.5*math.sin(3*t), #tps
+               3: lambda t: 3.3} #pedal switch
+    for use_ready in (False, True):
+        bus = FakeADS1115Bus(sources, transaction_time = 0.0002)
+        engine = AcquisitionEngine(bus, data_rate = 860, wait_ready = bus.wait_ready if use_ready else None).start()
+        run_time = 2
+        ages = []
+        end = time.perf_counter() + run_time
+        loops = 0
+        while time.perf_counter() < end: #pretend control loop, only takes snapshots
+            now = time.perf_counter()
+            snap = engine.snapshot()
+            ages.extend(now - s.timestamp for s in snap)
+            loops += 1
+            time.sleep(0.001)
+        engine.stop()
+        ages.sort()
+        stats = engine.stats()
+        print("ready pin:", use_ready, "  samples/s per channel:", [round(c/run_time) for c in stats['counts']], "  errors:", stats['errors'])
+        print("    control loops:", loops, "  sample age ms  p50:", round(ages[len(ages)//2]*1000,2), " p99:", round(ages[int(len(ages)*0.99)]*1000,2), " max:", round(ages[-1]*1000,2))
@@ -0,0 +1,157 @@
+#Axle speed from the tooth edges of the axle input shaft speed sensor, for ThrottleByWire.py
+#ax_spd_sens_v_to_veh_spd() works the speed out from the sensor voltage on ADS1115 channel P1 (assuming a straight line of 3.3 V at 5500 rpm).
+#That costs one of the slow ADC conversions every loop, and the voltage is noisy and rounded at golf car speeds.
+#Here the sensor signal goes to a GPIO pin instead, and every rising edge (one per tooth, axle_n_teeth per revolution) is timestamped by an edge interrupt callback
+#into a ring buffer. The speed is worked out from the edge times:
+#    low speed ---- 'period' method, from the time between the last few edges (there are only a few edges, each one is timed)
+#    high speed --- 'count' method, from the number of edges in the last 'count_window' seconds (many edges, averaging them out gives a steady reading)
+#    no edge for 'zero_timeout' seconds means the car is stopped. While waiting for the next edge the speed can be no higher than one tooth over the time since the last edge,
+#    so the reading comes down as the car slows instead of holding the last value.
+#With this the axle channel is no longer read by the ADC, so the other channels get sampled more often.
+#
+#The ring is written by the edge callback thread only, the loop only reads it: the callback writes the time into the next slot and then moves 'head' on (no lock needed).
+#Note: RPi.GPIO runs the callbacks on its own thread and timestamps them there, so each edge time can be off by some tens of microseconds. The averaging covers for most of that.
+#
+#'python3 axle_speed.py' runs simulated edges at a few speeds and prints the measured speed and method, and how long zero speed takes to be seen.
+
+
+#####Library Imports
+import time
+import calibration
+#####
+
+
+
+class EdgeSpeedSensor:
+    #n_teeth ------------ edges per revolution of the axle input shaft
+    #ring_size ---------- edge times kept
+    #count_window ------- seconds of edges averaged by the count method
+    #count_min_edges ---- edges needed in count_window for the count method to be used, below this the period method is used
+    #period_edges ------- edges averaged by the period method
+    #zero_timeout ------- seconds without an edge before the speed is 0
+    #clock -------------- time function used for the edge times (time.perf_counter on the Pi, simulated time in the simulator)
+    def __init__(self, cal = None, n_teeth = None, ring_size = 256, count_window = 0.05, count_min_edges = 8, period_edges = 2, zero_timeout = 0.5, clock = time.perf_counter):
+        self.cal = dict(calibration.DEFAULT_CALIBRATION if cal is None else cal)
+        self.n_teeth = n_teeth if n_teeth is not None else self.cal['axle_n_teeth']
+        self.size = ring_size
+        self.times = [0.0]*ring_size
+        self.head = 0 #total edges seen (next slot is head % size)
+        self.count_window = count_window
+        self.count_min_edges = count_min_edges
+        self.max_edges = ring_size//2 #most edges averaged, leaves half the ring as room for the callback to keep writing while the loop reads
+        self.period_edges = period_edges
+        self.zero_timeout = zero_timeout
+        self.clock = clock
+        self.rate = 0.0 #last edge rate worked out, edges per second
+        self.method = 'zero' #method used for the last reading ('period', 'count' or 'zero')
+
+    #Edge side (GPIO callback thread)
+    def on_edge(self, channel = None, t = None): #edge interrupt callback (RPi.GPIO calls it with the pin number), t is the edge time if known (simulator)
+        self.times[self.head % self.size] = self.clock() if t is None else t
+        self.head += 1
+
+    def attach(self, gpio, pin, bouncetime = None): #set up a GPIO pin as the tooth edge input with an edge interrupt
+        gpio.setup(pin, gpio.IN)
+        if bouncetime is None:
+            gpio.add_event_detect(pin, gpio.RISING, callback = self.on_edge)
+        else:
+            gpio.add_event_detect(pin, gpio.RISING, callback = self.on_edge, bouncetime = bouncetime)
+
+    def detach(self, gpio, pin):
+        gpio.remove_event_detect(pin)
+
+    #Loop side
+    def edge_rate(self, now = None): #edges per second
+        head = self.head
+        if head == 0:
+            self.rate = 0.0
+            self.method = 'zero'
+            return 0.0
+        now = self.clock() if now is None else now
+        times = self.times
+        size = self.size
+        last = times[(head - 1) % size]
+        since_last = now - last
+        if since_last > self.zero_timeout:
+            self.rate = 0.0
+            self.method = 'zero'
+            return 0.0
+        #edges to average over, picked from the last rate so it is O(1) (about count_window worth of edges)
+        n = int(self.rate*self.count_window)
+        if n >= self.count_min_edges:
+            self.method = 'count'
+            n = min(n, self.max_edges)
+        else:
+            self.method = 'period'
+            n = self.period_edges
+        n = min(n, head - 1)
+        if n < 1: #only one edge so far, can not time a period yet
+            self.rate = 0.0
+            return 0.0
+        span = last - times[(head - 1 - n) % size]
+        rate = n/span if span > 0 else 0.0
+        if since_last > 0 and since_last*rate > 1: #next edge is later than the last rate says it should be, the car is slowing
+            rate = 1/since_last
+        self.rate = rate
+        return rate
+
+    def rpm(self, now = None): #axle input shaft rpm
+        return self.edge_rate(now)/self.n_teeth*60
+
+    def veh_spd(self, now = None): #vehicle speed in mph (same rounding as the ADC conversion)
+        return calibration.axle_rpm_to_veh_spd(self.rpm(now), self.cal)
+
+
+
+class SimEdgeSource: #tooth edges for a simulated axle speed (used to test EdgeSpeedSensor without the car), calls a callback with (pin, edge time) for every edge
+    def __init__(self, callback, n_teeth = 32, pin = None, jitter = 0.0, seed = 0):
+        import random
+        self.callback = callback
+        self.n_teeth = n_teeth
+        self.pin = pin
+        self.jitter = jitter #standard deviation of timing error added to each edge time (s), like interrupt latency
+        self.random = random.Random(seed)
+        self.t = 0.0
+        self.teeth = 0.0 #teeth passed, fraction is how far to the next edge
+
+    def run(self, t, rpm): #move the shaft forward to time t at a steady rpm, making the edges that happen on the way
+        rate = rpm/60*self.n_teeth
+        before = self.teeth
+        self.teeth += rate*(t - self.t)
+        if rate > 0:
+            for k in range(int(before) + 1, int(self.teeth) + 1):
+                edge_t = self.t + (k - before)/rate
+                if self.jitter:
+                    edge_t += abs(self.random.gauss(0, self.jitter))
+                self.callback(self.pin, edge_t)
+        self.t = t
+
+
+
+#Simulated edges at steady speeds, then a stop
+#Run with 'python3 axle_speed.py'
+if __name__ == "__main__":
+    clock = [0.0]
+    sensor = EdgeSpeedSensor(clock = lambda: clock[0])
+    source = SimEdgeSource(sensor.on_edge, sensor.n_teeth, jitter = 0.00003)
+    rpm_per_mph = 5500/calibration.axle_rpm_to_veh_spd(5500) #rough, for the true speeds below
+    print("true_mph  measured_mph  method   (edges timed with 30 us of jitter, read every 5 ms)")
+    for mph in (0.5, 2, 5, 12, 25):
+        rpm = mph*rpm_per_mph
+        readings = []
+        for i in range(200):
+            clock[0] += 0.005
+            source.run(clock[0], rpm)
+            readings.append(sensor.veh_spd())
+        print(str(mph).rjust(8), str(round(sum(readings[-50:])/50, 2)).rjust(13), " ", sensor.method)
+    #stop
+    stop_t = clock[0]
+    while sensor.veh_spd() > 0:
+        clock[0] += 0.005
+        source.run(clock[0], 0)
+    print("stopped at", round(stop_t, 3), "s, speed read as 0 after", round(clock[0] - stop_t, 3), "s")
+    n = 100000
+    start = time.perf_counter()
+    for i in range(n):
+        sensor.veh_spd()
+    print("veh_spd() takes", round((time.perf_counter() - start)/n*1e6, 2), "us")
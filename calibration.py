@@ -0,0 +1,247 @@
+#Sensor calibration for ThrottleByWire.py
+#The calibration values used to live inside each conversion function, and the math (and np.arange/np.interp/np.around) was redone every time a sensor was read.
+#This file keeps the calibration values in one place, and has a 'calibration compiler' (CalibrationTables) that turns them into lookup tables indexed by the raw 16 bit ADS1115 code.
+#With the tables, converting a reading in the main loop is a single array index per channel. The tables are only rebuilt when a calibration value or cruise_spd changes.
+#The conversion functions below are the same math as the original functions. They work on a single voltage or a numpy array of them, and the tables are built by
+#calling them on the voltage of every code, so there is only one copy of the math.
+
+
+#####Library Imports
+import math
+import numpy as np
+#####
+
+
+
+#####Calibration values
+DEFAULT_CALIBRATION = {
+    #Pedal Position Sensor
+    'pps_v_in': 3.3, #3.3 or 5 (ECU delivers 5V)
+    'pps_mode': "potentiometer", #"potentiometer" or "pedal"
+    'pedalspeedmap_speed_percentage': (0,0.02,0.05,0.085,0.125,0.175,0.225,0.28,0.333,0.3875,0.45,0.51,0.575,0.64,0.71,0.775,0.84,0.9,0.95,0.98,1), #percent of cruise_spd for each 5% of pedal travel (0 to 100)
+    #Throttle Position Sensor
+    'tps_v_in': 5, #volts --- Input either 3.3 or 5. On Vehicle, ECU delivers 5 V
+    'deg_throttle_min': 0,
+    'deg_throttle_max': 80, #may be 82, see variation here from throttle body to throttle body
+    #Axle Input Shaft Speed Sensor
+    'axle_speed_sensor_v_in': 3.3, #Sensor Supply Voltage
+    'axle_input_rpm_at_v_in': 5500, #rpm when sensor outputs the supply voltage (25mph with 18" tires)
+    'axle_n_teeth': 32, #number of teeth per revolution of axle input shaft (for measuring speed from the sensor's tooth edges, see axle_speed.py)
+    'axle_ratio': 11.47,
+    'tire_dia': 18, #inch
+    'f_roll_rad': 0.965, #rolling radius factor
+    #Pedal Switch
+    'psw_v_threshold': 1.5, #pedal switch voltage above this is pedal down
+    #Throttle feedforward, used by the 'angle' control mode (see throttle_control.py)
+    'ff_spd_mph': (0, 5, 10, 15, 20, 25), #steady vehicle speeds, mph
+    'ff_throttle_deg': (0, 5.6, 12.8, 22.5, 38, 78), #throttle opening that holds each speed on flat ground (rough values, hold steady speeds on the car and note tps_deg to measure them)
+    #Rounding of returned speeds
+    'decimal_places': 2,
+    'rounding_integer': 5,
+}
+
+#ADS1115 full scale range in volts for each gain setting [From ADS1115 datasheet] (same as the adafruit library uses to calculate '.voltage')
+ADS1115_FSR = {2/3: 6.144, 1: 4.096, 2: 2.048, 4: 1.024, 8: 0.512, 16: 0.256}
+#####
+
+
+
+#####Conversions (same math as the original functions, 'voltage' can be a number or a numpy array)
+def pps_v_limits(cal): #returns (pps_v_min, pps_v_max) depending on pedal mode and supply voltage
+    pps_v_in = cal['pps_v_in']
+    pps_mode = cal['pps_mode']
+    if pps_mode == "potentiometer":
+        pps_v_min = 0
+        if pps_v_in == 3.3:
+            pps_v_max = 3.3
+        elif pps_v_in == 5:
+            pps_v_max = 5
+        else:
+            raise ValueError("pps_v_in must be 3.3 or 5")
+    elif pps_mode == "pedal":
+        if pps_v_in == 3.3:
+            pps_v_min = 0.724 #measured value with HPC
+            pps_v_max = 2.81 #measured value with HPC
+        elif pps_v_in == 5:
+            pps_v_min = 1.15 #measured value with HPC
+            pps_v_max = 3.876 #measured value with HPC
+        else:
+            raise ValueError("pps_v_in must be 3.3 or 5")
+    else:
+        raise ValueError("pps_mode must be 'potentiometer' or 'pedal'")
+    return pps_v_min, pps_v_max
+
+def tps_v_limits(cal): #returns (tps_v_min, tps_v_max) depending on throttle body supply voltage
+    tps_v_in = cal['tps_v_in']
+    if tps_v_in == 3.3: #3.3V Input to Throttle Body
+        tps_v_min = 0.41 #Fully Closed throttle signal reading
+        tps_v_max = 2.53 #Fully Open Throttle signal reading
+    elif tps_v_in == 5: #5V Input to Throttle Body
+        tps_v_min = 0.652 #Fully Closed throttle signal reading
+        tps_v_max = 3.865 #Fully Open Throttle signal reading
+    else:
+        raise ValueError("tps_v_in must be 3.3 or 5")
+    return tps_v_min, tps_v_max
+
+def pedalspeedmap(cal, cruise_spd): #returns (pedal position array, speed array) of the pedal map in mph
+    pedalspeedmap_pedalpos = np.arange(0,101,5) #create an array from 0 to 100
+    pedalspeedmap_speed = np.multiply(cal['pedalspeedmap_speed_percentage'], cruise_spd)
+    return pedalspeedmap_pedalpos, pedalspeedmap_speed
+
+def axle_v_to_veh_spd(voltage, cal = DEFAULT_CALIBRATION): #convert axle speed sensor voltage to vehicle speed in mph
+    axle_spd_sens_volt_per_rpm = cal['axle_speed_sensor_v_in']/cal['axle_input_rpm_at_v_in']
+    axle_input_rpm = voltage/axle_spd_sens_volt_per_rpm
+    return axle_rpm_to_veh_spd(axle_input_rpm, cal)
+
+def axle_rpm_to_veh_spd(axle_input_rpm, cal = DEFAULT_CALIBRATION): #convert axle input shaft rpm to vehicle speed in mph (speeds measured from tooth edges use this directly)
+    rounding_integer = cal['rounding_integer']
+    tire_circ = cal['tire_dia']*math.pi*cal['f_roll_rad']
+    tire_rpm = (axle_input_rpm)/cal['axle_ratio']
+    veh_spd_inchpermin = tire_rpm*tire_circ
+    veh_spd = veh_spd_inchpermin*((60/1)*(1/12)*(1/5280))
+    veh_spd = np.maximum(veh_spd, 0) #no negative speeds
+    return np.around(veh_spd/rounding_integer, cal['decimal_places'])*rounding_integer
+
+def pps_v_to_des_spd(voltage, cruise_spd, cal = DEFAULT_CALIBRATION): #convert pedal position sensor voltage to desired speed, in mph
+    rounding_integer = cal['rounding_integer']
+    pps_v_min, pps_v_max = pps_v_limits(cal)
+    pps_percent = (voltage - pps_v_min) / (pps_v_max - pps_v_min) * 100
+    pedalspeedmap_pedalpos, pedalspeedmap_speed = pedalspeedmap(cal, cruise_spd)
+    des_spd = np.interp(pps_percent, pedalspeedmap_pedalpos, pedalspeedmap_speed) #linear interpolation of speed map
+    des_spd = np.maximum(des_spd, 0) #no negative speeds
+    return np.around(des_spd/rounding_integer, cal['decimal_places'])*rounding_integer
+
+def tps_v_to_deg(voltage, cal = DEFAULT_CALIBRATION): #convert throttle position sensor voltage to deg of opening
+    tps_v_min, tps_v_max = tps_v_limits(cal)
+    deg_throttle_min = cal['deg_throttle_min']
+    deg_throttle_max = cal['deg_throttle_max']
+    voltage = np.clip(voltage, tps_v_min, tps_v_max) #in case tps signal is slightly lower/higher from throttle body to throttle body, round to tps_v_min/tps_v_max for now
+    deg_throttle = 0+(voltage-tps_v_min)*(deg_throttle_max-deg_throttle_min)/(tps_v_max-tps_v_min) #linear interpolation
+    return deg_throttle + 0.0 #do not want to see negative zero (-0.0 + 0.0 is 0.0)
+
+def psw_v_to_state(voltage, cal = DEFAULT_CALIBRATION): #returns the pedal switch state (Pedal Up = 0 ; Pedal Down = 1)
+    return (voltage > cal['psw_v_threshold'])*1
+#####
+
+
+
+#####Lookup tables
+def volts_from_code(code, gain = 1): #voltage of an ADS1115 code (or array of codes), same formula as the adafruit library uses for '.voltage'
+    return code*ADS1115_FSR[gain]/32767
+
+def code_to_voltage(gain = 1): #array of the voltage for every ADS1115 code, arranged so that table[code] works for negative codes too (python negative indexing)
+    codes = np.arange(65536).astype(np.uint16).view(np.int16).astype(np.int64) #0...32767, then -32768...-1
+    return volts_from_code(codes, gain)
+
+#each table is the conversion function run on the voltage of every code
+def compile_axle_table(voltage, cal):
+    return axle_v_to_veh_spd(voltage, cal)
+
+def compile_pps_table(voltage, cal, cruise_spd):
+    return pps_v_to_des_spd(voltage, cruise_spd, cal)
+
+def compile_tps_table(voltage, cal):
+    return tps_v_to_deg(voltage, cal)
+
+def compile_psw_table(voltage, cal):
+    return psw_v_to_state(voltage, cal).astype(np.int8)
+
+
+class CalibrationTables: #lookup tables from raw ADS1115 code to useful numbers, one per channel
+    #Use like 'tables.tps[code]' or 'tables.des_spd(code)'. Call set_cruise_spd()/set_calibration() whenever those might change, the tables only rebuild if a value actually changed.
+    def __init__(self, cal = None, cruise_spd = 12, gain = 1):
+        self.cal = dict(DEFAULT_CALIBRATION if cal is None else cal)
+        self.cruise_spd = cruise_spd
+        self.gain = gain
+        self.builds = 0 #number of times the tables have been compiled (useful to check they are not rebuilt every loop)
+        self._compile_all()
+
+    @classmethod
+    def from_arrays(cls, cal, cruise_spd, gain, arrays): #tables that were built before (e.g. loaded from the cache in profiles.py), without compiling them again
+        tables = cls.__new__(cls)
+        tables.cal = dict(cal)
+        tables.cruise_spd = cruise_spd
+        tables.gain = gain
+        tables.builds = 0
+        for name in ('voltage', 'axle', 'tps', 'psw', 'pps'):
+            setattr(tables, name, arrays[name])
+        return tables
+
+    def _compile_all(self):
+        self.voltage = code_to_voltage(self.gain)
+        self.axle = compile_axle_table(self.voltage, self.cal)
+        self.tps = compile_tps_table(self.voltage, self.cal)
+        self.psw = compile_psw_table(self.voltage, self.cal)
+        self.pps = compile_pps_table(self.voltage, self.cal, self.cruise_spd)
+        self.builds += 1
+
+    def set_cruise_spd(self, cruise_spd): #only the pedal table depends on cruise speed
+        if cruise_spd != self.cruise_spd:
+            self.cruise_spd = cruise_spd
+            self.pps = compile_pps_table(self.voltage, self.cal, self.cruise_spd)
+            self.builds += 1
+
+    def set_calibration(self, **changes): #change one or more calibration values, e.g. set_calibration(tps_v_in = 3.3)
+        changed = False
+        for key, value in changes.items():
+            if key not in self.cal:
+                raise KeyError("unknown calibration value: " + key)
+            if self.cal[key] != value:
+                self.cal[key] = value
+                changed = True
+        if changed:
+            self._compile_all()
+
+    def set_gain(self, gain):
+        if gain != self.gain:
+            self.gain = gain
+            self._compile_all()
+
+    #single array index per channel
+    def veh_spd(self, code):
+        return self.axle[code]
+
+    def des_spd(self, code):
+        return self.pps[code]
+
+    def tps_deg(self, code):
+        return self.tps[code]
+
+    def psw_state(self, code):
+        return self.psw[code]
+#####
+
+
+
+#Check that the tables match the reference functions, and time both methods
+#Run with 'python3 calibration.py' (does not need the Pi or the ADS1115)
+if __name__ == "__main__":
+    import timeit
+    tables = CalibrationTables()
+    cruise_spd = tables.cruise_spd
+    voltage = tables.voltage
+    codes = np.arange(-32768, 32768)
+    mismatches = 0
+    for code in codes.tolist():
+        v = voltage[code]
+        if tables.veh_spd(code) != axle_v_to_veh_spd(v):
+            mismatches += 1
+        if tables.des_spd(code) != pps_v_to_des_spd(v, cruise_spd):
+            mismatches += 1
+        if tables.tps_deg(code) != tps_v_to_deg(v):
+            mismatches += 1
+        if tables.psw_state(code) != psw_v_to_state(v):
+            mismatches += 1
+    print("codes checked:", len(codes), "  mismatches:", mismatches)
+
+    n = 20000
+    code = 12345
+    v = voltage[code]
+    for name, ref, table in (("veh_spd", lambda: axle_v_to_veh_spd(v), lambda: tables.axle[code]),
+                             ("des_spd", lambda: pps_v_to_des_spd(v, cruise_spd), lambda: tables.pps[code]),
+                             ("tps_deg", lambda: tps_v_to_deg(v), lambda: tables.tps[code])):
+        t_ref = timeit.timeit(ref, number = n)/n
+        t_table = timeit.timeit(table, number = n)/n
+        print(name, "  function:", round(t_ref*1e6,3), "us  table:", round(t_table*1e6,3), "us  speedup:", round(t_ref/t_table,1), "x")
+    t_build = timeit.timeit(lambda: CalibrationTables(), number = 5)/5
+    print("full table compile:", round(t_build*1e3,2), "ms")
@@ -0,0 +1,231 @@
+#GPIO write coalescing for ThrottleByWire.py
+#Every loop set_step_mode() writes the three MODE pins, even when the step mode has not changed, and every step_open()/step_close() writes DIR, even when the
+#direction is the same as last time. Each one is a separate RPi.GPIO call.
+#ShadowGPIO sits in front of RPi.GPIO (or a simulated GPIO) and keeps a copy (shadow) of the level last written to every output pin:
+#    writes that would not change a pin are skipped (counted in 'suppressed')
+#    'deferred' pins (M0/M1/M2 and DIR) are held until the next write to any other pin (the STEP pulse), so all of their changes go out together in one write
+#    several pins changing at once go out in one banked register write if there is a 'bank' (GpiomemBank on a Pi 1-4), or one gpio.output(list, list) call if not
+#    'passthrough' pins (STEP, which changes on every write anyway) skip the shadow and go straight out
+#Not thread safe: one thread should do the writes (with the motion engine running, the loop itself does not write pins).
+#'python3 gpio_shadow.py' runs the simulated golf car with and without the shadow and prints the GPIO calls made and saved.
+
+
+#####Library Imports
+import os
+from stepper_motion import SimulatedGPIO, SimClock
+#####
+
+
+
+def _pin_list(pin): #a pin number or a list/tuple of them, as a tuple
+    return tuple(pin) if isinstance(pin, (tuple, list)) else (pin,)
+
+
+
+class ShadowGPIO:
+    #gpio ---------- RPi.GPIO (or anything like it), where the writes go
+    #deferred ------ pins whose writes are held until the next write to another pin (or flush())
+    #passthrough --- pins written every time, without looking at the shadow
+    #bank ---------- optional banked writer, write(set_mask, clear_mask) sets/clears several pins in one register write (see GpiomemBank)
+    def __init__(self, gpio, deferred = (), passthrough = (), bank = None):
+        self.gpio = gpio
+        self.deferred = set(deferred)
+        self.passthrough = set(passthrough)
+        self.bank = bank
+        self.levels = {} #shadow, pin: last level written (pins not in here are unknown, so their next write always goes out)
+        self.pending = {} #deferred pin: level not written yet
+        self.calls = 0 #write calls made to the backend (a banked write is one call)
+        self.pin_writes = 0 #pin levels written by those calls
+        self.suppressed = 0 #pin writes skipped, pin was already at that level
+        self.banked = 0 #banked register writes
+        for name in ('HIGH', 'LOW', 'OUT', 'IN', 'BCM'): #constants the loop uses, copied so they do not go through __getattr__
+            if hasattr(gpio, name):
+                setattr(self, name, getattr(gpio, name))
+
+    def __getattr__(self, name): #everything else (HIGH, LOW, BCM, setmode, add_event_detect...) is the backend's
+        return getattr(self.gpio, name)
+
+    def setup(self, pin, direction, *args, **kwargs):
+        self.gpio.setup(pin, direction, *args, **kwargs)
+        for p in _pin_list(pin): #level is unknown after setup (unless 'initial' was given)
+            self.pending.pop(p, None)
+            if 'initial' in kwargs:
+                self.levels[p] = 1 if kwargs['initial'] else 0
+            else:
+                self.levels.pop(p, None)
+
+    def output(self, pin, value):
+        if pin.__class__ is int and pin in self.passthrough: #STEP, straight out
+            if self.pending:
+                self.flush()
+            self.gpio.output(pin, value)
+            self.calls += 1
+            self.pin_writes += 1
+            return
+        pins = _pin_list(pin)
+        values = value if isinstance(value, (tuple, list)) else (value,)*len(pins)
+        changes = None
+        levels = self.levels
+        pending = self.pending
+        for p, v in zip(pins, values):
+            v = 1 if v else 0
+            if p in pending:
+                if pending[p] == v:
+                    self.suppressed += 1
+                elif levels.get(p) == v: #back to the level already on the pin, nothing to write after all
+                    del pending[p]
+                    self.suppressed += 1
+                else:
+                    pending[p] = v
+            elif levels.get(p) == v:
+                self.suppressed += 1
+            elif p in self.deferred:
+                pending[p] = v
+            else:
+                if changes is None:
+                    changes = {}
+                changes[p] = v
+        if changes is not None:
+            if pending: #held pins go out with this write
+                pending.update(changes)
+                changes = pending
+                self.pending = {}
+            self._write(changes)
+
+    def flush(self): #write the held (deferred) pins now
+        if self.pending:
+            pending = self.pending
+            self.pending = {}
+            self._write(pending)
+
+    def invalidate(self, pin = None): #forget the shadow level of a pin (or all pins), e.g. if something else wrote it, so the next write goes out
+        if pin is None:
+            self.levels = {}
+            return
+        for p in _pin_list(pin):
+            self.levels.pop(p, None)
+
+    def _write(self, changes):
+        self.calls += 1
+        self.pin_writes += len(changes)
+        self.levels.update(changes)
+        if len(changes) == 1:
+            for p, v in changes.items():
+                self.gpio.output(p, v)
+            return
+        if self.bank is not None and all(p < 32 for p in changes):
+            set_mask = 0
+            clear_mask = 0
+            for p, v in changes.items():
+                if v:
+                    set_mask |= 1 << p
+                else:
+                    clear_mask |= 1 << p
+            self.bank.write(set_mask, clear_mask)
+            self.banked += 1
+            return
+        self.gpio.output(list(changes), list(changes.values()))
+
+    def cleanup(self, *args):
+        self.pending = {}
+        self.levels = {}
+        self.gpio.cleanup(*args)
+
+    def stats(self):
+        return {'calls': self.calls, 'pin_writes': self.pin_writes, 'suppressed': self.suppressed, 'banked': self.banked}
+
+
+
+class GpiomemBank: #GPIO set/clear registers of the BCM2835/2836/2837/2711 (Pi 1 to 4) through /dev/gpiomem, pins 0-31 in one register write each
+    #The pins still have to be set up as outputs (RPi.GPIO setup()), this only writes their levels.
+    #Pins being set all change together, and pins being cleared all change together (set register is written first).
+    GPSET0 = 0x1C #[From BCM2835 ARM peripherals datasheet]
+    GPCLR0 = 0x28
+
+    def __init__(self, path = '/dev/gpiomem'):
+        import mmap
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mem = mmap.mmap(fd, 4096, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.regs = memoryview(self.mem).cast('I') #32 bit registers
+
+    def write(self, set_mask, clear_mask):
+        if set_mask:
+            self.regs[self.GPSET0//4] = set_mask
+        if clear_mask:
+            self.regs[self.GPCLR0//4] = clear_mask
+
+
+def gpiomem_bank(): #GpiomemBank if this is a Pi 1-4 and /dev/gpiomem can be opened, None if not (the Pi 5 GPIO is different, it is not supported)
+    try:
+        with open('/proc/device-tree/compatible', 'rb') as f:
+            compatible = f.read()
+    except OSError:
+        return None
+    if not any(chip in compatible for chip in (b'bcm2835', b'bcm2836', b'bcm2837', b'bcm2711')):
+        return None
+    try:
+        return GpiomemBank()
+    except OSError:
+        return None
+
+
+
+class FakeBank: #banked writer for a FakeGPIO, to check and count banked writes without a Pi
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self.writes = 0
+
+    def write(self, set_mask, clear_mask):
+        self.writes += 1
+        for p in range(32):
+            if set_mask >> p & 1:
+                SimulatedGPIO.output(self.gpio, p, 1)
+            elif clear_mask >> p & 1:
+                SimulatedGPIO.output(self.gpio, p, 0)
+
+
+class FakeGPIO(SimulatedGPIO): #SimulatedGPIO that also counts output calls (a list of pins is one call), with a FakeBank in 'bank'
+    def __init__(self, clock = None, step_pin = 21, dir_pin = 20):
+        SimulatedGPIO.__init__(self, clock if clock is not None else SimClock(), step_pin, dir_pin)
+        self.calls = 0
+        self.bank = FakeBank(self)
+
+    def output(self, pin, value):
+        self.calls += 1
+        if isinstance(pin, (tuple, list)):
+            values = value if isinstance(value, (tuple, list)) else [value]*len(pin)
+            for p, v in zip(pin, values):
+                SimulatedGPIO.output(self, p, v)
+            return
+        SimulatedGPIO.output(self, pin, value)
+
+
+
+#GPIO calls with and without the shadow: the control loop on the simulated golf car, then the old in-loop stepping pattern on a FakeGPIO
+#Run with 'python3 gpio_shadow.py'
+if __name__ == "__main__":
+    import plant_sim
+    import ThrottleByWire as tbw
+    print("control loop on the simulated golf car, 20 s, steps made in the loop (use_motion_engine = False)")
+    print("shadow  loops  pin_writes_to_gpio  suppressed  stepper_pulses  final_speed")
+    for shadow in (False, True):
+        backend, trace = plant_sim.simulate(20, settings = {'shadow_gpio': shadow, 'use_motion_engine': False})
+        suppressed = tbw.GPIO.suppressed if shadow else 0
+        print(str(shadow).ljust(6), str(backend.cycles).rjust(6), str(backend.gpio.writes).rjust(19), str(suppressed).rjust(11), str(backend.plant.pulses).rjust(15), str(round(trace[-1][2], 3)).rjust(12))
+    #same mode most loops, DIR written for every step (like step_open()/step_close() without the motion engine)
+    pattern = [('1/8', 1, 3), ('1/8', 1, 2), ('1/8', -1, 1), ('1/16', -1, 2), ('1/16', -1, 1), ('Full', 1, 4)]*500
+    print("\n3000 loops of mode/dir/step writes on a FakeGPIO")
+    print("backend                  gpio_calls  banked  suppressed")
+    for name, shadow, bank in (('no shadow', False, False), ('shadow', True, False), ('shadow + banked writes', True, True)):
+        fake = FakeGPIO()
+        gpio = ShadowGPIO(fake, deferred = tbw.MODE + (tbw.DIR,), passthrough = (tbw.STEP,), bank = fake.bank if bank else None) if shadow else fake
+        for mode, direction, steps in pattern:
+            gpio.output(tbw.MODE, tbw.RESOLUTION[mode])
+            for i in range(steps):
+                gpio.output(tbw.DIR, tbw.CW if direction > 0 else tbw.CCW)
+                gpio.output(tbw.STEP, 1)
+                gpio.output(tbw.STEP, 0)
+        print(name.ljust(24), str(fake.calls + fake.bank.writes).rjust(10), str(fake.bank.writes).rjust(7), str(gpio.suppressed if shadow else 0).rjust(11))
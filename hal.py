@@ -0,0 +1,191 @@
+#Hardware abstraction for ThrottleByWire.py
+#The control loop only talks to the sensors and the stepper driver through a 'backend', so the same loop can run on the Pi (RealBackend)
+#or against the simulated golf car in plant_sim.py (SimBackend), with no Pi, ADS1115 or DRV8825 needed.
+#
+#A backend has:
+#    gpio ------------ RPi.GPIO, or something that acts like it (setmode/setup/output/cleanup, BCM/OUT/HIGH/LOW)
+#    gpio_bank() ----- banked GPIO register writer for gpio_shadow.ShadowGPIO, or None
+#    adc_channels ---- ADS1115 channels in channel order (pedal, axle speed, tps, pedal switch), each with '.value' (raw code) and '.voltage'
+#    adc_gain -------- ADS1115 gain
+#    clock ----------- now() and sleep_until(), used by the stepper motion engine
+#    realtime -------- True if time is real (background threads can be used), False if simulated
+#    now()/sleep() --- time in seconds, and wait
+#    cycle() --------- called once at the start of every control loop (simulator moves time forward here)
+#    acquisition() --------- makes the ADS1115 acquisition engine (real hardware only)
+#    motion_engine() ------- makes the stepper motion engine
+#    telemetry_recorder() -- makes the telemetry recorder
+#    close()
+#The engines are made by the backend, so a backend can hand the loop something that acts like them instead (see mp_runtime.py, where they are in other processes).
+
+
+#####Library Imports
+import time
+import timing
+import gpio_shadow
+from stepper_motion import RealClock, SimClock
+from ads_acquisition import AcquisitionEngine, BusioBackend, gpio_ready_waiter
+from calibration import volts_from_code
+from stepper_motion import MotionEngine
+from telemetry_recorder import TelemetryRecorder
+#####
+
+
+
+class RealBackend: #the Pi, ADS1115 and DRV8825
+    #Nothing is opened until it is first used: the GPIO pins when setup() sets them up, the I2C bus when the acquisition engine starts,
+    #and the adafruit ADS1115 objects only if the loop reads the channels directly (without the acquisition engine), so their import and setup time is not spent otherwise.
+    realtime = True
+
+    def __init__(self, gain = 1):
+        self.adc_gain = gain
+        self.clock = RealClock()
+        self._gpio = None
+        self._i2c = None
+        self._adc_channels = None
+
+    @property
+    def gpio(self):
+        if self._gpio is None:
+            import RPi.GPIO as GPIO #hardware libraries are imported here, so importing this file (or ThrottleByWire.py) does not need them
+            self._gpio = GPIO
+        return self._gpio
+
+    @property
+    def i2c(self):
+        if self._i2c is None:
+            import board
+            import busio
+            #Create the I2C bus
+            self._i2c = busio.I2C(board.SCL, board.SDA)
+        return self._i2c
+
+    @property
+    def adc_channels(self):
+        if self._adc_channels is None:
+            #Note: To install the package necessary for using the ads module, try 'sudo pip3 install adafruit-circuitpython-ads1x15'
+            import adafruit_ads1x15.ads1115 as ADS
+            from adafruit_ads1x15.analog_in import AnalogIn
+            #Create the ADC object using the I2C bus
+            self.ads = ADS.ADS1115(self.i2c)
+            self.ads.gain = self.adc_gain #GAIN
+            #Create single ended inputs (use 'channel_name.voltage' to get voltage)
+            self._adc_channels = (AnalogIn(self.ads, ADS.P0), #Pedal Position Sensor
+                                  AnalogIn(self.ads, ADS.P1), #Axle Shaft Speed Sensor
+                                  AnalogIn(self.ads, ADS.P2), #Throttle Position Sensor
+                                  AnalogIn(self.ads, ADS.P3)) #Pedal Switch
+        return self._adc_channels
+
+    def now(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds): #short waits (step delays) are spun, time.sleep can not do them (see timing.py)
+        timing.sleep(seconds)
+
+    def cycle(self):
+        pass
+
+    def adc_bus(self):
+        return BusioBackend(self.i2c)
+
+    def ready_waiter(self, pin):
+        return gpio_ready_waiter(self.gpio, pin)
+
+    def acquisition(self, schedule, data_rate, ready_pin = None, filters = None): #ADS1115 sampling thread (see ads_acquisition.py)
+        return AcquisitionEngine(self.adc_bus(), schedule, data_rate, self.adc_gain, self.ready_waiter(ready_pin) if ready_pin is not None else None, filters)
+
+    def gpio_bank(self): #GPIO set/clear registers through /dev/gpiomem (Pi 1-4 only)
+        return gpio_shadow.gpiomem_bank()
+
+    def motion_engine(self, gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw): #real hardware, motion engine runs on its own thread
+        return MotionEngine(gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw, self.clock)
+
+    def telemetry_recorder(self, directory, records_per_file):
+        return TelemetryRecorder(directory, records_per_file)
+
+    def close(self):
+        if self._i2c is not None:
+            try:
+                self._i2c.deinit()
+            except AttributeError:
+                pass
+
+
+
+class SimChannel: #simulated ADS1115 channel, every read is a blocking single shot conversion (costs one conversion time of simulated time)
+    def __init__(self, backend, ch):
+        self.backend = backend
+        self.ch = ch
+
+    @property
+    def value(self):
+        self.backend.advance(self.backend.conversion_time)
+        return self.backend.plant.code(self.ch)
+
+    @property
+    def voltage(self):
+        return volts_from_code(self.value, self.backend.adc_gain)
+
+
+class SimBackend: #simulated golf car (see plant_sim.py), time is simulated so it runs much faster than real time
+    #cycle_time ------- simulated time the loop's own computing takes each loop (the sensor reads and step sleeps add their own time)
+    #conversion_time -- simulated time of one ADS1115 single shot read (1/860 s at the fastest data rate)
+    #record_every ----- simulated seconds between entries in 'trace' (None to not record)
+    realtime = False
+
+    def __init__(self, plant, cycle_time = 0.0002, conversion_time = 1/860, record_every = 0.05):
+        self.plant = plant
+        self.clock = SimClock()
+        from plant_sim import PlantGPIO #imported here so the real hardware path does not load the simulator
+        self.gpio = PlantGPIO(self.clock, plant)
+        self.adc_gain = plant.gain
+        self.adc_channels = tuple(SimChannel(self, ch) for ch in range(4))
+        self.cycle_time = cycle_time
+        self.conversion_time = conversion_time
+        self.record_every = record_every
+        self.next_record = 0.0
+        self.trace = [] #(t, pedal, speed, throttle_deg)
+        self.motion = None
+        self.cycles = 0
+
+    def gpio_bank(self):
+        return None
+
+    def motion_engine(self, gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw): #the stepper motion engine pulses are made by advance() instead of a thread
+        self.motion = MotionEngine(gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw, self.clock)
+        return self.motion
+
+    def telemetry_recorder(self, directory, records_per_file):
+        return TelemetryRecorder(directory, records_per_file)
+
+    def advance(self, seconds): #move simulated time forward, making any stepper pulses due in that time
+        end = self.clock.now() + seconds
+        if self.motion is not None:
+            self.motion.run_until(end)
+        self.clock.sleep_until(end)
+        self.plant.update(end)
+        if self.record_every is not None and end >= self.next_record:
+            plant = self.plant
+            self.trace.append((end, plant.pedal(end), plant.speed, plant.throttle_deg))
+            self.next_record = end + self.record_every
+
+    def now(self):
+        return self.clock.now()
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def cycle(self):
+        self.cycles += 1
+        self.advance(self.cycle_time)
+
+    def adc_bus(self):
+        raise RuntimeError("SimBackend reads the ADC channels directly, the acquisition engine is not used")
+
+    def ready_waiter(self, pin):
+        raise RuntimeError("SimBackend has no ALRT/RDY pin")
+
+    def acquisition(self, schedule, data_rate, ready_pin = None, filters = None):
+        raise RuntimeError("SimBackend reads the ADC channels directly, the acquisition engine is not used")
+
+    def close(self):
+        pass
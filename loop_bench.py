@@ -0,0 +1,239 @@
+#Control loop latency and jitter benchmark for ThrottleByWire.py
+#Runs the control loop against the simulated golf car (hal.SimBackend) and times every loop and every stage of the loop with time.perf_counter().
+#Stage times are 'exclusive', so time the simulator spends making stepper pulses or moving the car is counted as 'simulator' and not as part of the stage that caused it.
+#The loop period percentiles and jitter are worked out per loop with that loop's simulator time taken off (the Pi has no simulator to wait on),
+#'period_with_simulator_us' is the raw period.
+#Also times the sensor conversion functions (ax_spd_sens_v_to_veh_spd etc.) directly, since the loop now uses the lookup tables instead.
+#Results are printed, and can be saved as JSON (--json) and checked against limits (--thresholds), so changes to the loop can come with before and after numbers.
+#
+#Examples:
+#    python3 loop_bench.py
+#    python3 loop_bench.py --cycles 20000 --json before.json
+#    python3 loop_bench.py --set use_motion_engine=False --set use_step_batches=False --json original_stepping.json
+#    python3 loop_bench.py --thresholds bench_limits.json     (exits with code 1 if any limit is exceeded)
+#Thresholds file is JSON of result paths to maximum values, e.g. {"loop.period_us.p99": 200, "loop.jitter_us.p99_minus_p50": 100, "stages.read_frame.p99_us": 100}
+
+
+#####Library Imports
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import hal
+import plant_sim
+import ThrottleByWire as tbw
+#####
+
+
+
+STAGES = ('read_frame', 'step_mode', 'delay', 'set_step_mode', 'step_count', 'step_open', 'step_close') #ThrottleByWire functions timed inside the loop
+CONVERSIONS = ('ax_spd_sens_v_to_veh_spd', 'pps_v_to_des_spd', 'tps_v_to_deg_throttle', 'pedalswitchstate') #conversion functions timed on their own
+
+
+
+class StageTimer: #exclusive time per stage: time spent in a timed stage called from inside another is taken off the outer one
+    def __init__(self, names):
+        self.samples = {name: [] for name in names}
+        self.stack = [] #child time of each stage currently running
+
+    def wrap(self, name, func):
+        samples = self.samples.setdefault(name, [])
+        stack = self.stack
+        def timed(*args, **kwargs):
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                child = stack.pop()
+                samples.append(elapsed - child)
+                if stack:
+                    stack[-1] += elapsed
+        return timed
+
+
+
+def summary_us(samples): #percentiles of a list of seconds, in microseconds
+    if len(samples) == 0:
+        return {'count': 0}
+    a = np.asarray(samples)*1e6
+    return {'count': int(a.size), 'mean': float(a.mean()), 'p50': float(np.percentile(a, 50)), 'p99': float(np.percentile(a, 99)),
+            'max': float(a.max()), 'min': float(a.min()), 'std': float(a.std())}
+
+
+def run_loop_benchmark(cycles = 10000, settings = None, plant = None, warmup = 200): #time the control loop for a number of loops, returns results dict
+    settings = dict(settings or {})
+    settings.setdefault('print_enabled', False)
+    old_settings = {name: getattr(tbw, name) for name in settings}
+    old_funcs = {name: getattr(tbw, name) for name in STAGES}
+    for name, value in settings.items():
+        setattr(tbw, name, value)
+    timer = StageTimer(STAGES + ('simulator',))
+    backend = hal.SimBackend(plant if plant is not None else plant_sim.GolfCarPlant(), record_every = None)
+    loop_starts = []
+    loop_sim_counts = [] #number of simulator samples made before each loop start
+    sim_samples = timer.samples['simulator']
+    original_cycle = backend.cycle
+    first_counted = {} #number of samples of each stage made during the warmup loops
+    def cycle():
+        loop_starts.append(time.perf_counter())
+        loop_sim_counts.append(len(sim_samples))
+        if len(loop_starts) == warmup + 1:
+            first_counted.update({name: len(samples) for name, samples in timer.samples.items()})
+        original_cycle()
+    backend.cycle = cycle
+    backend.advance = timer.wrap('simulator', backend.advance)
+    for name in STAGES:
+        setattr(tbw, name, timer.wrap(name, old_funcs[name]))
+    try:
+        tbw.run(backend, max_cycles = cycles + warmup)
+    finally:
+        for name, func in old_funcs.items():
+            setattr(tbw, name, func)
+        for name, value in old_settings.items():
+            setattr(tbw, name, value)
+    #drop the warmup loops (first sensor reads, window filling)
+    raw_periods = np.diff(np.asarray(loop_starts[warmup:]))
+    sim_cumulative = np.concatenate(([0.0], np.cumsum(sim_samples)))
+    counts = np.asarray(loop_sim_counts[warmup:])
+    loop_sim = sim_cumulative[counts[1:]] - sim_cumulative[counts[:-1]] #simulator time inside each loop
+    periods = raw_periods - loop_sim
+    period_us = periods*1e6
+    total_loop = float(np.sum(raw_periods))
+    stage_samples = {name: samples[first_counted.get(name, 0):] for name, samples in timer.samples.items()}
+    total_sim = float(np.sum(stage_samples['simulator']))
+    total_stages = float(sum(np.sum(samples) for samples in stage_samples.values()))
+    results = {
+        'cycles': int(len(periods)),
+        'simulated_seconds': backend.now(),
+        'settings': {name: repr(value) for name, value in settings.items()},
+        'loop': {
+            'period_us': summary_us(periods), #control loop only, each loop's simulator time taken off
+            'period_with_simulator_us': summary_us(raw_periods),
+            'jitter_us': {'std': float(period_us.std()) if len(period_us) else 0.0,
+                          'p99_minus_p50': float(np.percentile(period_us, 99) - np.percentile(period_us, 50)) if len(period_us) else 0.0},
+            'simulator_fraction': total_sim/total_loop if total_loop else 0.0, #share of the loop time spent in the simulator, not the control loop
+            'untimed_us_mean': (total_loop - total_stages)/len(periods)*1e6 if len(periods) else 0.0, #loop body outside the timed stages (accel rate window, step/tps history, branch logic)
+        },
+        'stages': {},
+    }
+    for name, samples in stage_samples.items():
+        s = summary_us(samples)
+        results['stages'][name] = {'calls': s['count'], 'total_us': float(np.sum(samples)*1e6)}
+        for key in ('mean', 'p50', 'p99', 'max'):
+            if key in s:
+                results['stages'][name][key + '_us'] = s[key]
+    return results
+
+
+def run_conversion_benchmark(n = 5000, plant = None): #time the sensor conversion functions on their own (simulated channels, so no waiting on a bus)
+    backend = hal.SimBackend(plant if plant is not None else plant_sim.GolfCarPlant(), conversion_time = 0.0, record_every = None)
+    old_print = tbw.print_enabled
+    tbw.print_enabled = False
+    tbw.setup(backend)
+    results = {}
+    try:
+        for name in CONVERSIONS:
+            func = getattr(tbw, name)
+            samples = []
+            for i in range(n):
+                start = time.perf_counter()
+                func()
+                samples.append(time.perf_counter() - start)
+            s = summary_us(samples)
+            results[name] = {'calls': s['count'], 'mean_us': s['mean'], 'p50_us': s['p50'], 'p99_us': s['p99'], 'max_us': s['max']}
+        #same values through the lookup tables, for comparison
+        for name, table, ch in (('table_veh_spd', tbw.tables.axle, tbw.AXLE_CH), ('table_des_spd', tbw.tables.pps, tbw.PPS_CH), ('table_tps_deg', tbw.tables.tps, tbw.TPS_CH)):
+            samples = []
+            for i in range(n):
+                start = time.perf_counter()
+                table[tbw.read_code(ch)]
+                samples.append(time.perf_counter() - start)
+            s = summary_us(samples)
+            results[name] = {'calls': s['count'], 'mean_us': s['mean'], 'p50_us': s['p50'], 'p99_us': s['p99'], 'max_us': s['max']}
+    finally:
+        tbw.shutdown()
+        tbw.print_enabled = old_print
+    return results
+
+
+
+def lookup(results, path): #value at a dotted path like 'loop.period_us.p99'
+    value = results
+    for key in path.split('.'):
+        value = value[key]
+    return value
+
+def check_thresholds(results, thresholds): #returns list of (path, value, limit) that are over their limit
+    failures = []
+    for path, limit in thresholds.items():
+        try:
+            value = lookup(results, path)
+        except (KeyError, TypeError):
+            failures.append((path, None, limit))
+            continue
+        if value > limit:
+            failures.append((path, value, limit))
+    return failures
+
+def parse_setting(text): #'name=value' to (name, value), value read as a python literal if it can be (True, 12, 0.5...)
+    import ast
+    name, _, value = text.partition('=')
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return name.strip(), value
+
+
+def print_results(results):
+    loop = results['loop']
+    p = loop['period_us']
+    print("loops:", results['cycles'], "  simulated time:", round(results['simulated_seconds'], 2), "s")
+    print("loop period us (without simulator)   mean:", round(p['mean'], 1), " p50:", round(p['p50'], 1), " p99:", round(p['p99'], 1), " max:", round(p['max'], 1))
+    print("jitter us (without simulator)         std:", round(loop['jitter_us']['std'], 1), " p99-p50:", round(loop['jitter_us']['p99_minus_p50'], 1))
+    print("simulator share of loop time:", round(loop['simulator_fraction']*100, 1), "%   loop period with simulator (mean):", round(loop['period_with_simulator_us']['mean'], 1), "us")
+    print("loop time outside the timed stages (mean):", round(loop['untimed_us_mean'], 1), "us")
+    print("stage            calls     mean_us   p50_us    p99_us    max_us")
+    for name, s in results['stages'].items():
+        if s['calls']:
+            print(name.ljust(16), str(s['calls']).rjust(6), *[str(round(s[k], 2)).rjust(9) for k in ('mean_us', 'p50_us', 'p99_us', 'max_us')])
+    if 'conversions' in results:
+        print("conversion                  mean_us   p50_us    p99_us")
+        for name, s in results['conversions'].items():
+            print(name.ljust(26), *[str(round(s[k], 2)).rjust(9) for k in ('mean_us', 'p50_us', 'p99_us')])
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Control loop latency/jitter benchmark (runs against the simulated golf car)")
+    parser.add_argument('--cycles', type = int, default = 10000, help = "number of control loops to time")
+    parser.add_argument('--set', dest = 'settings', action = 'append', default = [], metavar = 'NAME=VALUE', help = "change a ThrottleByWire setting first (can be repeated)")
+    parser.add_argument('--noise', type = float, default = 0.0, help = "sensor noise (volts) in the simulated car")
+    parser.add_argument('--no-conversions', action = 'store_true', help = "skip timing the conversion functions")
+    parser.add_argument('--json', help = "save results to this JSON file")
+    parser.add_argument('--thresholds', help = "JSON file of result paths to maximum values, exit code 1 if any is exceeded")
+    args = parser.parse_args()
+
+    settings = dict(parse_setting(s) for s in args.settings)
+    results = run_loop_benchmark(args.cycles, settings, plant_sim.GolfCarPlant(noise = args.noise))
+    if not args.no_conversions:
+        results['conversions'] = run_conversion_benchmark()
+    results['platform'] = {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()}
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
+        print("saved", args.json)
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+        failures = check_thresholds(results, thresholds)
+        for path, value, limit in failures:
+            print("OVER LIMIT:", path, "=", value, " limit:", limit)
+        if failures:
+            sys.exit(1)
+        print("all", len(thresholds), "limits met")
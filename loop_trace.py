@@ -0,0 +1,226 @@
+#Low overhead tracing for ThrottleByWire.py
+#The main loop used to build and print a long status line every 'print_itr_reset_count' loops. print() waits on the terminal (or the SSH session),
+#so a slow terminal held up the throttle loop while it printed.
+#Now the loop only records small timestamped events (sensor read, conversion, step decision, GPIO write, sleep, status values) into a preallocated ring buffer,
+#and a separate thread (TraceConsumer) drains the buffer to print the status lines or save the events to a file. The loop never waits on either.
+#When tracing is off the loop is given a NullTracer, whose methods do nothing. When only printing is on, the Tracer records only the STATUS and WARNING events (PRINT_KINDS).
+#
+#The ring is written by the control loop only and read by the consumer only, so no lock is needed: the loop fills a slot and then moves 'head' on,
+#the consumer only reads slots before 'head'. If the consumer falls more than one ring behind, the oldest events are lost (counted in 'dropped'), the loop is never held up.
+
+
+#####Library Imports
+import time
+import threading
+#####
+
+
+
+#Event kinds
+CYCLE = 0 #start of a control loop (value is the loop number)
+SENSOR_READ = 1 #sensor frame captured (duration is the read time)
+CONVERSION = 2 #raw codes converted to speeds/degrees (duration is the conversion time)
+STEP_DECISION = 3 #steps chosen this loop (value is signed number of steps, 0 for no move)
+GPIO_WRITE = 4 #pin write (value is what was written, e.g. the step mode)
+SLEEP = 5 #loop waited (duration is the time slept)
+STATUS = 6 #values that used to be printed (value is a tuple, see STATUS_FIELDS)
+WARNING = 7 #something to show the user (value is the message)
+
+KIND_NAMES = {CYCLE: 'cycle', SENSOR_READ: 'sensor_read', CONVERSION: 'conversion', STEP_DECISION: 'step_decision',
+              GPIO_WRITE: 'gpio_write', SLEEP: 'sleep', STATUS: 'status', WARNING: 'warning'}
+STATUS_FIELDS = ('tps_deg', 'act_spd', 'des_spd', 'accel_rate', 'step_mode', 'step_delay', 'psw')
+PRINT_KINDS = (STATUS, WARNING) #the events StatusPrinter uses
+
+
+
+class Tracer: #preallocated ring of (time, kind, duration, value) events
+    enabled = True
+
+    def __init__(self, size = 8192, clock = time.perf_counter, kinds = None): #kinds: event kinds to record (e.g. PRINT_KINDS), None for all, the others are skipped before the clock is read
+        if size < 1:
+            raise ValueError("Tracer size must be at least 1")
+        self.size = size
+        self.clock = clock
+        self.recorded = [kinds is None or kind in kinds for kind in range(len(KIND_NAMES))] #indexed by kind
+        #parallel preallocated lists, recording an event is four list stores (no new list/array is made)
+        self.times = [0.0]*size
+        self.kinds = [0]*size
+        self.durations = [0.0]*size
+        self.values = [None]*size
+        self.head = 0 #total events recorded (next slot is head % size)
+        self.tail = 0 #total events the consumer has read
+        self.dropped = 0 #events overwritten before the consumer read them
+
+    def now(self):
+        return self.clock()
+
+    def event(self, kind, value = None, duration = 0.0, t = None): #record an event (time is now unless given)
+        if not self.recorded[kind]:
+            return
+        i = self.head % self.size
+        self.times[i] = self.clock() if t is None else t
+        self.kinds[i] = kind
+        self.durations[i] = duration
+        self.values[i] = value
+        self.head += 1
+
+    def begin(self): #start time of a stage, pass to end()
+        return self.clock()
+
+    def end(self, kind, start, value = None): #record a stage that started at 'start' (time of the event is the start time)
+        if not self.recorded[kind]:
+            return
+        i = self.head % self.size
+        self.times[i] = start
+        self.kinds[i] = kind
+        self.durations[i] = self.clock() - start
+        self.values[i] = value
+        self.head += 1
+
+    def drain(self, limit = None): #events recorded since the last drain, oldest first, as (time, kind, duration, value) (consumer side)
+        head = self.head
+        tail = self.tail
+        if head - tail > self.size: #consumer fell behind, oldest events were overwritten
+            self.dropped += head - tail - self.size
+            tail = head - self.size
+        if limit is not None:
+            head = min(head, tail + limit)
+        events = []
+        for n in range(tail, head):
+            i = n % self.size
+            events.append((self.times[i], self.kinds[i], self.durations[i], self.values[i]))
+        #the loop may have lapped the consumer while copying, drop anything that was overwritten during the copy
+        overrun = self.head - self.size - tail
+        if overrun > 0:
+            events = events[overrun:]
+            self.dropped += overrun
+        self.tail = head
+        return events
+
+    def pending(self):
+        return min(self.head - self.tail, self.size)
+
+
+class NullTracer: #used when tracing is off, every method does nothing
+    enabled = False
+    head = 0
+    dropped = 0
+
+    def now(self):
+        return 0.0
+
+    def event(self, kind, value = None, duration = 0.0, t = None):
+        pass
+
+    def begin(self):
+        return 0.0
+
+    def end(self, kind, start, value = None):
+        pass
+
+    def drain(self, limit = None):
+        return []
+
+    def pending(self):
+        return 0
+
+
+
+#####Consumers (run on the TraceConsumer thread, never on the control loop)
+class StatusPrinter: #prints the STATUS and WARNING events, same line the main loop used to print
+    def __call__(self, events):
+        for t, kind, duration, value in events:
+            if kind == STATUS:
+                tps_deg, act_spd, des_spd, accel_rate, mode, step_delay, psw = value
+                print("tps_deg:",round(tps_deg,2),"deg  ","act_spd:",round(act_spd,2)," Des_veh_spd:",round(des_spd,2),"  accel_rate:",round(accel_rate,2)," mph/s","  step mode is: ",mode,"min delay is:",round(step_delay,7),"  psw is: ",psw)
+            elif kind == WARNING:
+                print(value)
+
+
+class CsvTraceWriter: #saves every event to a csv file (time, kind, duration, value)
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.file.write("time,kind,duration,value\n")
+
+    def __call__(self, events):
+        write = self.file.write
+        for t, kind, duration, value in events:
+            if isinstance(value, tuple):
+                value = ' '.join(str(v) for v in value)
+            write("%.7f,%s,%.7f,%s\n" % (t, KIND_NAMES.get(kind, kind), duration, '' if value is None else value))
+
+    def close(self):
+        self.file.close()
+
+
+class StageStats: #per kind event count and total/max duration (e.g. to see how long sensor reads take on the car)
+    def __init__(self):
+        self.count = {}
+        self.total = {}
+        self.max = {}
+
+    def __call__(self, events):
+        for t, kind, duration, value in events:
+            self.count[kind] = self.count.get(kind, 0) + 1
+            self.total[kind] = self.total.get(kind, 0.0) + duration
+            if duration > self.max.get(kind, 0.0):
+                self.max[kind] = duration
+
+    def summary(self): #{kind name: (count, mean duration, max duration)}
+        return {KIND_NAMES.get(kind, kind): (n, self.total[kind]/n, self.max[kind]) for kind, n in self.count.items()}
+
+
+class TraceConsumer: #thread that drains a tracer every 'interval' seconds and hands the events to each handler
+    def __init__(self, tracer, handlers, interval = 0.05):
+        self.tracer = tracer
+        self.handlers = list(handlers)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self): #drain once and pass the events on (the thread does this, can also be called directly, e.g. by the simulator)
+        events = self.tracer.drain()
+        if events:
+            for handler in self.handlers:
+                handler(events)
+        return len(events)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = "trace-consumer", daemon = True)
+            self._thread.start()
+        return self
+
+    def stop(self): #stop the thread, pass on anything still in the ring and close the handlers that have close()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout = 1)
+            self._thread = None
+        self.poll()
+        for handler in self.handlers:
+            if hasattr(handler, 'close'):
+                handler.close()
+#####
+
+
+
+#Time the cost of recording an event, tracing on vs off
+#Run with 'python3 loop_trace.py'
+if __name__ == "__main__":
+    n = 200000
+    for tracer in (NullTracer(), Tracer(8192)):
+        start = time.perf_counter()
+        for i in range(n):
+            s = tracer.begin()
+            tracer.end(SENSOR_READ, s)
+        elapsed = time.perf_counter() - start
+        print(type(tracer).__name__.ljust(10), "begin()+end():", round(elapsed/n*1e9), "ns")
+    stats = StageStats()
+    consumer = TraceConsumer(tracer, [stats])
+    consumer.poll()
+    print("events drained:", stats.count.get(SENSOR_READ, 0), "  dropped (ring smaller than events recorded, nothing was draining):", tracer.dropped)
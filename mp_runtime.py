@@ -0,0 +1,725 @@
+#Multi-process runtime for ThrottleByWire.py
+#ThrottleByWire.py runs everything in one thread: I2C reads, conversions, step pulses, sleeps and prints all share one core (and the GIL), so any slow stage holds up the throttle.
+#The Pi has four cores. This runs the same control loop split into processes, one for each job:
+#    acquisition --- ADS1115 acquisition engine (see ads_acquisition.py), publishes the latest raw code of every channel
+#    control ------- the unchanged control loop, run() from ThrottleByWire.py with a ShmControlBackend, publishes the target stepper position and step mode every loop
+#    actuation ----- owns the stepper driver pins and the motion engine (see stepper_motion.py), moves the motor to the latest target, and runs the watchdog
+#    telemetry ----- saves the control loop's records to .npy files (see telemetry_recorder.py), only started if record_telemetry is on
+#The processes pass fixed layout records through shared memory rings (ShmRing), nothing is pickled while running.
+#Each ring has one writer. Every record has a sequence number, readers use it to tell new records from old ones. Each ring also has a process shared lock
+#held while a record is written or copied (see ShmRing for why the sequence numbers alone are not enough on the Pi).
+#
+#Watchdog: the control loop publishes a command every loop, even if nothing changed (its heartbeat). If the actuation process sees no new command for 'watchdog_timeout' seconds
+#(control process stalled, crashed or stopped), it stops the motor and sets SLEEP low, which lets the return spring close the throttle.
+#By default it stays asleep until the runtime is started again (latched). The parent process also watches the processes and stops everything if one of them dies.
+#
+#'python3 mp_runtime.py' runs on the Pi. 'python3 mp_runtime.py --sim 20' runs 20 s against the simulated golf car in real time (the actuation process moves the simulated car,
+#the acquisition process reads it through a fake ADS1115), '--stall 8' also freezes the control process 8 s in to show the watchdog.
+
+
+#####Library Imports
+import os
+import time
+import signal
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import ThrottleByWire as tbw
+import timing
+import gpio_shadow
+from adc_filters import ChannelFilters
+from ads_acquisition import AcquisitionEngine, FakeADS1115Bus, Sample
+import calibration
+from calibration import volts_from_code
+from sensor_frame import STEP_DIVISOR, TICKS_PER_STEP
+from stepper_motion import MotionEngine, RealClock, SimulatedGPIO, ticks_per_pulse, stop_position
+from telemetry_recorder import TelemetryRecorder, RECORD_DTYPE, STEP_MODES, MODE_INDEX
+#####
+
+
+
+#####Record layouts (first field of every record is its sequence number, 1 for the first record written, 0 while a slot is being written)
+SENSOR_DTYPE = np.dtype([('seq', 'u8'), ('t', 'f8'), #time of the newest sample
+                         ('code', 'i2', (4,))]) #latest raw ADS1115 code of each channel (0 for channels not in the schedule)
+COMMAND_DTYPE = np.dtype([('seq', 'u8'), ('t', 'f8'), #time the control loop published it
+                          ('target', 'i8'), #target stepper position, ticks (1/64 steps)
+                          ('mode', 'i1')]) #requested step mode, index in STEP_MODES
+STATUS_DTYPE = np.dtype([('seq', 'u8'), ('t', 'f8'),
+                         ('position', 'i8'), ('target', 'i8'), #motion engine position/target, ticks
+                         ('mode', 'i1'), #step mode the MODE pins are set to, index in STEP_MODES
+                         ('velocity', 'f4'), #motion engine speed, full steps per second (signed, positive is opening)
+                         ('asleep', 'i1'), #SLEEP pin low (waiting for the first command, or watchdog tripped)
+                         ('trips', 'u4'), #watchdog trips
+                         ('commands', 'u8')]) #commands received
+PLANT_DTYPE = np.dtype([('seq', 'u8'), ('t', 'f8'), #simulator only, the simulated car's sensor voltages (and state, for printing)
+                        ('voltage', 'f8', (4,)), ('pedal', 'f8'), ('speed', 'f8'), ('throttle_deg', 'f8')])
+TELEMETRY_DTYPE = np.dtype([('seq', 'u8')] + RECORD_DTYPE.descr) #telemetry_recorder record with a sequence number in front
+#####
+
+
+
+class ShmRing: #ring of fixed layout records in shared memory, one writer process and any number of reader processes
+    #dtype ------ numpy record layout, the first field must be 'seq' ('u8')
+    #capacity --- records kept (a reader that falls further behind than this loses the oldest ones)
+    #name ------- shared memory name of an existing ring to attach to (from another process), None makes a new one
+    #lock ------- the ring's lock (from spec()), a new one is made with a new ring
+    #The writer marks the slot as being written (seq 0), writes the fields, then writes the seq and moves the head on.
+    #Readers copy a slot and check its seq before and after the copy, so a record overwritten part way through the copy is never used.
+    #That check alone is a seqlock without memory barriers: numpy stores are plain stores, and the Pi's ARM cores do not promise other cores see them in program order,
+    #so a reader could see the new seq before the fields. The writer and readers therefore also hold the ring's lock (a semaphore, which does have the barriers).
+    #A process stopped while holding it (crash, SIGSTOP) must not hold up the others (the watchdog reads the command ring), so the lock is only waited on for 'lock_timeout':
+    #a reader then sees nothing new, and the writer writes anyway (counted in 'contended', the seq check still applies).
+    HEADER = 64 #bytes before the records, holds the seq of the newest record
+    lock_timeout = 0.002
+
+    def __init__(self, dtype, capacity = 256, name = None, lock = None):
+        self.dtype = np.dtype(dtype)
+        if self.dtype.names[0] != 'seq':
+            raise ValueError("ShmRing records must start with a 'seq' field")
+        self.capacity = capacity
+        self.lock = lock if lock is not None else multiprocessing.get_context('spawn').Lock() #spawn context, same as the runtime's processes
+        self.contended = 0 #writes made without the lock
+        self.owner = name is None #the process that made the ring removes it
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create = True, size = self.HEADER + capacity*self.dtype.itemsize) #new shared memory is all zeros
+        else:
+            self.shm = shared_memory.SharedMemory(name = name)
+        self.head_seq = np.ndarray((1,), np.uint64, self.shm.buf, 0)
+        self.records = np.ndarray((capacity,), self.dtype, self.shm.buf, self.HEADER)
+        self.seqs = self.records['seq']
+        self.last_seq = int(self.head_seq[0]) #writer side count
+
+    def spec(self): #what another process needs to attach to this ring: ShmRing(*spec) (pass it as a Process argument, the lock can only be sent that way)
+        return (self.dtype.descr, self.capacity, self.shm.name, self.lock)
+
+    #Writer side
+    def write(self, values): #add a record, a tuple of the fields after 'seq', returns its seq
+        locked = self.lock.acquire(timeout = self.lock_timeout)
+        if not locked:
+            self.contended += 1
+        try:
+            seq = self.last_seq + 1
+            i = (seq - 1) % self.capacity
+            self.seqs[i] = 0 #slot is being written
+            self.records[i] = (0,) + values
+            self.seqs[i] = seq
+            self.head_seq[0] = seq
+            self.last_seq = seq
+        finally:
+            if locked:
+                self.lock.release()
+        return seq
+
+    #Reader side
+    def head(self): #seq of the newest record (0 if none yet), cheap way to see if anything new was written
+        return int(self.head_seq[0])
+
+    def latest(self): #newest record (a copy), or None if nothing was written yet (or the lock could not be had)
+        if not self.lock.acquire(timeout = self.lock_timeout):
+            return None
+        try:
+            seq = int(self.head_seq[0])
+            if seq == 0:
+                return None
+            i = (seq - 1) % self.capacity
+            record = self.records[i:i + 1].copy()[0]
+        finally:
+            self.lock.release()
+        if record['seq'] == seq and self.seqs[i] == seq: #not overwritten while copying (a write made without the lock)
+            return record
+        return None
+
+    def read_since(self, seq): #records written after 'seq', oldest first (copies), returns (records, number lost, newest seq)
+        if not self.lock.acquire(timeout = self.lock_timeout):
+            return self.records[:0].copy(), 0, seq
+        try:
+            head = int(self.head_seq[0])
+            first = max(seq + 1, head - self.capacity + 1)
+            if first > head:
+                return self.records[:0].copy(), 0, seq
+            expected = np.arange(first, head + 1, dtype = np.uint64)
+            slots = (expected - 1) % self.capacity
+            records = self.records[slots] #fancy indexing copies
+        finally:
+            self.lock.release()
+        good = (records['seq'] == expected) & (self.seqs[slots] == expected)
+        lost = (first - seq - 1) + len(good) - int(good.sum())
+        return records[good], lost, head
+
+    def close(self):
+        del self.head_seq, self.records, self.seqs #views on the shared memory have to go before it can be closed
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+
+#####Control process side (stand ins for the engines ThrottleByWire.setup() gets from the backend, see hal.py)
+class ShmSensorReader: #acts like the AcquisitionEngine, the samples come from the acquisition process through the sensor ring
+    def __init__(self, ring, schedule, gain = 1):
+        self.ring = ring
+        self.schedule = tuple(schedule)
+        self.gain = gain
+        self.latest = [None, None, None, None]
+        self.seq = 0
+
+    def _update(self):
+        if self.ring.head() == self.seq:
+            return
+        record = self.ring.latest()
+        if record is None:
+            return
+        self.seq = int(record['seq'])
+        t = float(record['t'])
+        codes = record['code'].tolist()
+        self.latest = [Sample(ch, codes[ch], volts_from_code(codes[ch], self.gain), t, self.seq) if ch in self.schedule else None for ch in range(4)]
+
+    def start(self, timeout = 5.0): #wait for the acquisition process's first record
+        deadline = time.perf_counter() + timeout
+        while self.ring.head() == 0:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("no samples from the acquisition process")
+            time.sleep(0.001)
+        self._update()
+        return self
+
+    def stop(self):
+        pass
+
+    def snapshot(self):
+        self._update()
+        return tuple(self.latest)
+
+    def sample(self, channel):
+        return self.snapshot()[channel]
+
+    def voltage(self, channel):
+        return self.snapshot()[channel].voltage
+
+    def code(self, channel):
+        return self.snapshot()[channel].code
+
+    def stats(self):
+        return {'seq': self.seq}
+
+
+class ShmMotionProxy: #acts like the MotionEngine, the target position and step mode go to the actuation process through the command ring
+    #acceleration --- the engine's, full steps per second per second (for halt())
+    def __init__(self, command, status, acceleration = 8000):
+        self.command = command
+        self.status = status
+        self.acceleration = acceleration
+        self.target = 0 #ticks (1/64 steps)
+        self.requested_mode = 'Full'
+        self.min_position = None #travel limits, ticks (see MotionEngine.set_limits)
+        self.max_position = None
+
+    def publish(self): #send the target and mode (also sent every loop as the watchdog heartbeat)
+        self.command.write((time.perf_counter(), self.target, MODE_INDEX[self.requested_mode]))
+
+    def set_target(self, position):
+        self.target = self._clamp(int(position))
+        self.publish()
+
+    def move_by(self, ticks):
+        self.target = self._clamp(self.target + int(ticks))
+        self.publish()
+
+    def set_limits(self, min_position = None, max_position = None):
+        self.min_position = min_position
+        self.max_position = max_position
+        target = self._clamp(self.target)
+        if target != self.target:
+            self.target = target
+            self.publish()
+
+    def halt(self): #drop the rest of the move, the target is where the motor (at the speed in the latest status) can slow down to a stop, inside the travel limits
+        record = self.status.latest()
+        if record is None:
+            position = self.target
+        else:
+            position = stop_position(int(record['position']), float(record['velocity']), self.acceleration, STEP_MODES[record['mode']])
+        self.target = self._clamp(position)
+        self.publish()
+
+    _clamp = MotionEngine._clamp #same clamping as the engine
+
+    def move_steps(self, steps, mode = None):
+        self.move_by(steps*ticks_per_pulse(mode if mode is not None else self.requested_mode))
+
+    def set_mode(self, mode):
+        if mode not in STEP_DIVISOR:
+            raise ValueError("unknown step mode: " + str(mode))
+        if mode != self.requested_mode:
+            self.requested_mode = mode
+            self.publish()
+
+    @property
+    def position(self): #motor position from the actuation process's latest status
+        record = self.status.latest()
+        return int(record['position']) if record is not None else 0
+
+    def distance_to_go(self):
+        return self.target - self.position
+
+    def is_moving(self):
+        return self.position != self.target
+
+    def start(self):
+        return self
+
+    def stop(self): #the actuation process stops the motor when the runtime stops
+        pass
+
+
+class ShmTelemetryWriter: #acts like the TelemetryRecorder, the records go to the telemetry process through the telemetry ring
+    def __init__(self, ring):
+        self.ring = ring
+
+    def record(self, values):
+        self.ring.write(values)
+
+    record_frame = TelemetryRecorder.record_frame #same record layout
+
+    def start(self):
+        return self
+
+    def close(self):
+        pass
+
+
+class ShmControlBackend: #backend for the control process (see hal.py), the sensors and stepper driver belong to the other processes
+    realtime = True
+
+    def __init__(self, specs, gain = 1):
+        self.rings = {name: ShmRing(*specs[name]) for name in ('sensor', 'command', 'status', 'telemetry')}
+        self.gpio = SimulatedGPIO(RealClock()) #the actuation process drives the pins, the loop's own pin writes (setup/shutdown) go nowhere
+        self.adc_channels = None #every read goes through the ShmSensorReader
+        self.adc_gain = gain
+        self.clock = RealClock()
+        self.motion = None
+
+    def now(self):
+        return time.perf_counter() #CLOCK_MONOTONIC on Linux, the same time in every process
+
+    def sleep(self, seconds):
+        timing.sleep(seconds)
+
+    def cycle(self): #heartbeat for the watchdog, every loop
+        if self.motion is not None:
+            self.motion.publish()
+
+    def acquisition(self, schedule, data_rate, ready_pin = None, filters = None): #samples are already filtered by the acquisition process
+        return ShmSensorReader(self.rings['sensor'], schedule, self.adc_gain)
+
+    def gpio_bank(self):
+        return None
+
+    def motion_engine(self, gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw):
+        self.motion = ShmMotionProxy(self.rings['command'], self.rings['status'], acceleration)
+        return self.motion
+
+    def telemetry_recorder(self, directory, records_per_file):
+        return ShmTelemetryWriter(self.rings['telemetry'])
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+#####
+
+
+
+class Watchdog: #puts the DRV8825 to sleep if the control loop's heartbeat stops (runs in the actuation process)
+    #timeout --- seconds without a new command before tripping
+    #latch ----- stay asleep after a trip, False wakes the driver again when commands come back
+    #The driver starts asleep and is woken by the first command, so the motor is never powered without the control loop running.
+    WAKE_TIME = 0.002 #DRV8825 needs up to 1.7 ms after SLEEP goes high before it takes STEP pulses [From DRV8825 datasheet]
+
+    def __init__(self, gpio, sleep_pin, engine, timeout = 0.1, latch = True):
+        self.gpio = gpio
+        self.sleep_pin = sleep_pin
+        self.engine = engine
+        self.timeout = timeout
+        self.latch = latch
+        self.asleep = True
+        self.tripped = False
+        self.trips = 0
+        self.last_beat = None
+        self.awake_at = None
+        gpio.output(sleep_pin, 0)
+
+    def beat(self, now): #a new command came in
+        self.last_beat = now
+        if self.asleep and not (self.tripped and self.latch):
+            self.gpio.output(self.sleep_pin, 1)
+            self.asleep = False
+            self.tripped = False
+            self.awake_at = now
+            self.engine.start()
+
+    def trip(self):
+        self.engine.stop() #no more pulses, target set to where the motor is
+        self.gpio.output(self.sleep_pin, 0)
+        self.asleep = True
+        self.tripped = True
+        self.trips += 1
+
+    def ready(self, now): #checks the heartbeat, returns True if the motor may be moved
+        if self.asleep:
+            return False
+        if now - self.last_beat > self.timeout:
+            self.trip()
+            return False
+        return now - self.awake_at >= self.WAKE_TIME
+
+
+
+#####Processes (each one is started in a fresh interpreter, so ThrottleByWire.py settings are passed in and set again)
+def _apply_settings(settings):
+    for name, value in settings.items():
+        setattr(tbw, name, value)
+
+
+def acquisition_process(specs, settings, sim, stop, cpus = None, priority = None):
+    _apply_settings(settings)
+    timing.set_realtime(priority, cpus)
+    sensor = ShmRing(*specs['sensor'])
+    plant = ShmRing(*specs['plant']) if sim else None
+    hw = None
+    engine = None
+    filters = ChannelFilters(tbw.adc_filters, tbw.ads_gain) if tbw.adc_filters_enabled else None
+    try:
+        if sim: #fake ADS1115 reading the simulated car's voltages from the actuation process
+            def source(ch):
+                def volts(t):
+                    record = plant.latest()
+                    return float(record['voltage'][ch]) if record is not None else 0.0
+                return volts
+            bus = FakeADS1115Bus({ch: source(ch) for ch in range(4)}, transaction_time = 0.0002)
+            engine = AcquisitionEngine(bus, tbw.ads_schedule, tbw.ads_data_rate, tbw.ads_gain, None, filters)
+        else:
+            import hal
+            hw = hal.RealBackend(tbw.ads_gain)
+            engine = hw.acquisition(tbw.ads_schedule, tbw.ads_data_rate, tbw.ADS_RDY, filters)
+        engine.start()
+        seq = 0
+        codes = [0, 0, 0, 0]
+        while not stop.is_set():
+            if engine.seq != seq: #new sample(s), publish every channel's latest code
+                seq = engine.seq
+                t = 0.0
+                for sample in engine.snapshot():
+                    if sample is not None:
+                        codes[sample.channel] = sample.code
+                        t = max(t, sample.timestamp)
+                sensor.write((t, tuple(codes)))
+            time.sleep(engine.conversion_time/2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if engine is not None:
+            engine.stop()
+        if hw is not None:
+            hw.close()
+        sensor.close()
+        if plant is not None:
+            plant.close()
+
+
+def control_process(specs, settings, stop):
+    _apply_settings(settings)
+    hw = ShmControlBackend(specs, tbw.ads_gain)
+    try:
+        tbw.run(hw) #stopped with SIGINT (KeyboardInterrupt) by the parent
+    except KeyboardInterrupt:
+        pass
+
+
+class _PlantClock: #simulated car time, starts at the runtime's start time
+    def __init__(self, t0):
+        self.t0 = t0
+
+    def now(self):
+        return time.perf_counter() - self.t0
+
+
+def actuation_process(specs, settings, sim, stop, t0, watchdog_timeout = 0.1, latch = True, poll = 0.0005, cpus = None, priority = None):
+    _apply_settings(settings)
+    timing.set_realtime(priority, cpus)
+    command = ShmRing(*specs['command'])
+    status = ShmRing(*specs['status'])
+    sensor = ShmRing(*specs['sensor']) #TPS, to find the motor again after the watchdog let it go
+    plant_ring = ShmRing(*specs['plant']) if sim else None
+    deg_per_tick = tbw.Step_deg/TICKS_PER_STEP*tbw.throttle_deg_per_motor_deg
+    def tps_ticks(): #throttle opening from the latest TPS code, in ticks, None if there is no sample yet
+        record = sensor.latest()
+        if record is None:
+            return None
+        return round(calibration.tps_v_to_deg(volts_from_code(int(record['code'][tbw.TPS_CH]), tbw.ads_gain), tbw.cal)/deg_per_tick)
+    if sim: #the simulated car lives here, moved by the STEP pulses and published for the acquisition process
+        from plant_sim import GolfCarPlant, PlantGPIO
+        plant = GolfCarPlant(tbw.cal, throttle_deg_per_motor_deg = tbw.throttle_deg_per_motor_deg)
+        lock = threading.Lock() #plant is moved by both the pulse thread (through PlantGPIO) and this loop
+        update = plant.update
+        def locked_update(t, *args):
+            with lock:
+                update(t, *args)
+        plant.update = locked_update
+        gpio = PlantGPIO(_PlantClock(t0), plant, tbw.STEP, tbw.DIR, tbw.MODE, tbw.CW, sleep_pin = tbw.SLEEP)
+        bank = None
+    else:
+        import RPi.GPIO as gpio
+        bank = gpio_shadow.gpiomem_bank() if tbw.use_gpio_bank else None
+    if tbw.shadow_gpio:
+        gpio = gpio_shadow.ShadowGPIO(gpio, tbw.MODE + (tbw.DIR,), (tbw.STEP,), bank)
+    gpio.setmode(gpio.BCM)
+    gpio.setup(tbw.DIR, gpio.OUT)
+    gpio.setup(tbw.STEP, gpio.OUT)
+    gpio.setup(tbw.MODE, gpio.OUT)
+    gpio.setup(tbw.SLEEP, gpio.OUT)
+    gpio.output(tbw.DIR, tbw.CW)
+    engine = MotionEngine(gpio, tbw.STEP, tbw.DIR, tbw.MODE, tbw.motor_max_velocity, tbw.motor_acceleration, tbw.CW, tbw.CCW, RealClock())
+    watchdog = Watchdog(gpio, tbw.SLEEP, engine, watchdog_timeout, latch)
+    seq = 0
+    commands = 0
+    target = None
+    mode = None
+    trips = 0
+    tps_offset = None #TPS ticks minus engine position when the driver was first woken
+    try:
+        while not stop.is_set():
+            now = time.perf_counter()
+            if watchdog.trips != trips: #the engine was stopped where it was, so the next command must be applied even if its target did not change
+                trips = watchdog.trips
+                target = None
+            if command.head() != seq:
+                record = command.latest()
+                if record is not None:
+                    seq = int(record['seq'])
+                    commands += 1
+                    if watchdog.asleep and not (watchdog.tripped and watchdog.latch): #about to wake the driver
+                        ticks = tps_ticks()
+                        if ticks is not None:
+                            if tps_offset is None:
+                                tps_offset = ticks - engine.position
+                            elif watchdog.tripped: #asleep the motor holds nothing, the return spring may have moved it, so start from where the TPS says it is
+                                engine.set_position(ticks - tps_offset)
+                    watchdog.beat(now)
+                    if watchdog.ready(now):
+                        if record['mode'] != mode:
+                            mode = record['mode']
+                            engine.set_mode(STEP_MODES[mode])
+                        if record['target'] != target:
+                            target = record['target']
+                            engine.set_target(target)
+            else:
+                watchdog.ready(now)
+            if sim:
+                plant.update(now - t0)
+                plant_ring.write((now, tuple(plant.voltage(ch) for ch in range(4)), plant.pedal(plant.t), plant.speed, plant.throttle_deg))
+            status.write((now, engine.position, engine.target, MODE_INDEX[engine.mode], engine.velocity, watchdog.asleep, watchdog.trips, commands))
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        gpio.output(tbw.SLEEP, 0) #disable stepper motor
+        gpio.cleanup()
+        command.close()
+        status.close()
+        sensor.close()
+        if plant_ring is not None:
+            plant_ring.close()
+
+
+def telemetry_process(specs, settings, stop, interval = 0.05):
+    _apply_settings(settings)
+    ring = ShmRing(*specs['telemetry'])
+    recorder = TelemetryRecorder(tbw.telemetry_dir, tbw.telemetry_records_per_file).start()
+    seq = 0
+    lost = 0
+    try:
+        while True:
+            done = stop.is_set() #one more pass after stop, for the last records
+            records, n_lost, seq = ring.read_since(seq)
+            lost += n_lost
+            for values in records.tolist():
+                recorder.record(values[1:])
+            if done:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+        ring.close()
+        if lost or recorder.dropped:
+            print("telemetry: records lost:", lost, " dropped:", recorder.dropped)
+#####
+
+
+
+class MultiprocessRuntime:
+    #settings ---------- ThrottleByWire.py settings to change (the same in every process), e.g. {'control_mode': 'angle'}
+    #sim --------------- run against the simulated golf car in real time instead of the Pi
+    #watchdog_timeout -- seconds without a control loop heartbeat before the driver is put to sleep
+    #latch ------------- stay asleep after a watchdog trip (until started again), False wakes the driver when the heartbeat comes back
+    #cpus -------------- dict of process name to set of CPUs, e.g. {'control': {3}, 'actuation': {2}, 'acquisition': {1}} (None leaves them alone)
+    #priority ---------- SCHED_FIFO priority for the acquisition, control and actuation processes, needs root (None leaves it alone)
+    def __init__(self, settings = None, sim = False, watchdog_timeout = 0.1, latch = True, cpus = None, priority = None):
+        self.settings = dict(settings or {})
+        if self.settings.get('axle_speed_source', tbw.axle_speed_source) != 'adc':
+            raise ValueError("the multi-process runtime reads the axle speed from the ADS1115 (axle_speed_source 'adc')")
+        self.settings['use_acquisition_engine'] = True
+        self.settings['use_motion_engine'] = True
+        self.sim = sim
+        self.watchdog_timeout = watchdog_timeout
+        self.latch = latch
+        self.cpus = dict(cpus or {})
+        self.priority = priority
+        self.sleep_pin = self.settings.get('SLEEP', tbw.SLEEP)
+        self.record = self.settings.get('record_telemetry', tbw.record_telemetry)
+        self.rings = {}
+        self.processes = {}
+        self.stop_event = None
+
+    def start(self):
+        ctx = multiprocessing.get_context('spawn') #fresh interpreter for each process, nothing half set up (GPIO, threads) is copied over like with fork
+        self.rings = {'sensor': ShmRing(SENSOR_DTYPE, 64),
+                      'command': ShmRing(COMMAND_DTYPE, 256),
+                      'status': ShmRing(STATUS_DTYPE, 64),
+                      'telemetry': ShmRing(TELEMETRY_DTYPE, 2**16)}
+        if self.sim:
+            self.rings['plant'] = ShmRing(PLANT_DTYPE, 64)
+        specs = {name: ring.spec() for name, ring in self.rings.items()}
+        self.stop_event = ctx.Event()
+        control_settings = dict(self.settings)
+        if self.priority is not None:
+            control_settings['realtime_priority'] = self.priority
+        if 'control' in self.cpus:
+            control_settings['cpu_affinity'] = self.cpus['control']
+        self.t0 = time.perf_counter()
+        #actuation first (driver held asleep until the first command), control last (once there is something to read)
+        self.processes['actuation'] = ctx.Process(target = actuation_process, name = 'tbw-actuation',
+                                                  args = (specs, self.settings, self.sim, self.stop_event, self.t0, self.watchdog_timeout, self.latch, 0.0005, self.cpus.get('actuation'), self.priority))
+        self.processes['acquisition'] = ctx.Process(target = acquisition_process, name = 'tbw-acquisition',
+                                                    args = (specs, self.settings, self.sim, self.stop_event, self.cpus.get('acquisition'), self.priority))
+        if self.record:
+            self.processes['telemetry'] = ctx.Process(target = telemetry_process, name = 'tbw-telemetry', args = (specs, self.settings, self.stop_event))
+        self.processes['control'] = ctx.Process(target = control_process, name = 'tbw-control', args = (specs, control_settings, self.stop_event))
+        for process in self.processes.values():
+            process.start()
+        return self
+
+    def status(self): #latest actuation process status record (None before the first one)
+        return self.rings['status'].latest()
+
+    def plant(self): #latest simulated car record (simulator only)
+        return self.rings['plant'].latest()
+
+    def supervise(self, duration = None, interval = 0.05, report = None, report_every = 1.0): #watch the processes for 'duration' seconds (forever if None)
+        #returns False (after putting the driver to sleep) if a process died, report(runtime) is called every 'report_every' seconds
+        end = None if duration is None else time.perf_counter() + duration
+        next_report = time.perf_counter() + report_every
+        while end is None or time.perf_counter() < end:
+            for process in self.processes.values():
+                if not process.is_alive():
+                    self.fail_safe()
+                    return False
+            if report is not None and time.perf_counter() >= next_report:
+                report(self)
+                next_report += report_every
+            time.sleep(interval)
+        return True
+
+    def fail_safe(self): #SLEEP low from this process (real hardware only), in case the actuation process is the one that died
+        if self.sim:
+            return
+        import RPi.GPIO as GPIO
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.sleep_pin, GPIO.OUT)
+        GPIO.output(self.sleep_pin, GPIO.LOW)
+
+    def pause_control(self): #freeze the control process (SIGSTOP), to test the watchdog
+        os.kill(self.processes['control'].pid, signal.SIGSTOP)
+
+    def resume_control(self):
+        os.kill(self.processes['control'].pid, signal.SIGCONT)
+
+    def stop(self, timeout = 2.0): #stop the control loop first (it cleans up like it does on 'CTRL+c'), then the others
+        control = self.processes.get('control')
+        if control is not None and control.is_alive():
+            os.kill(control.pid, signal.SIGCONT)
+            os.kill(control.pid, signal.SIGINT)
+            control.join(timeout)
+        if self.stop_event is not None:
+            self.stop_event.set()
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout)
+        if self.processes.get('actuation') is not None and self.processes['actuation'].exitcode != 0:
+            self.fail_safe()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        self.processes = {}
+
+
+
+#Run the multi-process runtime on the Pi, or against the simulated golf car in real time
+#Run with 'python3 mp_runtime.py' (Pi) or 'python3 mp_runtime.py --sim 20 --stall 8' (simulator, control process frozen for a moment 8 s in)
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Run ThrottleByWire.py split into acquisition, control, actuation and telemetry processes")
+    parser.add_argument('--sim', type = float, default = None, metavar = 'SECONDS', help = "run against the simulated golf car for this many seconds")
+    parser.add_argument('--stall', type = float, default = None, metavar = 'SECONDS', help = "freeze the control process this many seconds in, to test the watchdog")
+    parser.add_argument('--stall-for', type = float, default = 0.5, help = "seconds the control process stays frozen")
+    parser.add_argument('--no-latch', action = 'store_true', help = "wake the driver again when the control loop comes back after a watchdog trip")
+    parser.add_argument('--watchdog', type = float, default = 0.1, help = "watchdog timeout, seconds")
+    parser.add_argument('--profile', help = "cart profile in profiles/ to use (see profiles.py)")
+    args = parser.parse_args()
+    settings = {}
+    if args.sim is not None:
+        settings = {'print_enabled': False, 'loop_period': 0.002, 'control_mode': 'angle'} #fixed loop rate, so the simulated car's processes get their share of the CPU
+    if args.profile is not None:
+        cal_changes, profile_settings = tbw.profile_changes(args.profile)
+        settings.update(profile_settings, cal = dict(tbw.cal, **cal_changes), profile = args.profile)
+    runtime = MultiprocessRuntime(settings, sim = args.sim is not None, watchdog_timeout = args.watchdog, latch = not args.no_latch)
+    last = {'t': time.perf_counter(), 'commands': 0, 'sensor': 0}
+    def report(runtime):
+        now = time.perf_counter()
+        status = runtime.status()
+        if status is None:
+            return
+        sensor = runtime.rings['sensor'].head()
+        dt = now - last['t']
+        line = [str(round(now - runtime.t0, 1)).rjust(5), str(round((int(status['commands']) - last['commands'])/dt)).rjust(9), str(round((sensor - last['sensor'])/dt)).rjust(10),
+                str(int(status['position'])).rjust(9), str(bool(status['asleep'])).rjust(7), str(int(status['trips'])).rjust(6)]
+        if runtime.sim:
+            plant = runtime.plant()
+            line += [str(round(float(plant['pedal']), 2)).rjust(6), str(round(float(plant['speed']), 2)).rjust(8), str(round(float(plant['throttle_deg']), 1)).rjust(13)]
+        print(" ".join(line))
+        last.update(t = now, commands = int(status['commands']), sensor = sensor)
+    print("    t  cmds/s  sensor/s  position  asleep  trips" + ("  pedal  act_spd  throttle_deg" if runtime.sim else ""))
+    runtime.start()
+    try:
+        if args.stall is not None:
+            if runtime.supervise(args.stall, report = report):
+                print("freezing the control process for", args.stall_for, "s")
+                runtime.pause_control()
+                runtime.supervise(args.stall_for, report = report)
+                runtime.resume_control()
+        remaining = None if args.sim is None else args.sim - (time.perf_counter() - runtime.t0)
+        if remaining is None or remaining > 0:
+            runtime.supervise(remaining, report = report)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        status = runtime.status()
+        runtime.stop()
+        if status is not None:
+            print("commands received:", int(status['commands']), "  watchdog trips:", int(status['trips']))
@@ -0,0 +1,241 @@
+#Simulated golf car for ThrottleByWire.py (the 'plant' the control loop controls)
+#Models the pedal, the throttle body (stepper motor pulling the cable, return spring closing it, TPS voltage) and the vehicle speed (axle input shaft sensor voltage),
+#using the same calibration values (axle_ratio, tire_dia, tps/pps voltage limits) as the real sensors, so the unchanged control loop can be run without a Pi.
+#Used through hal.SimBackend. Time is simulated, so a long drive runs in a fraction of the time.
+#'python3 plant_sim.py' runs the control loop from ThrottleByWire.py against the simulator and prints how it went.
+
+
+#####Library Imports
+import math
+import random
+import calibration
+from axle_speed import SimEdgeSource
+from sensor_frame import RESOLUTION, TICKS_PER_STEP
+from stepper_motion import SimulatedGPIO, ticks_per_pulse
+#####
+
+
+
+MODE_FROM_PINS = {pins: mode for mode, pins in RESOLUTION.items()} #reverse of RESOLUTION, to know the step mode from the M0/M1/M2 pin levels
+
+
+def step_pedal(level = 0.5, start = 1.0, end = None): #pedal profile: pedal up, then pressed to 'level' (0 to 1) at 'start' seconds, released at 'end' seconds
+    def pedal(t):
+        if t < start or (end is not None and t >= end):
+            return 0.0
+        return level
+    return pedal
+
+def drive_cycle_pedal(t): #a short drive: gentle pull away, cruise, full pedal, lift off, then a part throttle hold
+    if t < 1:
+        return 0.0
+    elif t < 15:
+        return 0.5
+    elif t < 30:
+        return 1.0
+    elif t < 35:
+        return 0.0
+    elif t < 50:
+        return 0.7
+    return 0.0
+
+
+
+class GolfCarPlant:
+    #pedal ------------------------ function of time (s) that returns pedal travel from 0 (up) to 1 (floored)
+    #throttle_deg_per_motor_deg --- pulley ratio between stepper motor and throttle shaft
+    #top_speed -------------------- mph at wide open throttle (5500 axle input rpm is 25 mph with 18" tires)
+    #speed_tau -------------------- seconds for the speed to get most of the way to the speed the throttle opening would give (vehicle inertia)
+    #throttle_tau ----------------- seconds for the throttle plate to follow the cable (return spring closing it / motor opening it)
+    #noise ------------------------ standard deviation of noise added to every sensor voltage (volts)
+    #stall_deg -------------------- opening pulses are lost past this throttle opening (motor too weak against the return spring), None for never
+    #step_deg --------------------- motor degrees per full step, None for the motor ThrottleByWire.py is set up for (its Step_deg)
+    def __init__(self, cal = None, pedal = None, throttle_deg_per_motor_deg = 1.0, top_speed = 25.0, speed_tau = 3.0, throttle_tau = 0.02,
+                 noise = 0.0, gain = 1, seed = 0, stall_deg = None, step_deg = None):
+        if step_deg is None:
+            import ThrottleByWire as tbw
+            step_deg = tbw.Step_deg
+        self.cal = dict(calibration.DEFAULT_CALIBRATION if cal is None else cal)
+        self.step_deg = step_deg
+        self.pedal = pedal if pedal is not None else drive_cycle_pedal
+        self.throttle_deg_per_motor_deg = throttle_deg_per_motor_deg
+        self.top_speed = top_speed
+        self.speed_tau = speed_tau
+        self.throttle_tau = throttle_tau
+        self.noise = noise
+        self.gain = gain
+        self.stall_deg = stall_deg
+        self.random = random.Random(seed)
+        self.deg_throttle_max = self.cal['deg_throttle_max']
+        self.pps_v_min, self.pps_v_max = calibration.pps_v_limits(self.cal)
+        self.tps_v_min, self.tps_v_max = calibration.tps_v_limits(self.cal)
+        #mph to axle input shaft rpm, inverse of calibration.axle_v_to_veh_spd
+        tire_circ = self.cal['tire_dia']*math.pi*self.cal['f_roll_rad']
+        self.rpm_per_mph = self.cal['axle_ratio']/(tire_circ*((60/1)*(1/12)*(1/5280)))
+        self.volt_per_rpm = self.cal['axle_speed_sensor_v_in']/self.cal['axle_input_rpm_at_v_in']
+        #state
+        self.t = 0.0
+        self.stepper_ticks = 0 #stepper position in 1/64 steps (0 is where the cable just starts to pull)
+        self.throttle_deg = 0.0
+        self.speed = 0.0 #mph
+        self.pulses = 0
+        self.lost_pulses = 0 #pulses the motor did not follow (stall_deg)
+        self.edges = None #SimEdgeSource making the axle sensor tooth edges, if something is listening for them
+
+    def connect_tooth_edges(self, callback, pin = None): #call callback(pin, t) for every axle input shaft sensor tooth edge
+        self.edges = SimEdgeSource(callback, self.cal['axle_n_teeth'], pin)
+        self.edges.t = self.t
+
+    #Stepper motor
+    def step(self, direction, ticks): #one STEP pulse, direction 1 opens and -1 closes
+        self.pulses += 1
+        if self.stall_deg is not None and direction > 0 and self.cable_deg() >= self.stall_deg:
+            self.lost_pulses += 1
+            return
+        self.stepper_ticks += direction*ticks
+
+    def release(self): #driver asleep (SLEEP low), motor coils off: the return spring closes the throttle and pulls the cable (and motor) back to the stop
+        self.stepper_ticks = min(self.stepper_ticks, 0)
+
+    def cable_deg(self): #throttle opening the cable allows (the return spring holds the throttle against the cable, the cable can not push)
+        motor_deg = self.stepper_ticks/TICKS_PER_STEP*self.step_deg
+        return min(max(motor_deg*self.throttle_deg_per_motor_deg, 0.0), self.deg_throttle_max)
+
+    #Vehicle
+    def speed_for_throttle(self, deg): #speed the vehicle would settle at for a throttle opening
+        return self.top_speed*(1 - math.exp(-3*deg/self.deg_throttle_max))/(1 - math.exp(-3))
+
+    def update(self, t, max_dt = 0.001, min_dt = 0.0001): #move the simulation forward to time t (in steps of max_dt, skipped if less than min_dt has passed)
+        if t - self.t < min_dt:
+            return
+        while self.t < t:
+            dt = min(max_dt, t - self.t)
+            target = self.cable_deg()
+            self.throttle_deg += (target - self.throttle_deg)*min(dt/self.throttle_tau, 1.0)
+            speed_target = self.speed_for_throttle(self.throttle_deg)
+            self.speed += (speed_target - self.speed)*min(dt/self.speed_tau, 1.0)
+            self.t += dt
+            if self.edges is not None:
+                self.edges.run(self.t, self.speed*self.rpm_per_mph)
+
+    #Sensors
+    def voltage(self, ch): #sensor voltage on an ADS1115 channel (0 pedal, 1 axle speed, 2 tps, 3 pedal switch)
+        if ch == 0:
+            v = self.pps_v_min + self.pedal(self.t)*(self.pps_v_max - self.pps_v_min)
+        elif ch == 1:
+            v = self.speed*self.rpm_per_mph*self.volt_per_rpm
+        elif ch == 2:
+            v = self.tps_v_min + self.throttle_deg/self.deg_throttle_max*(self.tps_v_max - self.tps_v_min)
+        elif ch == 3:
+            v = 3.3 if self.pedal(self.t) > 0.02 else 0.0
+        else:
+            return 0.0
+        if self.noise:
+            v += self.random.gauss(0, self.noise)
+        return v
+
+    def code(self, ch): #raw ADS1115 code for a channel
+        code = int(round(self.voltage(ch)/calibration.ADS1115_FSR[self.gain]*32767))
+        return max(-32768, min(32767, code))
+
+
+
+class PlantGPIO(SimulatedGPIO): #SimulatedGPIO that moves the simulated stepper on every STEP pulse, using the DIR and M0/M1/M2 pin levels
+    #record_pulses --- also keep the time of every pulse (like SimulatedGPIO), off by default since a long simulation makes millions of pulses
+    #sleep_pin ------- DRV8825 SLEEP, pulses are ignored and the throttle is let go while it is low (the driver is taken as awake until it is first written)
+    def __init__(self, clock, plant, step_pin = 21, dir_pin = 20, mode_pins = (14,15,18), cw = 0, record_pulses = False, axle_edge_pin = 23, sleep_pin = 17):
+        SimulatedGPIO.__init__(self, clock, step_pin, dir_pin)
+        self.plant = plant
+        self.mode_pins = mode_pins
+        self.cw = cw
+        self.record_pulses = record_pulses
+        self.direction = 1 #1 opens, -1 closes (from DIR pin)
+        self.ticks = ticks_per_pulse('Full') #1/64 steps per pulse (from M0/M1/M2 pins)
+        self.axle_edge_pin = axle_edge_pin
+        self.sleep_pin = sleep_pin
+
+    def add_event_detect(self, pin, edge, callback = None, bouncetime = None): #an edge callback on the axle edge pin gets the simulated tooth edges
+        SimulatedGPIO.add_event_detect(self, pin, edge, callback, bouncetime)
+        if pin == self.axle_edge_pin and callback is not None:
+            self.plant.connect_tooth_edges(callback, pin)
+
+    def remove_event_detect(self, pin):
+        SimulatedGPIO.remove_event_detect(self, pin)
+        if pin == self.axle_edge_pin:
+            self.plant.edges = None
+
+    def output(self, pin, value):
+        if isinstance(pin, (tuple, list)):
+            values = value if isinstance(value, (tuple, list)) else [value]*len(pin)
+            for p, v in zip(pin, values):
+                self.writes += 1
+                self.pins[p] = v
+            self._pins_changed(pin)
+            return
+        self.writes += 1
+        if pin == self.step_pin:
+            if value and not self.pins.get(pin, 0) and self.pins.get(self.sleep_pin, 1): #rising edge, motor takes one (micro)step (if the driver is awake)
+                now = self.clock.now()
+                self.plant.update(now)
+                self.plant.step(self.direction, self.ticks)
+                if self.record_pulses:
+                    self.pulses.append((now, self.pins.get(self.dir_pin, 0)))
+            self.pins[pin] = value
+            return
+        self.pins[pin] = value
+        self._pins_changed((pin,))
+
+    def _pins_changed(self, pins):
+        if self.dir_pin in pins:
+            self.direction = 1 if self.pins[self.dir_pin] == self.cw else -1
+        if any(p in self.mode_pins for p in pins):
+            mode = MODE_FROM_PINS.get(tuple(self.pins.get(p, 0) for p in self.mode_pins), '1/32') #M1+M2 high (not in RESOLUTION) is 1/32 on the DRV8825
+            self.ticks = ticks_per_pulse(mode)
+        if self.sleep_pin in pins and not self.pins[self.sleep_pin]:
+            self.plant.release()
+
+
+
+def simulate(duration = 60.0, plant = None, settings = None, cycle_time = 0.0002, record_every = 0.05): #run the control loop from ThrottleByWire.py against the simulator
+    #settings is a dict of ThrottleByWire module settings to change first, e.g. {'cruise_spd': 10, 'use_step_batches': False}
+    #returns (backend, list of (t, pedal, speed, throttle_deg) recorded every 'record_every' simulated seconds)
+    import ThrottleByWire as tbw
+    import hal
+    old = {}
+    settings = dict(settings or {})
+    settings.setdefault('print_enabled', False)
+    for name, value in settings.items():
+        old[name] = getattr(tbw, name)
+        setattr(tbw, name, value)
+    try:
+        plant = plant if plant is not None else GolfCarPlant()
+        backend = hal.SimBackend(plant, cycle_time = cycle_time, record_every = record_every)
+        tbw.run(backend, duration = duration)
+    finally:
+        for name, value in old.items():
+            setattr(tbw, name, value)
+    return backend, backend.trace
+
+def desired_speed(trace, plant, cruise_spd = None): #desired speed (mph) for every entry of a simulate() trace, from its pedal travel (cruise_spd None for ThrottleByWire's)
+    if cruise_spd is None:
+        import ThrottleByWire as tbw
+        cruise_spd = tbw.cruise_spd
+    pps_v_min, pps_v_max = calibration.pps_v_limits(plant.cal)
+    return [calibration.pps_v_to_des_spd(pps_v_min + pedal*(pps_v_max - pps_v_min), cruise_spd, plant.cal) for t, pedal, speed, deg in trace]
+
+
+
+#Run the control loop against the simulated golf car and print a summary
+#Run with 'python3 plant_sim.py'
+if __name__ == "__main__":
+    import time
+    duration = 60.0
+    start = time.perf_counter()
+    backend, trace = simulate(duration)
+    wall = time.perf_counter() - start
+    print("simulated", duration, "s of driving in", round(wall, 2), "s  (", round(duration/wall, 1), "x real time )")
+    print("control loops:", backend.cycles, "  (", round(backend.cycles/wall), "loops per second of computer time,", round(backend.cycles/duration), "per simulated second )")
+    print("stepper pulses:", backend.plant.pulses)
+    print("    t   pedal  des_spd  act_spd  throttle_deg")
+    for (t, pedal, speed, deg), des_spd in list(zip(trace, desired_speed(trace, backend.plant)))[::40]:
+        print(str(round(t,1)).rjust(5), str(round(pedal,2)).rjust(6), str(round(des_spd,2)).rjust(8), str(round(speed,2)).rjust(8), str(round(deg,1)).rjust(12))
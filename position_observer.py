@@ -0,0 +1,189 @@
+#Throttle position observer for ThrottleByWire.py
+#Every loop read the TPS channel, even when the stepper had not moved and the throttle could not have either. And the stepper can lose position
+#(see notes at bottom of ThrottleByWire.py), which the step_history/tps_history windows were meant to catch but never did (step_stop was never set).
+#The PositionObserver predicts the throttle opening from the steps issued (each pulse moves Step_deg/microsteps motor degrees, times the pulley ratio),
+#and the loop only reads the TPS when a reading is due:
+#    the prediction follows the cable with the same lag the throttle plate has (return spring), and stops at the throttle stops (the cable can go slack past closed)
+#    every TPS reading pulls the prediction toward it ('gain'), and if it agreed the next reading is put off longer (up to 'max_interval', 'moving_interval' while the motor moves)
+#    a reading that does not agree brings the readings back to every loop, and if the next 'confirm' readings do not agree either:
+#        stall ------- steps were issued but the throttle did not move, 'stalled' is the direction (1 opening, -1 closing) until the throttle moves again, the motor
+#                      is stepped the other way, or 'retry_after' seconds pass. ThrottleByWire.py stops stepping that way (step_stop) meanwhile.
+#        lost steps -- the throttle moved and settled, but not where the steps say, 'lost_ticks' counts the difference
+#      either way (or if the throttle was still catching up to a fast move) the prediction starts again from the reading.
+#Each update is a handful of arithmetic, no history is kept.
+#'python3 position_observer.py' runs the simulated golf car with and without the observer, then with a throttle the motor can not open past 20 degrees.
+
+
+#####Library Imports
+from sensor_frame import TICKS_PER_STEP
+#####
+
+
+
+class PositionObserver:
+    #deg_per_tick ------ throttle degrees per 1/64 step (Step_deg/64*throttle_deg_per_motor_deg)
+    #min_deg/max_deg --- throttle stops, degrees
+    #lag --------------- seconds for the throttle to follow the cable (0 for no lag)
+    #tolerance_deg ----- readings this close to the prediction agree with it (TPS noise and throttle slop)
+    #lag_slack --------- while the throttle is catching up to the cable, readings also agree if within this fraction of the distance still to go
+    #gain -------------- 0 to 1, how far each agreeing reading pulls the prediction toward it
+    #min_interval ------ seconds between readings after one that did not agree (0 is every loop)
+    #max_interval ------ longest time between readings while the motor is still
+    #moving_interval --- longest time between readings while the motor is moving
+    #confirm ----------- readings in a row that must disagree before a stall or lost steps is flagged
+    #retry_after ------- seconds a stall blocks stepping in its direction before trying again
+    def __init__(self, deg_per_tick, min_deg = 0.0, max_deg = 90.0, lag = 0.02, tolerance_deg = 1.0, lag_slack = 0.5, gain = 0.5, min_interval = 0.0, max_interval = 0.1,
+                 moving_interval = 0.02, confirm = 2, retry_after = 0.5):
+        self.deg_per_tick = deg_per_tick
+        self.min_deg = min_deg
+        self.max_deg = max_deg
+        self.lag = lag
+        self.tolerance_deg = tolerance_deg
+        self.lag_slack = lag_slack
+        self.gain = gain
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.moving_interval = moving_interval
+        self.confirm = confirm
+        self.retry_after = retry_after
+        self.reset()
+
+    def reset(self): #forget the position, the next reading starts the prediction again
+        self.ticks = 0 #stepper position, 1/64 steps (commanded)
+        self.cable_deg = None #throttle opening the cable allows, degrees (below min_deg is slack cable), None until the first reading
+        self.ticks_at_cable = 0 #stepper position cable_deg was worked out at
+        self.deg = None #predicted throttle opening, degrees
+        self.t = None #time of the prediction
+        self.interval = self.min_interval
+        self.next_read = None #time the next reading is due, None is now
+        self.moved = False #stepper moved since the last reading
+        self.disagree = 0 #readings in a row that did not agree
+        self.first_residual = 0.0 #reading minus prediction, and whether the throttle had settled, at the first reading that did not agree
+        self.first_settled = False
+        self.sync_deg = None #reading and stepper position at the last reading that agreed (to tell a stall from lost steps)
+        self.sync_ticks = 0
+        self.stalled = 0 #direction the throttle stalled in, 0 if not stalled
+        self.stall_time = None
+        #counters
+        self.reads = 0
+        self.predictions = 0
+        self.stalls = 0
+        self.lost_ticks = 0
+
+    def move(self, ticks, now = None): #stepper moved by this many 1/64 steps (positive opens) by time 'now', for steps made in the loop
+        if ticks:
+            if now is not None and self.cable_deg is not None: #throttle follows from when the steps were made, not from the last prediction
+                self._follow(now)
+            self.ticks += ticks
+            self.moved = True
+            if self.stalled and (ticks > 0) != (self.stalled > 0): #stepping back the other way, the stall no longer blocks anything
+                self.stalled = 0
+
+    def set_position(self, ticks, now = None): #stepper position in 1/64 steps, for the motion engine (MotionEngine.position)
+        self.move(ticks - self.ticks, now)
+
+    def due(self, now): #True if the TPS should be read this loop
+        return self.next_read is None or now >= self.next_read
+
+    def predict(self, now): #predicted throttle opening at time 'now', degrees
+        self.predictions += 1
+        self._follow(now)
+        return self.deg
+
+    def correct(self, now, measured): #a TPS reading (degrees), returns the corrected prediction
+        self.reads += 1
+        if self.cable_deg is None: #first reading, start from it
+            self.cable_deg = measured
+            self._sync(now, measured)
+            return self.deg
+        self._follow(now)
+        residual = measured - self.deg
+        catching_up = abs(min(max(self.cable_deg, self.min_deg), self.max_deg) - self.deg) #throttle still following a move, the lag is not known exactly
+        if abs(residual) <= self.tolerance_deg + self.lag_slack*catching_up:
+            self.disagree = 0
+            if self.stalled and abs(measured - self.sync_deg) >= self.tolerance_deg: #throttle moving again
+                self.stalled = 0
+            self.cable_deg += self.gain*residual
+            self.deg += self.gain*residual
+            self.sync_deg = measured
+            self.sync_ticks = self.ticks
+            if self.stalled and self.stall_time is not None and now - self.stall_time >= self.retry_after:
+                self.stalled = 0
+            self.interval = min(max(self.interval*2, 0.005), self.moving_interval if self.moved else self.max_interval)
+        else:
+            self.disagree += 1
+            self.interval = self.min_interval
+            if self.disagree == 1: #the loop may step again before the next reading, so lost steps are judged from this one
+                self.first_residual = residual
+                self.first_settled = catching_up < self.tolerance_deg #throttle had settled, so it is the position that is off, not the lag
+            if self.disagree >= self.confirm:
+                commanded = (self.ticks - self.sync_ticks)*self.deg_per_tick
+                if abs(commanded) > self.tolerance_deg and abs(measured - self.sync_deg) < self.tolerance_deg and (residual > 0) != (commanded > 0):
+                    self.stalled = 1 if commanded > 0 else -1 #steps issued, throttle did not move
+                    self.stall_time = now
+                    self.stalls += 1
+                elif self.first_settled and abs(self.first_residual) > self.tolerance_deg + TICKS_PER_STEP*self.deg_per_tick: #a stepper loses whole steps
+                    self.lost_ticks += int(round(abs(self.first_residual)/self.deg_per_tick))
+                self.cable_deg += residual #cable is still ahead of the throttle by what the lag says
+                self._sync(now, measured)
+                return self.deg
+        self.moved = False
+        self.next_read = now + self.interval
+        return self.deg
+
+    def _sync(self, now, measured): #start the prediction again from a reading
+        self.ticks_at_cable = self.ticks
+        self.deg = measured
+        self.t = now
+        self.sync_deg = measured
+        self.sync_ticks = self.ticks
+        self.disagree = 0
+        self.moved = False
+        self.interval = self.min_interval
+        self.next_read = now + self.interval
+
+    def _follow(self, now): #move the predicted opening toward where the cable now is
+        if self.ticks != self.ticks_at_cable:
+            self.cable_deg += (self.ticks - self.ticks_at_cable)*self.deg_per_tick
+            self.ticks_at_cable = self.ticks
+        target = min(max(self.cable_deg, self.min_deg), self.max_deg) #the cable can not push the throttle past closed, or pull it past wide open
+        if self.t is None or self.lag <= 0:
+            self.deg = target
+        else:
+            self.deg += (target - self.deg)*min((now - self.t)/self.lag, 1.0)
+        self.t = now
+
+    def stats(self):
+        return {'reads': self.reads, 'predictions': self.predictions, 'stalls': self.stalls, 'lost_ticks': self.lost_ticks}
+
+
+def observer_for(step_deg, throttle_deg_per_motor_deg, min_deg = 0.0, max_deg = 90.0, **settings): #PositionObserver for a motor and pulley ratio
+    return PositionObserver(step_deg/TICKS_PER_STEP*throttle_deg_per_motor_deg, min_deg, max_deg, **settings)
+
+
+
+#Simulated golf car with and without the observer (TPS reads and speed error), then a throttle the motor can not open past 20 degrees
+#Run with 'python3 position_observer.py'
+if __name__ == "__main__":
+    import numpy as np
+    import plant_sim
+    import ThrottleByWire as tbw
+    duration = 60.0
+    print("simulated golf car,", duration, "s, default settings (motion engine, step batches)")
+    print("mode   observer  loops  tps_reads  reads_per_loop  speed_error_rms_mph  stalls  lost_ticks")
+    for mode in ('step', 'angle'):
+        for observe in (False, True):
+            plant = plant_sim.GolfCarPlant(noise = 0.005)
+            backend, trace = plant_sim.simulate(duration, plant, {'position_observer_enabled': observe, 'control_mode': mode})
+            stats = tbw.observer.stats() if observe else {'reads': backend.cycles, 'stalls': 0, 'lost_ticks': 0}
+            speed = np.array([row[2] for row in trace])
+            des_spd = np.array(plant_sim.desired_speed(trace, plant))
+            rms = float(np.sqrt(np.mean((speed - des_spd)**2)))
+            print(mode.ljust(6), str(observe).ljust(8), str(backend.cycles).rjust(6), str(stats['reads']).rjust(10), str(round(stats['reads']/backend.cycles, 3)).rjust(15),
+                  str(round(rms, 2)).rjust(20), str(stats['stalls']).rjust(7), str(stats['lost_ticks']).rjust(11))
+    print("\nthrottle stalls at 20 degrees (motor too weak against the return spring), full pedal")
+    print("observer  stalls  stepper_ticks_past_stall  final_throttle_deg")
+    for observe in (False, True):
+        plant = plant_sim.GolfCarPlant(pedal = plant_sim.step_pedal(1.0, 1.0), stall_deg = 20.0)
+        backend, trace = plant_sim.simulate(10.0, plant, {'position_observer_enabled': observe})
+        print(str(observe).ljust(8), str(tbw.observer.stalls if observe else 0).rjust(7), str(plant.lost_pulses).rjust(25), str(round(trace[-1][3], 1)).rjust(19))
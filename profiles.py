@@ -0,0 +1,121 @@
+#Cart profiles and the calibration table cache, for ThrottleByWire.py
+#A profile is a small json file in 'profiles/' with the calibration values (see DEFAULT_CALIBRATION in calibration.py) and ThrottleByWire.py settings
+#that are different on one cart, so several carts can run the same code: 'python3 ThrottleByWire.py --profile cart2' uses profiles/cart2.json:
+#    {"calibration": {"tire_dia": 20, "axle_ratio": 12.28}, "settings": {"cruise_spd": 10}}
+#
+#Building the calibration lookup tables (CalibrationTables) does the conversion math for all 65536 ADS1115 codes, which takes a while on the Pi at every start.
+#cached_tables() saves the built tables as .npy files under a key made from everything they are built from (calibration values, cruise_spd, gain, the calibration.py code and CACHE_VERSION),
+#and loads them (memory mapped, so only the pages the loop uses are ever read) at the next start. Changing any of those gives a new key, so the tables are rebuilt then.
+#'python3 profiles.py' times building the tables against loading them from the cache.
+
+
+#####Library Imports
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import calibration
+#####
+
+
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles') #next to this file, so it does not matter what folder the program is started from
+CACHE_DIR = os.path.join(PROFILE_DIR, 'cache')
+CACHE_VERSION = 1 #change this if the way the tables are saved changes (changes to calibration.py are already part of the key, see code_digest())
+TABLE_NAMES = ('voltage', 'axle', 'tps', 'psw', 'pps')
+
+
+
+#####Profiles
+def profile_path(name, directory = PROFILE_DIR):
+    return os.path.join(directory, name + '.json')
+
+def list_profiles(directory = PROFILE_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[:-5] for f in os.listdir(directory) if f.endswith('.json'))
+
+def load_profile(name, directory = PROFILE_DIR): #returns (calibration changes, settings changes) of a profile
+    with open(profile_path(name, directory)) as f:
+        profile = json.load(f)
+    unknown = set(profile) - {'calibration', 'settings', 'description'}
+    if unknown:
+        raise ValueError("unknown section in profile " + name + ": " + ", ".join(sorted(unknown)))
+    cal = {}
+    for key, value in profile.get('calibration', {}).items():
+        if key not in calibration.DEFAULT_CALIBRATION:
+            raise KeyError("unknown calibration value in profile " + name + ": " + key)
+        cal[key] = tuple(value) if isinstance(value, list) else value #json has lists, DEFAULT_CALIBRATION has tuples
+    settings = {key: tuple(value) if isinstance(value, list) else value for key, value in profile.get('settings', {}).items()}
+    return cal, settings
+
+def save_profile(name, cal = None, settings = None, description = None, directory = PROFILE_DIR): #write a profile, e.g. save_profile('cart2', {'tire_dia': 20})
+    profile = {}
+    if description:
+        profile['description'] = description
+    profile['calibration'] = dict(cal or {})
+    profile['settings'] = dict(settings or {})
+    os.makedirs(directory, exist_ok = True)
+    with open(profile_path(name, directory), 'w') as f:
+        json.dump(profile, f, indent = 4)
+#####
+
+
+
+#####Calibration table cache
+def code_digest(): #hash of calibration.py, so tables cached before the conversion code changed are not used
+    with open(calibration.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def table_key(cal, cruise_spd, gain): #changes whenever anything the tables are built from changes
+    source = json.dumps({'version': CACHE_VERSION, 'code': code_digest(), 'calibration': cal, 'cruise_spd': cruise_spd, 'gain': gain}, sort_keys = True)
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+def cached_tables(cal, cruise_spd = 12, gain = 1, directory = CACHE_DIR): #CalibrationTables loaded from the cache, or built and saved to it. 'from_cache' says which.
+    cal = dict(cal)
+    key = table_key(cal, cruise_spd, gain)
+    path = os.path.join(directory, key)
+    if os.path.isdir(path):
+        try:
+            arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r') for name in TABLE_NAMES}
+            tables = calibration.CalibrationTables.from_arrays(cal, cruise_spd, gain, arrays)
+            tables.from_cache = True
+            return tables
+        except (OSError, ValueError): #damaged cache (power lost while saving?), build it again
+            shutil.rmtree(path, ignore_errors = True)
+    tables = calibration.CalibrationTables(cal, cruise_spd, gain)
+    tables.from_cache = False
+    try:
+        temp = path + '.tmp' + str(os.getpid())
+        os.makedirs(temp, exist_ok = True)
+        for name in TABLE_NAMES:
+            np.save(os.path.join(temp, name + '.npy'), getattr(tables, name))
+        with open(os.path.join(temp, 'source.json'), 'w') as f: #what the tables were built from, for looking at by hand
+            json.dump({'version': CACHE_VERSION, 'code': code_digest(), 'calibration': cal, 'cruise_spd': cruise_spd, 'gain': gain}, f, indent = 4)
+        os.rename(temp, path) #whole directory appears at once, a half saved cache is never loaded
+    except OSError: #read only file system etc., the tables still work, they just are not saved
+        shutil.rmtree(temp, ignore_errors = True)
+    return tables
+#####
+
+
+
+#Time building the tables against loading them from the cache
+#Run with 'python3 profiles.py'
+if __name__ == "__main__":
+    import time
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        for attempt in ('first start (build and save)', 'next start (load)'):
+            start = time.perf_counter()
+            tables = cached_tables(calibration.DEFAULT_CALIBRATION, 12, 1, directory)
+            tables.tps[1234], tables.pps[4321], tables.axle[2222] #first lookups touch the pages
+            print(attempt.ljust(30), round((time.perf_counter() - start)*1e3, 2), "ms  from cache:", tables.from_cache)
+        changed = dict(calibration.DEFAULT_CALIBRATION, tire_dia = 20)
+        start = time.perf_counter()
+        tables = cached_tables(changed, 12, 1, directory)
+        print("tire_dia changed".ljust(30), round((time.perf_counter() - start)*1e3, 2), "ms  from cache:", tables.from_cache)
+        reference = calibration.CalibrationTables(changed, 12, 1)
+        print("cached tables match a fresh build:", all(np.array_equal(getattr(cached_tables(changed, 12, 1, directory), name), getattr(reference, name)) for name in TABLE_NAMES))
+    print("profiles:", ", ".join(list_profiles()) or "none")
@@ -0,0 +1,286 @@
+#Offline replay of the ThrottleByWire.py control law over a recorded drive
+#Tuning the pedal map, the step mode thresholds, accel_rate_cap or tps_deg_max_pedal_up used to mean driving the car again.
+#The replay takes a recorded sensor trace (telemetry_recorder .npy files, or a csv) and works out, for every sample at once with numpy arrays,
+#what the main loop would have decided: desired speed, windowed acceleration rate, step mode and step delay, the open/close/hold branch and the number of steps.
+#Many parameter sets can be scored in one run (optionally on several processes), a long drive takes well under a second per parameter set.
+#
+#Note the replay is 'open loop': it uses the recorded speeds and throttle openings, so it shows what the control law would have commanded at each sample,
+#not how the car would have responded to it (use plant_sim.py for that).
+#Loop state that can not be worked out from the sensors is taken from the recording: the stall direction (step_stop, set by the position observer) and whether the
+#motion engine was still stepping out a move (no step batch that loop). Traces without them are replayed as if neither happened.
+#Only control_mode 'step' is replayed, the 'angle' mode depends on the controller's integrator and the throttle response (use plant_sim.py).
+#
+#'python3 replay.py' records a drive on the simulator, checks the replay makes the same decisions the loop made, then sweeps some parameters.
+#'python3 replay.py telemetry/' replays recorded files instead.
+
+
+#####Library Imports
+import os
+import time
+import itertools
+import numpy as np
+import calibration
+from sensor_frame import STEP_MODES, STEP_MODE_THRESHOLDS, STEP_DIVISOR, delay_FullStep, min_delay
+#####
+
+
+
+#Branches of the main loop's step decision
+HOLD = 0
+OPEN = 1 #want to go faster
+CLOSE_ACCEL_CAP = 2 #want to go faster but over accel_rate_cap
+CLOSE_OVERSPEED = 3 #going faster than desired
+CLOSE_PEDAL_UP = 4 #pedal switch open
+BRANCH_NAMES = ('hold', 'open', 'close_accel_cap', 'close_overspeed', 'close_pedal_up')
+
+#Settings the replay uses, with the same defaults as ThrottleByWire.py / StepBatchPlanner. Any key of calibration.DEFAULT_CALIBRATION can be given too.
+DEFAULT_PARAMS = {
+    'control_mode': 'step', #only 'step' can be replayed
+    'cruise_spd': 12,
+    'accel_rate_cap': 2.5,
+    'tps_deg_stop_min': 0.2,
+    'tps_deg_stop_max': 78,
+    'tps_deg_max_pedal_up': 0.5,
+    'mov_avg_itr_window': 25,
+    'accel_rate_method': 'endpoint',
+    'step_mode_thresholds': STEP_MODE_THRESHOLDS,
+    'use_step_batches': True,
+    'throttle_deg_per_motor_deg': 1.0,
+    'deg_per_mph': 4.0,
+    'max_batch_deg': 10.0,
+    'cycle_budget': 0.02,
+    'max_steps_per_cycle': 256,
+    'batch_error_min': 2.0,
+    'ads_gain': 1,
+    'step_deg': None, #motor degrees per full step, None for ThrottleByWire.Step_deg
+}
+
+
+
+#####Loading traces
+def load_trace(path): #recorded trace as a dict of arrays: t, pps_code, axle_code, tps_code, psw_code (and steps/accel_rate/act_spd/tps_deg if recorded)
+    #path can be telemetry_recorder files (a .npy file, or a directory of them), or a csv with a header row.
+    #A csv needs a 't' column, and either code columns (pps_code, axle_code, tps_code, psw_code) or voltage columns (pps_v, axle_v, tps_v, psw_v).
+    #An 'act_spd' column can be given instead of the axle column (speed measured from tooth edges).
+    if os.path.isdir(path) or path.endswith('.npy'):
+        from telemetry_recorder import read_telemetry
+        data = read_telemetry(path)
+    else:
+        data = np.genfromtxt(path, delimiter = ',', names = True)
+    names = data.dtype.names
+    trace = {'t': np.asarray(data['t'], dtype = float)}
+    for ch in ('pps', 'axle', 'tps', 'psw'):
+        if ch + '_code' in names:
+            trace[ch + '_code'] = np.asarray(data[ch + '_code'], dtype = np.int64)
+        elif ch + '_v' in names:
+            trace[ch + '_code'] = voltage_to_code(np.asarray(data[ch + '_v'], dtype = float))
+        elif ch == 'axle' and 'act_spd' in names: #speed measured from tooth edges, no axle channel
+            trace['axle_code'] = np.zeros(len(trace['t']), dtype = np.int64)
+        else:
+            raise ValueError("trace has no '" + ch + "_code' or '" + ch + "_v' column")
+    for name in ('steps', 'accel_rate', 'act_spd', 'tps_deg', 'step_stop', 'move_queued', 'tps_predicted'):
+        if name in names:
+            trace[name] = np.asarray(data[name])
+    return trace
+
+def voltage_to_code(voltage, gain = 1): #ADS1115 code for voltages (inverse of calibration.code_to_voltage)
+    return np.clip(np.round(voltage/calibration.ADS1115_FSR[gain]*32767), -32768, 32767).astype(np.int64)
+#####
+
+
+
+#####Vectorized control law
+def windowed_accel_rate(t, v, window, method = 'endpoint'): #accel rate at every sample, same as SpeedWindow with size 'window' (0 until the window is full)
+    n = len(t)
+    rate = np.zeros(n)
+    if n < window or window < 1:
+        return rate
+    if method == 'endpoint':
+        dt = t[window - 1:] - t[:n - window + 1]
+        dv = v[window - 1:] - v[:n - window + 1]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            rate[window - 1:] = np.where(dt > 0, dv/np.where(dt > 0, dt, 1), 0.0)
+    elif method == 'slope':
+        tt = t - t[0] #relative times, for precision
+        def window_sum(x): #sum of each window of x, by cumulative sums
+            c = np.concatenate(([0.0], np.cumsum(x)))
+            return c[window:] - c[:n - window + 1]
+        sum_t = window_sum(tt)
+        sum_v = window_sum(v)
+        sum_tt = window_sum(tt*tt)
+        sum_tv = window_sum(tt*v)
+        denom = window*sum_tt - sum_t*sum_t
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            rate[window - 1:] = np.where(denom > 0, (window*sum_tv - sum_t*sum_v)/np.where(denom > 0, denom, 1), 0.0)
+    else:
+        raise ValueError("accel rate method must be 'endpoint' or 'slope'")
+    return rate
+
+def step_mode_index(spd_error, thresholds = STEP_MODE_THRESHOLDS): #index in STEP_MODES for every speed error (same as sensor_frame.step_mode_for_error)
+    diff = np.abs(spd_error)
+    index = np.zeros(len(diff), dtype = np.int8) #Full
+    for i, limit in enumerate(thresholds): #each threshold moves one mode finer
+        index[diff < limit] = i + 1
+    return index
+
+def planned_steps(direction, tps_deg, spd_error, mode_index, accel_rate, p): #number of steps for every sample (same as StepBatchPlanner.plan, without the sign)
+    divisor = np.array([STEP_DIVISOR[m] for m in STEP_MODES], dtype = float)[mode_index]
+    spacing = np.maximum(delay_FullStep/divisor, min_delay)
+    move_deg = np.minimum(np.maximum(np.abs(spd_error) - p['batch_error_min'], 0.0)*p['deg_per_mph'], p['max_batch_deg'])
+    cap = p['accel_rate_cap']
+    opening = direction > 0
+    if cap > 0:
+        move_deg = np.where(opening & (accel_rate > 0), move_deg*np.maximum(0.0, 1 - accel_rate/cap), move_deg)
+        move_deg = np.where(~opening & (accel_rate > cap), np.minimum(p['max_batch_deg'], (accel_rate - cap)/cap*p['max_batch_deg']), move_deg)
+    room = np.where(opening, p['tps_deg_stop_max'] - tps_deg, tps_deg - p['tps_deg_stop_min'])
+    move_deg = np.minimum(move_deg, np.maximum(room, 0.0))
+    steps = np.floor(move_deg/(p['step_deg']/divisor*p['throttle_deg_per_motor_deg']))
+    steps = np.minimum(np.minimum(steps, p['max_steps_per_cycle']), np.floor(p['cycle_budget']/spacing))
+    return np.maximum(steps, 1).astype(np.int64)
+
+def evaluate(trace, params = None): #the main loop's decisions for every sample of a trace, returns dict of arrays
+    p = dict(DEFAULT_PARAMS)
+    p.update(params or {})
+    if p['control_mode'] != 'step':
+        raise ValueError("replay only models control_mode 'step', not " + repr(p['control_mode']) + " (use plant_sim.py for the 'angle' mode)")
+    if p['step_deg'] is None:
+        import ThrottleByWire as tbw
+        p['step_deg'] = tbw.Step_deg
+    cal = dict(calibration.DEFAULT_CALIBRATION)
+    cal.update({k: v for k, v in p.items() if k in cal})
+    if 'pedalspeedmap_speed_percentage' in p:
+        cal['pedalspeedmap_speed_percentage'] = tuple(p['pedalspeedmap_speed_percentage'])
+    tables = calibration.CalibrationTables(cal, p['cruise_spd'], p['ads_gain'])
+    t = trace['t']
+    if 'act_spd' in trace and not np.any(trace['axle_code']): #speed was measured from tooth edges (axle channel not read), use the recorded speed
+        act_spd = trace['act_spd'].astype(float)
+    else:
+        act_spd = tables.axle[trace['axle_code']]
+    des_spd = tables.pps[trace['pps_code']]
+    tps_deg = tables.tps[trace['tps_code']]
+    if 'tps_predicted' in trace: #opening was predicted by the position observer (the tps code may still be a real sample with the acquisition engine), use the recorded opening there
+        tps_deg = np.where(trace['tps_predicted'] != 0, trace['tps_deg'].astype(float), tps_deg)
+    elif 'tps_deg' in trace: #traces without the flag (csv, or recorded before it): the tps channel was not read where its code is 0
+        tps_deg = np.where(trace['tps_code'] == 0, trace['tps_deg'].astype(float), tps_deg)
+    psw = tables.psw[trace['psw_code']]
+    accel_rate = windowed_accel_rate(t, act_spd, p['mov_avg_itr_window'] - 1, p['accel_rate_method'])
+    accel_rate[:p['mov_avg_itr_window'] - 1] = 0.0 #the loop starts once the window has dropped its first pair (SpeedWindow.rolled)
+    spd_error = des_spd - act_spd
+    mode = step_mode_index(spd_error, p['step_mode_thresholds'])
+    cap = p['accel_rate_cap']
+    down = psw == 1
+    faster = des_spd > act_spd
+    step_stop = trace['step_stop'] if 'step_stop' in trace else np.zeros(len(t), dtype = np.int8)
+    can_open = step_stop != 1
+    can_close = step_stop != -1
+    #same branch order as the main loop
+    branch = np.select([faster & (tps_deg < p['tps_deg_stop_max']) & (accel_rate < cap) & down & can_open,
+                        faster & (tps_deg > p['tps_deg_stop_min']) & (accel_rate > cap) & down & can_close,
+                        (des_spd < act_spd) & (tps_deg > p['tps_deg_stop_min']) & down & can_close,
+                        (psw == 0) & (tps_deg > p['tps_deg_stop_min']) & can_close],
+                       [OPEN, CLOSE_ACCEL_CAP, CLOSE_OVERSPEED, CLOSE_PEDAL_UP], HOLD).astype(np.int8)
+    mode = np.where(branch == CLOSE_PEDAL_UP, 0, mode).astype(np.int8) #pedal up closes in Full step mode
+    direction = np.where(branch == OPEN, 1, np.where(branch == HOLD, 0, -1))
+    if p['use_step_batches']:
+        steps = planned_steps(direction, tps_deg, spd_error, mode, accel_rate, p)*direction
+        if 'move_queued' in trace: #motion engine was still stepping out a batch, the loop made one step
+            steps = np.where(trace['move_queued'] != 0, direction, steps)
+    else:
+        steps = direction.astype(np.int64)
+    divisor = np.array([STEP_DIVISOR[m] for m in STEP_MODES], dtype = float)[mode]
+    return {'t': t, 'act_spd': act_spd, 'des_spd': des_spd, 'tps_deg': tps_deg, 'psw': psw, 'accel_rate': accel_rate, 'spd_error': spd_error,
+            'step_mode': mode, 'step_delay': np.maximum(delay_FullStep/divisor, min_delay), 'branch': branch, 'steps': steps, 'params': p}
+#####
+
+
+
+#####Scoring and sweeps
+def default_score(trace, result): #summary numbers for one parameter set (lower is better for all but 'agreement')
+    branch = result['branch']
+    steps = result['steps']
+    p = result['params']
+    n = max(len(branch), 1)
+    moving = np.sign(steps[steps != 0])
+    score = {name + '_frac': float(np.count_nonzero(branch == i))/n for i, name in enumerate(BRANCH_NAMES)}
+    score['reversals'] = int(np.count_nonzero(moving[1:] != moving[:-1])) #open to close or close to open changes (hunting)
+    score['steps_total'] = int(np.abs(steps).sum())
+    score['mean_abs_spd_error'] = float(np.mean(np.abs(result['spd_error']))) if len(branch) else 0.0
+    score['accel_over_cap_frac'] = float(np.count_nonzero(result['accel_rate'] > p['accel_rate_cap']))/n
+    pedal_up = result['psw'] == 0
+    score['pedal_up_open_frac'] = float(np.count_nonzero(pedal_up & (result['tps_deg'] > p['tps_deg_max_pedal_up'])))/max(np.count_nonzero(pedal_up), 1)
+    if 'steps' in trace: #how often this parameter set decides the same as the recorded loop did
+        score['agreement'] = float(np.count_nonzero(np.asarray(trace['steps']) == steps))/n
+    return score
+
+def param_grid(**choices): #every combination, e.g. param_grid(cruise_spd = [10, 12], accel_rate_cap = [2, 2.5, 3]) gives 6 parameter dicts
+    names = list(choices)
+    return [dict(zip(names, values)) for values in itertools.product(*(choices[name] for name in names))]
+
+_worker_trace = None #trace for pool workers, sent once per worker instead of once per parameter set
+
+def _init_worker(trace):
+    global _worker_trace
+    _worker_trace = trace
+
+def _score_worker(args):
+    params, score = args
+    return score(_worker_trace, evaluate(_worker_trace, params))
+
+def sweep(trace, param_sets, score = default_score, processes = None): #score every parameter set over the trace, returns list of (params, score dict)
+    #processes > 1 spreads the parameter sets over a process pool (score must then be a module level function)
+    if processes is not None and processes > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes, initializer = _init_worker, initargs = (trace,)) as pool:
+            scores = list(pool.map(_score_worker, [(params, score) for params in param_sets]))
+    else:
+        scores = [score(trace, evaluate(trace, params)) for params in param_sets]
+    return list(zip(param_sets, scores))
+#####
+
+
+
+def record_sim_trace(duration = 120.0, settings = None): #record a drive on the simulator (plant_sim.py) and return it as a trace
+    import tempfile
+    import plant_sim
+    with tempfile.TemporaryDirectory() as directory:
+        run_settings = {'record_telemetry': True, 'telemetry_dir': directory}
+        run_settings.update(settings or {})
+        plant_sim.simulate(duration, settings = run_settings, record_every = None)
+        return load_trace(directory)
+
+
+
+#Check the replay against a simulated drive, then sweep some parameters
+#Run with 'python3 replay.py [trace file or telemetry directory] [--processes N]'
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Replay the control law over a recorded drive and sweep parameters")
+    parser.add_argument('trace', nargs = '?', help = "telemetry .npy file/directory or csv (records a simulated drive if not given)")
+    parser.add_argument('--processes', type = int, default = None, help = "process pool size for the sweep")
+    args = parser.parse_args()
+
+    if args.trace is None:
+        start = time.perf_counter()
+        trace = record_sim_trace()
+        print("recorded simulated drive:", len(trace['t']), "samples in", round(time.perf_counter() - start, 1), "s")
+    else:
+        trace = load_trace(args.trace)
+        print("loaded", len(trace['t']), "samples from", args.trace)
+
+    start = time.perf_counter()
+    result = evaluate(trace)
+    elapsed = time.perf_counter() - start
+    print("replay with the current settings:", round(elapsed*1000, 1), "ms  (", round(elapsed/max(len(trace['t']), 1)*1e9), "ns per sample )")
+    if 'steps' in trace:
+        print("same decision as the recorded loop:", round(default_score(trace, result)['agreement']*100, 3), "% of samples")
+
+    param_sets = param_grid(cruise_spd = [10, 12, 14], accel_rate_cap = [2.0, 2.5, 3.0], mov_avg_itr_window = [10, 25, 50], accel_rate_method = ['endpoint', 'slope'])
+    start = time.perf_counter()
+    results = sweep(trace, param_sets, processes = args.processes)
+    elapsed = time.perf_counter() - start
+    print("swept", len(param_sets), "parameter sets in", round(elapsed, 2), "s")
+    print("fewest reversals (least hunting):")
+    print("  cruise_spd  accel_rate_cap  window  method    reversals  steps_total  accel_over_cap")
+    for params, score in sorted(results, key = lambda r: (r[1]['reversals'], r[1]['steps_total']))[:5]:
+        print("  " + str(params['cruise_spd']).rjust(10), str(params['accel_rate_cap']).rjust(15), str(params['mov_avg_itr_window']).rjust(7), params['accel_rate_method'].ljust(9),
+              str(score['reversals']).rjust(10), str(score['steps_total']).rjust(12), str(round(score['accel_over_cap_frac'], 3)).rjust(15))
@@ -0,0 +1,139 @@
+#Per loop sensor frame for ThrottleByWire.py
+#Before this, one loop would call step_mode() once for the MODE pins, again inside delay() for each step, and twice more when printing,
+#and delay('pedal_up') would do another tps read. So the decisions inside one loop could be made from different sensor readings.
+#A SensorFrame captures the raw ADC codes once per loop, and works out the useful values (speeds, tps degrees, step mode, step delay etc.) only when first asked for,
+#at most once per loop. The frame can not be changed after it is made, so every decision in one loop is made from the same readings.
+
+
+#####Step mode/delay settings
+delay_FullStep = 0.00125 #Time to delay between each step, if full stepping
+min_delay = 0.000002 #min delay of 2 microseconds
+
+STEP_MODES = ('Full', 'Half', '1/4', '1/8', '1/16', '1/32', '1/64') #coarsest to finest
+STEP_MODE_THRESHOLDS = (5, 4, 3.5, 3, 2.5, 1) #speed error (mph) below which each finer mode (STEP_MODES[1:]) is used, see step_mode_for_error()
+STEP_DIVISOR = {'Full': 1, 'Half': 2, '1/4': 4, '1/8': 8, '1/16': 16, '1/32': 32, '1/64': 64} #number of microsteps per full step for each mode
+RESOLUTION = {'Full': (0,0,0), 'Half': (1,0,0), '1/4': (0,1,0), '1/8': (1,1,0), '1/16': (0,0,1), '1/32': (1,0,1), '1/64': (1,1,1)} #M0/M1/M2 pin levels for each mode [From DRV8825 datasheet]
+TICKS_PER_STEP = 64 #1/64 step is the finest DRV8825 microstep, positions are counted in these ('ticks')
+STEP_DELAY = {mode: max(delay_FullStep/div, min_delay) for mode, div in STEP_DIVISOR.items()} #delay between steps for each step mode
+#####
+
+
+
+def step_mode_for_error(diff): #microstepping mode depending upon how close actual and desired speeds are, in order for throttle control to be more precise vs quick
+    diff = abs(diff)
+    mode = 'Full'
+    for finer, limit in zip(STEP_MODES[1:], STEP_MODE_THRESHOLDS): #each threshold the error is under moves one mode finer
+        if diff >= limit:
+            break
+        mode = finer
+    return mode
+
+def step_mode_for_pedal_up(diff): #microstepping mode when closing throttle with pedal up, diff is degrees above tps_deg_max_pedal_up
+    if diff < 0.1:
+        return '1/64'
+    elif diff < 0.25:
+        return '1/32'
+    elif diff < 0.5:
+        return '1/16'
+    elif diff < 1:
+        return '1/8'
+    elif diff < 3:
+        return '1/4'
+    elif diff < 5:
+        return 'Half'
+    return 'Full'
+
+
+
+_UNSET = object() #marks a value in the frame that has not been worked out yet
+
+
+class SensorFrame: #raw sensor readings for one loop, and the values worked out from them (each worked out at most once)
+    __slots__ = ('timestamp', 'pps_code', 'axle_code', 'tps_code', 'psw_code', 'tps_predicted', 'tables', 'tps_deg_max_pedal_up',
+                 '_act_spd', '_des_spd', '_tps_deg', '_psw', '_spd_error', '_step_mode', '_step_mode_pedal_up')
+
+    def __init__(self, timestamp, pps_code, axle_code, tps_code, psw_code, tables, tps_deg_max_pedal_up, act_spd = _UNSET, tps_deg = _UNSET):
+        setattr_ = object.__setattr__
+        setattr_(self, 'timestamp', timestamp)
+        setattr_(self, 'pps_code', pps_code)
+        setattr_(self, 'axle_code', axle_code)
+        setattr_(self, 'tps_code', tps_code)
+        setattr_(self, 'psw_code', psw_code)
+        setattr_(self, 'tables', tables) #calibration.CalibrationTables used to convert the codes
+        setattr_(self, 'tps_deg_max_pedal_up', tps_deg_max_pedal_up)
+        for name in ('_des_spd', '_psw', '_spd_error', '_step_mode', '_step_mode_pedal_up'):
+            setattr_(self, name, _UNSET)
+        setattr_(self, '_act_spd', act_spd) #given if the speed is measured some other way than the axle channel (see axle_speed.py)
+        setattr_(self, '_tps_deg', tps_deg) #given if the throttle opening is predicted instead of read (see position_observer.py)
+        setattr_(self, 'tps_predicted', tps_deg is not _UNSET) #tps_deg is the prediction, not tps_code converted (tps_code is 0 or a sample the loop did not use)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SensorFrame can not be changed, capture a new frame instead")
+
+    def __delattr__(self, name):
+        raise AttributeError("SensorFrame can not be changed, capture a new frame instead")
+
+    @property
+    def act_spd(self): #actual vehicle speed, mph
+        if self._act_spd is _UNSET:
+            object.__setattr__(self, '_act_spd', self.tables.veh_spd(self.axle_code))
+        return self._act_spd
+
+    @property
+    def des_spd(self): #desired vehicle speed from pedal, mph
+        if self._des_spd is _UNSET:
+            object.__setattr__(self, '_des_spd', self.tables.des_spd(self.pps_code))
+        return self._des_spd
+
+    @property
+    def tps_deg(self): #throttle opening, degrees
+        if self._tps_deg is _UNSET:
+            object.__setattr__(self, '_tps_deg', self.tables.tps_deg(self.tps_code))
+        return self._tps_deg
+
+    @property
+    def psw(self): #pedal switch (Pedal Up = 0; Pedal Down = 1)
+        if self._psw is _UNSET:
+            object.__setattr__(self, '_psw', int(self.tables.psw_state(self.psw_code)))
+        return self._psw
+
+    @property
+    def spd_error(self): #desired minus actual speed, positive value indicates user commanding to go faster
+        if self._spd_error is _UNSET:
+            object.__setattr__(self, '_spd_error', self.des_spd - self.act_spd)
+        return self._spd_error
+
+    @property
+    def step_mode(self): #microstepping mode from speed error (see step_mode_for_error)
+        if self._step_mode is _UNSET:
+            object.__setattr__(self, '_step_mode', step_mode_for_error(self.spd_error))
+        return self._step_mode
+
+    @property
+    def step_mode_pedal_up(self): #microstepping mode used when closing throttle with pedal up (see step_mode_for_pedal_up)
+        if self._step_mode_pedal_up is _UNSET:
+            object.__setattr__(self, '_step_mode_pedal_up', step_mode_for_pedal_up(self.tps_deg - self.tps_deg_max_pedal_up))
+        return self._step_mode_pedal_up
+
+    @property
+    def step_delay(self): #delay between steps for this loop's step mode
+        return STEP_DELAY[self.step_mode]
+
+    @property
+    def step_delay_pedal_up(self):
+        return STEP_DELAY[self.step_mode_pedal_up]
+
+    def __repr__(self):
+        return ("SensorFrame(t=" + str(round(self.timestamp, 4)) + ", pps=" + str(self.pps_code) + ", axle=" + str(self.axle_code) +
+                ", tps=" + str(self.tps_code) + ", psw=" + str(self.psw_code) + ")")
+
+
+def capture_frame(read_code, timestamp, tables, tps_deg_max_pedal_up, pps_ch = 0, axle_ch = 1, tps_ch = 2, psw_ch = 3, act_spd = None, tps_deg = None): #read each channel exactly once and make a frame
+    #if act_spd is given (speed from tooth edges), the axle channel is not read and its code is 0, the same for tps_deg (predicted opening) and the tps channel
+    return SensorFrame(timestamp, read_code(pps_ch), 0 if act_spd is not None else read_code(axle_ch), 0 if tps_deg is not None else read_code(tps_ch), read_code(psw_ch),
+                       tables, tps_deg_max_pedal_up, _UNSET if act_spd is None else act_spd, _UNSET if tps_deg is None else tps_deg)
+
+def frame_from_snapshot(snapshot, timestamp, tables, tps_deg_max_pedal_up, pps_ch = 0, axle_ch = 1, tps_ch = 2, psw_ch = 3, act_spd = None, tps_deg = None): #make a frame from an AcquisitionEngine snapshot (no bus reads at all)
+    #the tps sample is kept even when tps_deg (predicted opening) is given, the frame's tps_predicted says which one the loop used
+    return SensorFrame(timestamp, snapshot[pps_ch].code, 0 if act_spd is not None else snapshot[axle_ch].code, snapshot[tps_ch].code, snapshot[psw_ch].code,
+                       tables, tps_deg_max_pedal_up, _UNSET if act_spd is None else act_spd, _UNSET if tps_deg is None else tps_deg)
@@ -0,0 +1,96 @@
+#Step batch planner for ThrottleByWire.py
+#The main loop used to issue at most one step per loop. At full step that is 1.8 deg of motor travel, at 1/64 it is far less,
+#so a big pedal change took hundreds of loops (each one paying for the sensor reads) to get the throttle where it needed to be.
+#The planner works out how many steps to issue this loop, and how far apart to space them, from the throttle opening, speed error and microstep mode.
+#It never plans past tps_deg_stop_min/tps_deg_stop_max, and plans fewer opening steps as the acceleration rate gets near accel_rate_cap.
+#With the motion engine, tps_deg should be where the queued move will leave the throttle (the TPS lags the motor), see ThrottleByWire.step_count().
+#'python3 step_planner.py' prints how many loops it takes to go from closed to wide open throttle, compared with one step per loop.
+
+
+#####Library Imports
+import math
+from collections import namedtuple
+from sensor_frame import STEP_DIVISOR
+#####
+
+
+
+
+StepBatch = namedtuple('StepBatch', ['steps', 'spacing', 'mode']) #number of pulses (signed, negative closes), seconds between pulses, microstep mode
+
+
+
+class StepBatchPlanner:
+    #throttle_deg_per_motor_deg --- throttle degrees moved per motor degree (pulley/cable ratio, measure on the car; 1 if the pulleys are the same size)
+    #deg_per_mph ------------------ how many throttle degrees to move per mph of speed error (past batch_error_min) in one loop
+    #max_batch_deg ---------------- most throttle degrees to move in one loop
+    #cycle_budget ----------------- most time (s) the pulses of one batch should take, so the batch is finished before the next loop
+    #step_delay ------------------- dict of step mode to seconds between pulses
+    #step_deg --------------------- motor degrees for each full step (ThrottleByWire.Step_deg)
+    #batch_error_min -------------- speed error (mph) below which only the one step per loop is planned. The speed takes seconds to follow the throttle,
+    #                               so batches sized on a small speed error overshoot and the throttle swings back and forth around the desired speed
+    def __init__(self, step_delay, step_deg, tps_deg_stop_min = 0.2, tps_deg_stop_max = 78, accel_rate_cap = 2.5, throttle_deg_per_motor_deg = 1.0,
+                 deg_per_mph = 4.0, max_batch_deg = 10.0, cycle_budget = 0.02, max_steps_per_cycle = 256, batch_error_min = 2.0):
+        self.step_delay = step_delay
+        self.step_deg = step_deg
+        self.tps_deg_stop_min = tps_deg_stop_min
+        self.tps_deg_stop_max = tps_deg_stop_max
+        self.accel_rate_cap = accel_rate_cap
+        self.throttle_deg_per_motor_deg = throttle_deg_per_motor_deg
+        self.deg_per_mph = deg_per_mph
+        self.max_batch_deg = max_batch_deg
+        self.cycle_budget = cycle_budget
+        self.max_steps_per_cycle = max_steps_per_cycle
+        self.batch_error_min = batch_error_min
+
+    def deg_per_pulse(self, mode): #throttle degrees moved by one pulse in this mode
+        return self.step_deg/STEP_DIVISOR[mode]*self.throttle_deg_per_motor_deg
+
+    def plan(self, direction, tps_deg, spd_error, mode, accel_rate = 0.0): #direction is 1 (open) or -1 (close) as picked by the main loop
+        if direction == 0:
+            return StepBatch(0, 0.0, mode)
+        #how far the throttle should move this loop (nothing past the one step inside batch_error_min, growing from there so the batch size does not jump at the edge)
+        move_deg = min(max(abs(spd_error) - self.batch_error_min, 0.0)*self.deg_per_mph, self.max_batch_deg)
+        if direction > 0:
+            room = self.tps_deg_stop_max - tps_deg #do not plan past fully open
+            if self.accel_rate_cap > 0 and accel_rate > 0: #open less as accel rate gets near the cap
+                move_deg *= max(0.0, 1 - accel_rate/self.accel_rate_cap)
+        else:
+            room = tps_deg - self.tps_deg_stop_min #do not plan past closed
+            if accel_rate > self.accel_rate_cap > 0: #closing because of accel rate cap, close more the further over the cap
+                move_deg = min(self.max_batch_deg, (accel_rate - self.accel_rate_cap)/self.accel_rate_cap*self.max_batch_deg)
+        move_deg = min(move_deg, max(room, 0.0))
+        spacing = self.step_delay[mode]
+        steps = int(move_deg/self.deg_per_pulse(mode))
+        steps = min(steps, self.max_steps_per_cycle, int(self.cycle_budget/spacing) if spacing > 0 else self.max_steps_per_cycle)
+        steps = max(steps, 1) #the main loop already decided to step, so always at least the one step it used to do
+        return StepBatch(direction*steps, spacing, mode)
+
+
+
+def cycles_closed_to_wot(planner, mode, spd_error, batched = True): #number of loops to open the throttle from tps_deg_stop_min to tps_deg_stop_max
+    tps_deg = planner.tps_deg_stop_min
+    cycles = 0
+    while tps_deg < planner.tps_deg_stop_max:
+        if batched:
+            steps = planner.plan(1, tps_deg, spd_error, mode).steps
+        else:
+            steps = 1
+        tps_deg += steps*planner.deg_per_pulse(mode)
+        cycles += 1
+    return cycles
+
+
+
+#Compare loops needed from closed to wide open throttle, batched vs one step per loop
+#Run with 'python3 step_planner.py'
+if __name__ == "__main__":
+    from sensor_frame import STEP_DELAY, step_mode_for_error
+    from ThrottleByWire import Step_deg
+    planner = StepBatchPlanner(STEP_DELAY, Step_deg)
+    print("loops from closed to wide open throttle (throttle_deg_per_motor_deg =", planner.throttle_deg_per_motor_deg, ")")
+    for spd_error in (6, 4.5, 3.2, 2, 0.5):
+        mode = step_mode_for_error(spd_error)
+        one = cycles_closed_to_wot(planner, mode, spd_error, batched = False)
+        batched = cycles_closed_to_wot(planner, mode, spd_error)
+        print("  speed error", spd_error, "mph  mode", mode, "   one step per loop:", one, "   batched:", batched, "   (", round(one/batched, 1), "x fewer loops )")
@@ -0,0 +1,357 @@
+#Stepper motor motion engine for ThrottleByWire.py
+#step_open()/step_close() pulse STEP and then sleep for the step delay, so the whole control loop waits on the motor every time it steps.
+#The MotionEngine here generates the step pulses itself on its own thread. The control loop only tells it where the motor should be (a target position),
+#and the engine steps toward it with a trapezoidal speed profile (speeds up at a set acceleration, runs at the speed limit, slows down before the target),
+#so the motor is not asked to jump straight to full speed (a cause of lost steps, see notes at bottom of ThrottleByWire.py).
+#If the target changes to behind the motor (or closer than it can stop), the motor slows to a stop at the same acceleration first, then comes back.
+#Targets are kept inside the travel limits (min_position/max_position), a stop past a target can still go over by the stopping distance.
+#Microstep mode changes are held until the motor is on a position the new mode can land on, because changing modes part way between steps also seemed to lose position.
+#
+#Positions are counted in 1/64 steps ('ticks'), so the position stays the same no matter what microstep mode was used to get there.
+#A SimulatedGPIO (and SimClock) can be used instead of RPi.GPIO to record the pulse times, to check the ramps without a Pi: 'python3 stepper_motion.py'
+
+
+#####Library Imports
+import time
+import math
+import threading
+import timing
+from sensor_frame import STEP_DIVISOR, RESOLUTION, TICKS_PER_STEP #step mode tables (see sensor_frame.py)
+#####
+
+
+
+def ticks_per_pulse(mode): #how many 1/64 steps one STEP pulse moves in this mode
+    return TICKS_PER_STEP//STEP_DIVISOR[mode]
+
+def stop_position(position, velocity, acceleration, mode): #nearest position (ticks) a motor at 'velocity' (full steps/s) can slow down to a stop at, in whole pulses of 'mode'
+    ticks = math.ceil(velocity*velocity/(2*acceleration)*TICKS_PER_STEP)
+    pulse = ticks_per_pulse(mode)
+    ticks = -(-ticks//pulse)*pulse
+    return position + (ticks if velocity > 0 else -ticks)
+
+
+
+#####Clocks and GPIO backends
+class RealClock: #time.perf_counter, with short waits spun instead of slept (time.sleep is not accurate for short times, see timing.py)
+    spin_below = timing.SPIN_BELOW
+
+    def now(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        timing.sleep_until(time.perf_counter() + seconds, self.spin_below)
+
+    def sleep_until(self, t):
+        timing.sleep_until(t, self.spin_below)
+
+
+class SimClock: #simulated time, sleeping just moves the time forward (so a long move is simulated instantly)
+    def __init__(self, start = 0.0):
+        self.t = start
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+    def sleep_until(self, t):
+        if t > self.t:
+            self.t = t
+
+
+class SimulatedGPIO: #stands in for RPi.GPIO, records every output and the time of every STEP pulse
+    HIGH = 1
+    LOW = 0
+    OUT = 0
+    IN = 1
+    BCM = 11
+    RISING = 31
+
+    def __init__(self, clock, step_pin = 21, dir_pin = 20):
+        self.clock = clock
+        self.step_pin = step_pin
+        self.dir_pin = dir_pin
+        self.pins = {}
+        self.writes = 0
+        self.pulses = [] #(time, direction pin level) for every rising edge on STEP
+        self.edge_callbacks = {} #pin: callback, from add_event_detect
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction):
+        pass
+
+    def output(self, pin, value):
+        if isinstance(pin, (tuple, list)):
+            values = value if isinstance(value, (tuple, list)) else [value]*len(pin)
+            for p, v in zip(pin, values):
+                self.output(p, v)
+            return
+        self.writes += 1
+        if pin == self.step_pin and value and not self.pins.get(pin, 0):
+            self.pulses.append((self.clock.now(), self.pins.get(self.dir_pin, 0)))
+        self.pins[pin] = value
+
+    def add_event_detect(self, pin, edge, callback = None, bouncetime = None):
+        self.edge_callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.edge_callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.pins = {}
+
+    def pulse_times(self):
+        return [t for t, d in self.pulses]
+
+    def intervals(self): #time between each pulse and the one before it
+        times = self.pulse_times()
+        return [b - a for a, b in zip(times, times[1:])]
+#####
+
+
+
+class MotionEngine: #steps the motor toward a target position on its own thread, with trapezoidal acceleration
+    #gpio ------------- RPi.GPIO (or SimulatedGPIO)
+    #max_velocity ----- speed limit in full steps per second
+    #acceleration ----- full steps per second per second, used to speed up and to slow down
+    #cw/ccw ----------- DIR pin levels for opening/closing the throttle (positive/negative positions)
+    #min_position/max_position --- travel limits in ticks, targets are clamped to these (None for no limit)
+    def __init__(self, gpio, step_pin, dir_pin, mode_pins = None, max_velocity = 800, acceleration = 8000, cw = 0, ccw = 1, clock = None,
+                 min_position = None, max_position = None):
+        self.gpio = gpio
+        self.step_pin = step_pin
+        self.dir_pin = dir_pin
+        self.mode_pins = mode_pins
+        self.max_velocity = max_velocity
+        self.acceleration = acceleration
+        self.cw = cw
+        self.ccw = ccw
+        self.clock = clock if clock is not None else RealClock()
+        self.min_position = min_position
+        self.max_position = max_position
+        self.position = 0 #commanded position, ticks (1/64 steps)
+        self.target = 0 #target position, ticks
+        self.mode = 'Full' #mode the MODE pins are set to
+        self.requested_mode = 'Full' #mode the control loop asked for (used once the position lines up with it)
+        self.velocity = 0.0 #current speed, full steps per second (signed, positive is opening)
+        self.direction = None #last level written to DIR pin
+        self.next_pulse_time = None
+        self.pulse_count = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self._running = False
+        self._thread = None
+        if mode_pins is not None:
+            gpio.output(mode_pins, RESOLUTION[self.mode])
+
+    #Control loop side (these only change numbers, they never wait on the motor)
+    def set_target(self, position): #target position in ticks (1/64 steps), clamped to the travel limits
+        with self.lock:
+            self.target = self._clamp(int(position))
+        self.wake.set()
+
+    def move_by(self, ticks): #move the target by this many ticks from where the target currently is (clamped to the travel limits)
+        with self.lock:
+            self.target = self._clamp(self.target + int(ticks))
+        self.wake.set()
+
+    def halt(self): #drop the rest of the move: target the nearest position the motor can slow down to a stop at (clamped to the travel limits), no sudden stop
+        with self.lock:
+            self.target = self._clamp(stop_position(self.position, self.velocity, self.acceleration, self.mode))
+        self.wake.set()
+
+    def set_limits(self, min_position = None, max_position = None): #travel limits in ticks (None for no limit), the target is moved inside them
+        with self.lock:
+            self.min_position = min_position
+            self.max_position = max_position
+            target = self.target
+            self.target = self._clamp(target)
+        if self.target != target:
+            self.wake.set()
+
+    def _clamp(self, position):
+        if self.max_position is not None and position > self.max_position:
+            position = self.max_position
+        if self.min_position is not None and position < self.min_position:
+            position = self.min_position
+        return position
+
+    def move_steps(self, steps, mode = None): #move the target by a number of pulses in a microstep mode (e.g. move_steps(1, '1/16') is one 1/16 step)
+        self.move_by(steps*ticks_per_pulse(mode if mode is not None else self.requested_mode))
+
+    def set_mode(self, mode): #change microstep mode (applied between pulses, once position lines up with the new mode)
+        if mode not in STEP_DIVISOR:
+            raise ValueError("unknown step mode: " + str(mode))
+        with self.lock:
+            self.requested_mode = mode
+        self.wake.set()
+
+    def set_max_velocity(self, max_velocity): #full steps per second
+        self.max_velocity = max_velocity
+
+    def distance_to_go(self):
+        return self.target - self.position
+
+    def is_moving(self): #not at the target, or still slowing down (past it, or turning around)
+        return self.position != self.target or self.velocity != 0.0
+
+    #Pulse generation
+    def _write_mode(self, mode):
+        self.mode = mode
+        if self.mode_pins is not None:
+            self.gpio.output(self.mode_pins, RESOLUTION[mode])
+
+    def _choose_mode(self, to_go): #pick the mode for the next pulse
+        #go to the requested mode once the position is a whole number of its steps (only matters when going to a coarser mode)
+        if self.mode != self.requested_mode and self.position % ticks_per_pulse(self.requested_mode) == 0:
+            self._write_mode(self.requested_mode)
+        #if the position is between steps of this mode, or a pulse would go past the target, use the coarsest finer mode that fits
+        ticks = ticks_per_pulse(self.mode)
+        if self.position % ticks == 0 and abs(to_go) >= ticks:
+            return ticks
+        for mode in ('Half', '1/4', '1/8', '1/16', '1/32', '1/64'):
+            t = ticks_per_pulse(mode)
+            if t < ticks and self.position % t == 0 and abs(to_go) >= t:
+                self._write_mode(mode)
+                return t
+        return ticks
+
+    def _can_stop(self): #True if the motor is slow enough to stop (or turn around) in one pulse of the current mode
+        return self.velocity*self.velocity <= 2*self.acceleration*ticks_per_pulse(self.mode)/TICKS_PER_STEP*1.000001
+
+    def step_once(self): #do one pulse if needed, returns the time the next pulse is due (or None if at target and stopped)
+        with self.lock:
+            to_go = self.target - self.position
+            moving = (self.velocity > 0) - (self.velocity < 0) #direction the motor is turning, 0 if stopped
+            if moving and (to_go == 0 or (to_go > 0) != (moving > 0)) and self._can_stop():
+                self.velocity = 0.0 #slow enough to stop here (and turn around if the target is behind)
+                moving = 0
+            if to_go == 0 and not moving:
+                if self.mode != self.requested_mode and self.position % ticks_per_pulse(self.requested_mode) == 0:
+                    self._write_mode(self.requested_mode)
+                self.next_pulse_time = None
+                return None
+            if moving and (to_go == 0 or (to_go > 0) != (moving > 0)): #target is behind the motor (or it is going too fast to stop on it), keep going and slow down
+                direction = moving
+                ticks = self._choose_mode(moving*TICKS_PER_STEP)
+                braking = True
+            else:
+                direction = 1 if to_go > 0 else -1
+                ticks = self._choose_mode(to_go)
+                braking = False
+        #trapezoidal profile, worked out per pulse: v^2 = v0^2 +/- 2*a*distance
+        pulse_dist = ticks/TICKS_PER_STEP #full steps moved by this pulse
+        speed = abs(self.velocity)
+        stop_dist = speed*speed/(2*self.acceleration) #full steps needed to slow to a stop
+        if braking or (abs(to_go)/TICKS_PER_STEP <= stop_dist + pulse_dist*0.5 and speed > 0):
+            speed = math.sqrt(max(speed*speed - 2*self.acceleration*pulse_dist, 0.0))
+        else:
+            speed = math.sqrt(speed*speed + 2*self.acceleration*pulse_dist)
+        speed = min(max(speed, math.sqrt(2*self.acceleration*pulse_dist)), self.max_velocity)
+        interval = pulse_dist/speed
+        now = self.clock.now()
+        if self.next_pulse_time is not None and self.next_pulse_time > now:
+            self.clock.sleep_until(self.next_pulse_time)
+            now = self.next_pulse_time
+        level = self.cw if direction > 0 else self.ccw
+        if level != self.direction:
+            self.gpio.output(self.dir_pin, level)
+            self.direction = level
+        self.gpio.output(self.step_pin, 1)
+        self.gpio.output(self.step_pin, 0)
+        with self.lock: #halt() reads the velocity from the loop thread
+            self.position += direction*ticks
+            self.pulse_count += 1
+            self.velocity = direction*speed
+        self.next_pulse_time = now + interval
+        return self.next_pulse_time
+
+    def run_until_idle(self, timeout = None): #generate pulses on this thread until the target is reached (for simulations, or without the thread)
+        start = self.clock.now()
+        while self.step_once() is not None:
+            if timeout is not None and self.clock.now() - start > timeout:
+                return False
+        return True
+
+    def run_until(self, t): #generate every pulse that is due up to time t on this thread (used by the simulator instead of the pulse thread)
+        while self.is_moving():
+            if self.next_pulse_time is not None and self.next_pulse_time > t:
+                return
+            self.step_once() #at target and slow enough, this stops the motor and lets the mode change to the requested mode
+        if self.mode != self.requested_mode:
+            self.step_once()
+
+    def _run(self):
+        while self._running:
+            if self.step_once() is None:
+                self.wake.wait(0.01)
+                self.wake.clear()
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target = self._run, name = "stepper-motion", daemon = True)
+            self._thread.start()
+        return self
+
+    def set_position(self, position): #say where the motor is (ticks), e.g. after the driver was asleep and the return spring moved it. Only while stopped, target is set there too
+        with self.lock:
+            self.position = int(position)
+            self.target = self._clamp(self.position)
+            self.velocity = 0.0
+        self.next_pulse_time = None
+
+    def stop(self): #stop the pulse thread (motor stops where it is, target set to current position)
+        self._running = False
+        self.wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout = 1)
+            self._thread = None
+        with self.lock:
+            self.target = self.position
+            self.velocity = 0.0
+
+    def wait_idle(self, timeout = None): #wait for the thread to reach the target (control loop should not need this), makes the pulses itself if the thread is not running
+        if not self._running:
+            return self.run_until_idle(timeout)
+        end = None if timeout is None else self.clock.now() + timeout
+        while self.is_moving():
+            if end is not None and self.clock.now() > end:
+                return False
+            self.clock.sleep(0.002)
+        return True
+
+
+
+#Simulated move to check the ramp timing: speeds up at the set acceleration, holds the speed limit, slows down before the target, then a target reversed part way
+#Run with 'python3 stepper_motion.py'
+if __name__ == "__main__":
+    clock = SimClock()
+    gpio = SimulatedGPIO(clock)
+    engine = MotionEngine(gpio, step_pin = 21, dir_pin = 20, mode_pins = (14,15,18), max_velocity = 800, acceleration = 8000, clock = clock)
+    engine.set_target(400*TICKS_PER_STEP) #400 full steps
+    engine.run_until_idle()
+    intervals = gpio.intervals()
+    speeds = [1/i for i in intervals]
+    ramp_time = 800/8000
+    print("pulses:", len(gpio.pulses), "  position:", engine.position/TICKS_PER_STEP, "steps  move time:", round(clock.now(), 4), "s")
+    print("peak speed:", round(max(speeds)), "steps/s   first speeds:", [round(s) for s in speeds[:5]], "  last speeds:", [round(s) for s in speeds[-5:]])
+    print("expected move time (trapezoid):", round(400/800 + ramp_time, 4), "s")
+    engine.set_mode('1/16')
+    engine.move_by(-3*ticks_per_pulse('1/16'))
+    engine.run_until_idle()
+    print("after 3 x 1/16 steps back:", engine.position, "ticks  mode:", engine.mode)
+    engine.set_mode('Full')
+    engine.set_target(0)
+    engine.run_until(clock.now() + 0.2) #closing at full speed
+    turned_at = engine.position
+    engine.set_target(400*TICKS_PER_STEP) #target changed to behind the motor, it slows to a stop before coming back
+    lowest = engine.position
+    while engine.step_once() is not None:
+        lowest = min(lowest, engine.position)
+    print("target reversed at", turned_at/TICKS_PER_STEP, "steps going", round(engine.max_velocity), "steps/s, stopped at", lowest/TICKS_PER_STEP,
+          "steps (stopping distance", engine.max_velocity**2/(2*engine.acceleration), "steps), then back to", engine.position/TICKS_PER_STEP)
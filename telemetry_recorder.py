@@ -0,0 +1,169 @@
+#Binary telemetry recorder for ThrottleByWire.py
+#Saves one fixed size record per control loop (time, raw ADS1115 codes, act_spd, des_spd, tps_deg, psw, accel_rate, step mode and steps), so a drive can be looked at afterwards.
+#
+#The loop only copies its record into a preallocated numpy structured array in memory (a ring of 'blocks').
+#A background thread copies the records from the ring into memory mapped .npy files, flushes them to disk every 'flush_interval' seconds,
+#and starts a new file every 'records_per_file' records, so memory use stays the same no matter how long the drive is.
+#The loop never waits on the SD card: if the writer falls a whole ring behind, new records are dropped (counted in 'dropped') instead.
+#
+#Files are normal .npy files, 'read_telemetry()' (or np.load) reads them back. Unused records at the end of the last file have cycle 0.
+#'python3 telemetry_recorder.py' records a long run of fake records as fast as it can and prints the time per record.
+
+
+#####Library Imports
+import os
+import time
+import threading
+import numpy as np
+from sensor_frame import STEP_MODES
+#####
+
+
+
+MODE_INDEX = {mode: i for i, mode in enumerate(STEP_MODES)}
+
+RECORD_DTYPE = np.dtype([('cycle', 'u4'), #loop number (starts at 1, 0 is an unused record)
+                         ('t', 'f8'), #frame timestamp, s
+                         ('pps_code', 'i2'), ('axle_code', 'i2'), ('tps_code', 'i2'), ('psw_code', 'i2'), #raw ADS1115 codes
+                         ('act_spd', 'f4'), ('des_spd', 'f4'), ('tps_deg', 'f4'), #mph, mph, deg
+                         ('psw', 'i1'), #pedal switch (Pedal Up = 0; Pedal Down = 1)
+                         ('step_mode', 'i1'), #index in STEP_MODES
+                         ('accel_rate', 'f4'), #mph/s
+                         ('steps', 'i2'), #steps issued this loop, positive opens, negative closes, 0 no move
+                         ('step_stop', 'i1'), #direction stepping was stopped in by a stall (1 opening, -1 closing, 0 none)
+                         ('move_queued', 'i1'), #1 if the motion engine was still stepping out an earlier move (no step batch this loop)
+                         ('tps_predicted', 'i1')]) #1 if tps_deg is the position observer's prediction (TPS not read, or its sample not used)
+
+
+
+class TelemetryRecorder:
+    #directory ---------- where the files go (made if needed), files are named '<prefix>_<start date/time>_<file number>.npy'
+    #records_per_file --- records in each file before starting the next one (fixed file size, records_per_file*RECORD_DTYPE.itemsize bytes)
+    #block_records ------ the writer is woken every time this many records have been added
+    #blocks ------------- ring size in blocks (how far the writer can fall behind before records are dropped)
+    #flush_interval ----- seconds between flushes of the file to disk
+    def __init__(self, directory = 'telemetry', records_per_file = 2**18, block_records = 1024, blocks = 16, flush_interval = 1.0, prefix = 'drive'):
+        self.directory = directory
+        self.records_per_file = records_per_file
+        self.block_records = block_records
+        self.size = block_records*blocks
+        self.flush_interval = flush_interval
+        self.prefix = prefix
+        self.ring = np.zeros(self.size, RECORD_DTYPE)
+        self.head = 0 #total records added by the loop
+        self.tail = 0 #total records copied to file by the writer
+        self.dropped = 0
+        self.files = [] #paths of files written
+        self.file = None #memory mapped array of the current file
+        self.file_pos = 0 #next record in the current file
+        self.started = time.strftime('%Y%m%d_%H%M%S')
+        self.wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    #Control loop side
+    def record(self, values): #add one record, a tuple in RECORD_DTYPE field order (one struct copy into the ring)
+        head = self.head
+        if head - self.tail >= self.size: #writer is a whole ring behind, drop rather than wait
+            self.dropped += 1
+            return
+        self.ring[head % self.size] = values
+        self.head = head + 1
+        if self.head % self.block_records == 0:
+            self.wake.set()
+
+    def record_frame(self, cycle, frame, accel_rate, mode, steps, step_stop = 0, move_queued = False): #add the record for one loop from its SensorFrame
+        self.record((cycle, frame.timestamp, frame.pps_code, frame.axle_code, frame.tps_code, frame.psw_code,
+                     frame.act_spd, frame.des_spd, frame.tps_deg, frame.psw, MODE_INDEX[mode], accel_rate, steps, step_stop, move_queued, frame.tps_predicted))
+
+    #Writer side
+    def _open_file(self):
+        os.makedirs(self.directory, exist_ok = True)
+        path = os.path.join(self.directory, self.prefix + '_' + self.started + '_' + str(len(self.files)).zfill(3) + '.npy')
+        self.file = np.lib.format.open_memmap(path, mode = 'w+', dtype = RECORD_DTYPE, shape = (self.records_per_file,))
+        self.file_pos = 0
+        self.files.append(path)
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.flush()
+            del self.file #unmaps the file
+            self.file = None
+
+    def write_pending(self): #copy records from the ring to the file(s), returns number copied (writer thread does this, close() does the last of it)
+        head = self.head
+        copied = 0
+        while self.tail < head:
+            if self.file is None or self.file_pos == self.records_per_file:
+                self._close_file()
+                self._open_file()
+            start = self.tail % self.size
+            #as many as fit before the end of the ring, the records waiting, and the room left in the file
+            n = min(self.size - start, head - self.tail, self.records_per_file - self.file_pos)
+            self.file[self.file_pos:self.file_pos + n] = self.ring[start:start + n]
+            self.file_pos += n
+            self.tail += n
+            copied += n
+        return copied
+
+    def _run(self):
+        last_flush = time.perf_counter()
+        while self._running:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.write_pending()
+            now = time.perf_counter()
+            if self.file is not None and now - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = now
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target = self._run, name = "telemetry-writer", daemon = True)
+            self._thread.start()
+        return self
+
+    def close(self): #stop the writer, save anything still in the ring and close the file
+        self._running = False
+        self.wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout = 5)
+            self._thread = None
+        self.write_pending()
+        self._close_file()
+
+
+
+def read_telemetry(paths): #read recorded files (a path, list of paths or a directory) into one array, oldest first, without unused records
+    if isinstance(paths, str):
+        if os.path.isdir(paths):
+            paths = sorted(os.path.join(paths, name) for name in os.listdir(paths) if name.endswith('.npy'))
+        else:
+            paths = [paths]
+    parts = []
+    for path in paths:
+        data = np.load(path, mmap_mode = 'r')
+        parts.append(np.array(data[data['cycle'] > 0]))
+    if not parts:
+        return np.zeros(0, RECORD_DTYPE)
+    return np.concatenate(parts)
+
+
+
+#Record fake loop records as fast as possible, then read them back
+#Run with 'python3 telemetry_recorder.py'
+if __name__ == "__main__":
+    import tempfile
+    n = 500000
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = TelemetryRecorder(directory, records_per_file = 2**17).start()
+        start = time.perf_counter()
+        for i in range(1, n + 1):
+            recorder.record((i, i*0.001, 1000, 2000, 3000, 20000, 10.0, 12.0, 20.0, 1, 2, 0.5, 3, 0, 0, 0))
+        elapsed = time.perf_counter() - start
+        recorder.close()
+        data = read_telemetry(directory)
+        print("records:", n, "  time per record:", round(elapsed/n*1e6, 2), "us  (", round(n/elapsed), "records/s )  dropped:", recorder.dropped)
+        print("files:", len(recorder.files), " each", round(2**17*RECORD_DTYPE.itemsize/1e6, 1), "MB   record size:", RECORD_DTYPE.itemsize, "bytes")
+        print("read back:", len(data), "records   cycles in order:", bool(np.all(np.diff(data['cycle'].astype(np.int64)) == 1)))
@@ -0,0 +1,170 @@
+#Telemetry windows used by the main loop in ThrottleByWire.py
+#The main loop used to keep python lists of the recent vehicle speeds, times, steps and tps values, and would remove the oldest value with 'x = x[1:]'
+#That copies the whole list every iteration, and the '.count()' calls rescan the whole list as well, so the loop slowed down as the windows grew.
+#The classes here keep the same windows in preallocated numpy arrays used as ring buffers (oldest value overwritten by newest), and keep running totals so every update is O(1).
+
+
+#####Library Imports
+import numpy as np
+#####
+
+
+
+class RingBuffer: #fixed size, preallocated circular buffer (oldest value is overwritten once full)
+    def __init__(self, size, dtype = float):
+        if size < 1:
+            raise ValueError("RingBuffer size must be at least 1")
+        self.size = size
+        self.data = np.zeros(size, dtype = dtype)
+        self.head = 0 #index the next value will be written to
+        self.count = 0 #number of valid values in buffer (stops growing once buffer is full)
+
+    def push(self, value): #add a value, returns the value that was overwritten (or None if buffer was not full yet)
+        dropped = None
+        if self.count == self.size:
+            dropped = self.data[self.head].item()
+        else:
+            self.count += 1
+        self.data[self.head] = value
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+        return dropped
+
+    def full(self):
+        return self.count == self.size
+
+    def oldest(self):
+        return self.data[(self.head - self.count) % self.size].item()
+
+    def newest(self):
+        return self.data[(self.head - 1) % self.size].item()
+
+    def values(self): #copy of the values, oldest first (only for printing/debugging, this is O(n))
+        if self.count < self.size:
+            return self.data[:self.count].copy()
+        return np.concatenate((self.data[self.head:], self.data[:self.head]))
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+
+
+class SpeedWindow: #window of (time, vehicle speed) pairs used to calculate the acceleration rate
+    #Keeps running sums of t, v, t*t and t*v so the least squares slope can be updated in O(1).
+    #Times are stored relative to a reference time so the sums do not lose precision as time.perf_counter() grows.
+    #The sums are rebuilt from the buffer once every 'size' samples (still O(1) on average) so rounding errors from adding/subtracting do not build up over a long drive.
+    def __init__(self, size):
+        self.times = RingBuffer(size)
+        self.speeds = RingBuffer(size)
+        self.t_ref = None #reference time, subtracted from every time stored
+        self.pushes_since_rebuild = 0
+        self.rolled = False #True once the window was full and has dropped its oldest pair
+        self._zero_sums()
+
+    def _zero_sums(self):
+        self.sum_t = 0.0
+        self.sum_v = 0.0
+        self.sum_tt = 0.0
+        self.sum_tv = 0.0
+
+    def _rebuild_sums(self): #re-reference times to the oldest sample and recalculate the sums from scratch
+        t = self.times.values()
+        v = self.speeds.values()
+        shift = t[0]
+        self.t_ref += shift
+        t = t - shift
+        #write the shifted times back into the buffer (in place, buffer order does not matter for the sums)
+        self.times.data -= shift
+        self.sum_t = float(t.sum())
+        self.sum_v = float(v.sum())
+        self.sum_tt = float(np.dot(t, t))
+        self.sum_tv = float(np.dot(t, v))
+        self.pushes_since_rebuild = 0
+
+    def push(self, t, v): #add newest time (s) and vehicle speed (mph) pair
+        if self.t_ref is None:
+            self.t_ref = t
+        t = t - self.t_ref
+        dropped_t = self.times.push(t)
+        dropped_v = self.speeds.push(v)
+        self.sum_t += t
+        self.sum_v += v
+        self.sum_tt += t*t
+        self.sum_tv += t*v
+        if dropped_t is not None:
+            self.rolled = True
+            self.sum_t -= dropped_t
+            self.sum_v -= dropped_v
+            self.sum_tt -= dropped_t*dropped_t
+            self.sum_tv -= dropped_t*dropped_v
+        self.pushes_since_rebuild += 1
+        if self.pushes_since_rebuild >= self.times.size:
+            self._rebuild_sums()
+
+    def full(self):
+        return self.times.full()
+
+    def endpoint_rate(self): #accel rate from oldest and newest speed/time values (same as the original list calculation)
+        dt = self.times.newest() - self.times.oldest()
+        if dt <= 0:
+            return 0.0
+        return (self.speeds.newest() - self.speeds.oldest())/dt
+
+    def slope_rate(self): #accel rate from least squares line fit through every value in the window (less sensitive to one noisy speed reading)
+        n = self.times.count
+        if n < 2:
+            return 0.0
+        denom = n*self.sum_tt - self.sum_t*self.sum_t
+        if denom <= 0:
+            return 0.0
+        return (n*self.sum_tv - self.sum_t*self.sum_v)/denom
+
+    def rate(self, method = 'endpoint'): #'endpoint' or 'slope'
+        if method == 'endpoint':
+            return self.endpoint_rate()
+        elif method == 'slope':
+            return self.slope_rate()
+        raise ValueError("accel rate method must be 'endpoint' or 'slope'")
+
+    def __len__(self):
+        return len(self.times)
+
+
+
+class HistoryWindow: #window of recent values (step directions or tps values) that can say if every value is the same in O(1)
+    #Instead of 'list.count(list[0]) >= len(list)', track how many of the newest values in a row are equal.
+    #If that run is at least as long as the window, then every value in the window is the same.
+    def __init__(self, size, dtype = float):
+        self.buffer = RingBuffer(size, dtype)
+        self.run_length = 0 #number of newest values in a row that are equal
+        self.step_sum = 0 #running total of the window (for step history this is the net number of steps)
+
+    def push(self, value):
+        if self.buffer.count and self.buffer.newest() == value:
+            self.run_length += 1
+        else:
+            self.run_length = 1
+        dropped = self.buffer.push(value)
+        self.step_sum += value
+        if dropped is not None:
+            self.step_sum -= dropped
+
+    def full(self):
+        return self.buffer.full()
+
+    def all_same(self): #True if every value currently in the window is equal
+        return self.buffer.count > 0 and self.run_length >= self.buffer.count
+
+    def first(self): #oldest value in the window
+        return self.buffer.oldest()
+
+    def values(self):
+        return self.buffer.values()
+
+    def __len__(self):
+        return len(self.buffer)
@@ -0,0 +1,15 @@
+#The modules are plain files in the folder above (no package), so make them importable from the tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stepper_motion import MotionEngine, SimClock, SimulatedGPIO
+
+
+
+def make_engine(**kwargs): #motion engine on a simulated clock (800 full steps/s, 8000 full steps/s^2), returns (engine, gpio, clock)
+    clock = SimClock()
+    gpio = SimulatedGPIO(clock)
+    engine = MotionEngine(gpio, step_pin = 21, dir_pin = 20, mode_pins = (14,15,18), max_velocity = 800, acceleration = 8000, clock = clock, **kwargs)
+    return engine, gpio, clock
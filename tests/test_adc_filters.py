@@ -0,0 +1,74 @@
+#ADC filter stages: spike removal, low pass step response, hysteresis
+import math
+from adc_filters import MovingMedian, Hysteresis, lowpass_biquad, one_pole_alpha, OnePole, Decimate, ChannelFilters, make_stage, volts_to_code
+
+
+def test_median_removes_short_spikes():
+    median = MovingMedian(5)
+    out = [median.update(x) for x in [100, 100, 100, 9000, 100, 100, -9000, -9000, 100, 100, 100]]
+    assert all(y == 100 for y in out)
+
+def test_median_follows_a_step_after_half_the_window():
+    median = MovingMedian(5)
+    out = [median.update(x) for x in [0]*5 + [50]*5]
+    assert out[5:] == [0, 0, 50, 50, 50]
+
+def test_median_of_the_last_n_only():
+    median = MovingMedian(3)
+    for x in [5, 1, 9, 7, 3]:
+        y = median.update(x)
+    assert y == 7 and median.sorted == [3, 7, 9]
+
+def test_biquad_step_response():
+    biquad = lowpass_biquad(0.05)
+    assert abs(biquad.dc_gain - 1) < 1e-9
+    out = [biquad.update(0.0) for i in range(10)] + [biquad.update(1000.0) for i in range(200)]
+    assert out[:10] == [0.0]*10 #starts from the first sample, no start up transient
+    step = out[10:]
+    assert step == sorted(step[:step.index(max(step)) + 1]) + step[step.index(max(step)) + 1:] #rises without wiggling
+    assert max(step) < 1000*1.05 #Butterworth overshoots about 4%
+    assert abs(step[-1] - 1000) < 0.5 #settles to the input
+    rise = next(i for i, y in enumerate(step) if y >= 900)
+    assert 4 <= rise <= 12 #about a third of a cycle of the cutoff (1/0.05 = 20 samples)
+
+def test_biquad_cuts_high_frequency():
+    biquad = lowpass_biquad(0.05)
+    out = [biquad.update(500 + (100 if i % 2 else -100)) for i in range(200)]
+    assert max(abs(y - 500) for y in out[50:]) < 1 #at the Nyquist frequency the low pass blocks it almost completely
+
+def test_one_pole_alpha_matches_cutoff():
+    alpha = one_pole_alpha(10, 860)
+    pole = OnePole(alpha)
+    pole.update(0)
+    y = [pole.update(1) for i in range(round(860/(2*math.pi*10)))] #one time constant
+    assert abs(y[-1] - (1 - math.exp(-1))) < 0.02
+
+def test_hysteresis_switches_only_past_the_other_threshold():
+    switch = Hysteresis(100, 200)
+    out = [switch.update(x) for x in [50, 150, 199, 201, 150, 101, 99, 150, 250]]
+    assert out == [100, 100, 100, 200, 200, 200, 100, 100, 200]
+
+def test_hysteresis_thresholds_must_be_ordered():
+    try:
+        Hysteresis(200, 100)
+    except ValueError:
+        return
+    assert False
+
+def test_decimate_averages_every_factor_samples():
+    decimate = Decimate(4)
+    assert [decimate.update(x) for x in [1, 2, 3, 6, 10, 10, 10, 10]] == [None, None, None, 3.0, None, None, None, 10.0]
+
+def test_channel_filters_chain_and_unfiltered_channels():
+    filters = ChannelFilters({0: [('median', 3)], 3: [('hysteresis', 1.0, 2.0)]})
+    assert filters.update(1, 1234) == 1234
+    assert [filters.update(0, x) for x in [10, 10, 5000, 10]] == [10, 10, 10, 10]
+    assert filters.update(3, volts_to_code(1.5)) == volts_to_code(1.0)
+    assert filters.update(3, volts_to_code(2.5)) == volts_to_code(2.0)
+
+def test_unknown_stage():
+    try:
+        make_stage(('kalman', 1))
+    except ValueError:
+        return
+    assert False
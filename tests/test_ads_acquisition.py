@@ -0,0 +1,54 @@
+#Acquisition engine against the fake ADS1115
+import time
+import pytest
+import ads_acquisition
+import calibration
+
+
+class DeadBus: #nothing answers on the I2C bus
+    def write_register(self, register, value):
+        raise OSError("no ack")
+    def read_register(self, register):
+        raise OSError("no ack")
+
+class BusyI2C: #busio.I2C that another thread holds for the first 'busy' tries
+    def __init__(self, busy):
+        self.busy = busy
+        self.locked = False
+    def try_lock(self):
+        if self.busy:
+            self.busy -= 1
+            return False
+        self.locked = True
+        return True
+    def unlock(self):
+        self.locked = False
+    def writeto(self, address, buf):
+        assert self.locked
+
+
+def test_samples_every_channel():
+    bus = ads_acquisition.FakeADS1115Bus({0: lambda t: 1.0, 1: lambda t: 2.5})
+    engine = ads_acquisition.AcquisitionEngine(bus, schedule = (0, 1)).start()
+    before = time.perf_counter()
+    time.sleep(0.02)
+    samples = engine.snapshot()
+    engine.stop()
+    assert abs(samples[0].voltage - 1.0) < 0.001 and abs(samples[1].voltage - 2.5) < 0.001
+    assert samples[0].voltage == calibration.volts_from_code(samples[0].code)
+    assert samples[2] is None and samples[3] is None
+    assert max(s.timestamp for s in samples[:2]) > before - 0.005
+
+def test_start_raises_without_samples():
+    engine = ads_acquisition.AcquisitionEngine(DeadBus(), schedule = (0, 1))
+    with pytest.raises(RuntimeError, match = "channel"):
+        engine.start(timeout = 0.05)
+    assert not engine._running
+
+def test_busy_bus_lock_backs_off(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ads_acquisition.time, 'sleep', sleeps.append)
+    i2c = BusyI2C(8)
+    ads_acquisition.BusioBackend(i2c).write_register(ads_acquisition.REG_CONFIG, 0x8583)
+    assert not i2c.locked and len(sleeps) == 8
+    assert sleeps[0] == 0.0 and sleeps == sorted(sleeps) and sleeps[-1] == ads_acquisition.BUS_LOCK_BACKOFF_MAX
@@ -0,0 +1,49 @@
+#Edge speed sensor: period/count crossover, slowing down and the zero speed timeout
+import calibration
+from axle_speed import EdgeSpeedSensor, SimEdgeSource
+
+
+def make_sensor(**kwargs):
+    clock = [0.0]
+    sensor = EdgeSpeedSensor(clock = lambda: clock[0], **kwargs)
+    source = SimEdgeSource(sensor.on_edge, sensor.n_teeth)
+    return sensor, source, clock
+
+def run(sensor, source, clock, rpm, seconds, dt = 0.005): #steady rpm, returns the last rate read
+    for i in range(int(round(seconds/dt))):
+        clock[0] += dt
+        source.run(clock[0], rpm)
+        rate = sensor.edge_rate()
+    return rate
+
+def test_period_below_crossover_count_above():
+    sensor, source, clock = make_sensor(count_window = 0.05, count_min_edges = 8)
+    #8 edges in 0.05 s is 160 edges/s
+    low = 150/sensor.n_teeth*60
+    assert abs(run(sensor, source, clock, low, 1.0) - 150) < 1.0 and sensor.method == 'period'
+    high = 170/sensor.n_teeth*60
+    assert abs(run(sensor, source, clock, high, 1.0) - 170) < 1.0 and sensor.method == 'count'
+    assert abs(run(sensor, source, clock, 2000/sensor.n_teeth*60, 1.0) - 2000) < 1.0 and sensor.method == 'count'
+    run(sensor, source, clock, low, 1.0)
+    assert sensor.method == 'period'
+
+def test_zero_timeout_and_slowing():
+    sensor, source, clock = make_sensor(zero_timeout = 0.5)
+    assert sensor.edge_rate() == 0.0 and sensor.method == 'zero'
+    run(sensor, source, clock, 1000, 0.5)
+    last_edge = sensor.times[(sensor.head - 1) % sensor.size]
+    clock[0] = last_edge + 0.1 #no edge for 0.1 s: at most one tooth per 0.1 s
+    assert abs(sensor.edge_rate() - 10.0) < 1e-9
+    clock[0] = last_edge + 0.49
+    assert 0 < sensor.edge_rate() < 2.1
+    clock[0] = last_edge + 0.51
+    assert sensor.edge_rate() == 0.0 and sensor.method == 'zero' and sensor.veh_spd() == 0
+
+def test_speed_matches_the_adc_conversion():
+    cal = calibration.DEFAULT_CALIBRATION
+    volt_per_rpm = cal['axle_speed_sensor_v_in']/cal['axle_input_rpm_at_v_in']
+    for rpm in (0, 250, 1234.5, 5500):
+        assert calibration.axle_rpm_to_veh_spd(rpm) == calibration.axle_v_to_veh_spd(rpm*volt_per_rpm)
+    sensor, source, clock = make_sensor()
+    run(sensor, source, clock, 3000, 1.0)
+    assert abs(sensor.veh_spd() - calibration.axle_rpm_to_veh_spd(3000)) <= 0.1
@@ -0,0 +1,29 @@
+#Lookup tables against the conversion functions they are built from
+import numpy as np
+import calibration
+
+
+def test_tables_match_conversions():
+    tables = calibration.CalibrationTables()
+    for code in range(-32768, 32768, 97):
+        v = float(tables.voltage[code])
+        assert tables.veh_spd(code) == calibration.axle_v_to_veh_spd(v)
+        assert tables.des_spd(code) == calibration.pps_v_to_des_spd(v, tables.cruise_spd)
+        assert tables.tps_deg(code) == calibration.tps_v_to_deg(v)
+        assert tables.psw_state(code) == calibration.psw_v_to_state(v)
+
+def test_limits_and_no_negative_zero():
+    tables = calibration.CalibrationTables()
+    assert tables.tps.min() == 0 and tables.tps.max() == tables.cal['deg_throttle_max']
+    assert not np.signbit(tables.tps).any()
+    assert tables.axle.min() == 0 and tables.pps.min() == 0
+    assert calibration.tps_v_to_deg(-1.0) == 0 and calibration.psw_v_to_state(5.0) == 1
+
+def test_rebuild_only_on_change():
+    tables = calibration.CalibrationTables()
+    tables.set_cruise_spd(12)
+    tables.set_calibration(tire_dia = 18)
+    assert tables.builds == 1
+    tables.set_calibration(tire_dia = 20)
+    assert tables.builds == 2
+    assert tables.veh_spd(20000) == calibration.axle_v_to_veh_spd(float(tables.voltage[20000]), tables.cal)
@@ -0,0 +1,69 @@
+#Coalesced GPIO writes: suppressed repeats, deferred MODE/DIR pins going out with STEP, banked set/clear masks
+from gpio_shadow import ShadowGPIO, FakeGPIO, FakeBank
+
+MODE = (14, 15, 18)
+DIR = 20
+STEP = 21
+
+
+class RecordingBank(FakeBank): #FakeBank that also keeps the masks of every write
+    def __init__(self, gpio):
+        FakeBank.__init__(self, gpio)
+        self.masks = []
+
+    def write(self, set_mask, clear_mask):
+        self.masks.append((set_mask, clear_mask))
+        FakeBank.write(self, set_mask, clear_mask)
+
+
+def make_shadow(banked = True):
+    fake = FakeGPIO()
+    bank = RecordingBank(fake) if banked else None
+    return ShadowGPIO(fake, deferred = MODE + (DIR,), passthrough = (STEP,), bank = bank), fake, bank
+
+
+def test_deferred_pins_go_out_in_one_banked_write():
+    gpio, fake, bank = make_shadow()
+    gpio.output(MODE, (1, 0, 1))
+    gpio.output(DIR, 1)
+    assert fake.calls == 0 and bank.masks == [] #held until the next write to another pin
+    gpio.output(STEP, 1)
+    assert bank.masks == [(1 << 14 | 1 << 18 | 1 << 20, 1 << 15)]
+    assert fake.pins[STEP] == 1 and fake.pins[DIR] == 1 and [fake.pins[p] for p in MODE] == [1, 0, 1]
+    assert fake.calls == 1 and gpio.banked == 1 #the STEP write, the rest was one register write
+
+def test_only_changed_pins_are_in_the_masks():
+    gpio, fake, bank = make_shadow()
+    gpio.output(MODE, (1, 0, 1))
+    gpio.output(DIR, 1)
+    gpio.flush()
+    gpio.output(MODE, (0, 1, 1)) #M2 already high
+    gpio.output(DIR, 1) #no change
+    gpio.output(STEP, 1)
+    assert bank.masks[-1] == (1 << 15, 1 << 14)
+    assert gpio.suppressed == 2
+
+def test_change_and_change_back_writes_nothing():
+    gpio, fake, bank = make_shadow()
+    gpio.output(DIR, 0)
+    gpio.flush()
+    writes = fake.writes
+    gpio.output(DIR, 1)
+    gpio.output(DIR, 0)
+    gpio.output(STEP, 1)
+    assert fake.writes == writes + 1 and len(bank.masks) == 0 #only STEP
+
+def test_without_a_bank_one_list_call():
+    gpio, fake, bank = make_shadow(banked = False)
+    gpio.output(MODE, (1, 1, 0))
+    gpio.output(STEP, 1)
+    assert fake.calls == 2 and fake.bank.writes == 0 #MODE pins as one output(list, list), then STEP
+    assert [fake.pins[p] for p in MODE] == [1, 1, 0]
+
+def test_pins_above_31_are_not_banked():
+    fake = FakeGPIO()
+    bank = RecordingBank(fake)
+    gpio = ShadowGPIO(fake, deferred = (14, 40), passthrough = (STEP,), bank = bank)
+    gpio.output((14, 40), (1, 1))
+    gpio.output(STEP, 1)
+    assert bank.masks == [] and fake.pins[40] == 1 and fake.pins[14] == 1
@@ -0,0 +1,14 @@
+#Loop benchmark takes the simulator time off each loop
+import loop_bench
+
+
+def test_periods_exclude_simulator():
+    results = loop_bench.run_loop_benchmark(cycles = 300, warmup = 50)
+    loop = results['loop']
+    assert results['cycles'] == 299
+    assert loop['period_us']['count'] == loop['period_with_simulator_us']['count'] == 299
+    assert loop['period_us']['mean'] < loop['period_with_simulator_us']['mean']
+    assert abs(loop['period_us']['mean'] - loop['period_with_simulator_us']['mean']*(1 - loop['simulator_fraction'])) < 1.0
+    assert loop['period_us']['min'] > 0
+    assert loop_bench.check_thresholds(results, {'loop.period_us.p99': 1e9}) == []
+    assert loop_bench.check_thresholds(results, {'loop.period_us.p99': 0})[0][0] == 'loop.period_us.p99'
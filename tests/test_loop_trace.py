@@ -0,0 +1,25 @@
+#Trace ring and the printing only event mask
+import loop_trace
+import plant_sim
+import ThrottleByWire as tbw
+
+
+def test_kind_mask():
+    tracer = loop_trace.Tracer(16, kinds = loop_trace.PRINT_KINDS)
+    tracer.event(loop_trace.CYCLE, 1)
+    tracer.end(loop_trace.SENSOR_READ, tracer.begin())
+    tracer.event(loop_trace.STEP_DECISION, 3)
+    tracer.event(loop_trace.WARNING, "check")
+    tracer.event(loop_trace.STATUS, (1.0,))
+    assert [kind for t, kind, d, v in tracer.drain()] == [loop_trace.WARNING, loop_trace.STATUS]
+    full = loop_trace.Tracer(16)
+    full.event(loop_trace.CYCLE, 1)
+    full.end(loop_trace.SENSOR_READ, full.begin())
+    assert len(full.drain()) == 2
+
+def test_print_only_loop_records_status_events_only(capsys):
+    plant_sim.simulate(2.0, settings = {'print_enabled': True, 'trace_enabled': False, 'print_itr_reset_count': 50})
+    assert tbw.tracer.recorded[loop_trace.STATUS] and tbw.tracer.recorded[loop_trace.WARNING]
+    assert not any(tbw.tracer.recorded[kind] for kind in (loop_trace.CYCLE, loop_trace.SENSOR_READ, loop_trace.STEP_DECISION, loop_trace.SLEEP))
+    assert tbw.tracer.head < 200 #a status line every 50 loops, not ~5 events every loop
+    assert "tps_deg:" in capsys.readouterr().out
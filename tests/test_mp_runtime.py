@@ -0,0 +1,65 @@
+#Shared memory rings and the actuation watchdog (no processes started)
+import numpy as np
+from mp_runtime import ShmRing, ShmMotionProxy, Watchdog, COMMAND_DTYPE, STATUS_DTYPE
+from conftest import make_engine
+
+
+def test_ring_roundtrip_and_lost_records():
+    ring = ShmRing(COMMAND_DTYPE, 4)
+    try:
+        reader = ShmRing(*ring.spec())
+        assert reader.latest() is None
+        for i in range(6):
+            ring.write((float(i), 10*i, 0))
+        assert int(reader.latest()['target']) == 50
+        records, lost, head = reader.read_since(0)
+        assert list(records['target']) == [20, 30, 40, 50] and lost == 2 and head == 6
+        records, lost, head = reader.read_since(head)
+        assert len(records) == 0 and lost == 0 and head == 6
+        reader.close()
+    finally:
+        ring.close()
+
+def test_ring_held_lock_does_not_block():
+    ring = ShmRing(COMMAND_DTYPE, 4)
+    try:
+        ring.write((0.0, 1, 0))
+        ring.lock.acquire() #another process stopped while holding it
+        assert ring.latest() is None
+        assert len(ring.read_since(0)[0]) == 0
+        ring.write((1.0, 2, 0))
+        assert ring.contended == 1
+        ring.lock.release()
+        assert int(ring.latest()['target']) == 2
+    finally:
+        ring.close()
+
+def test_watchdog_trips_and_wakes_without_latch():
+    engine, gpio, clock = make_engine()
+    watchdog = Watchdog(gpio, 4, engine, timeout = 0.1, latch = False)
+    assert not watchdog.ready(0.0)
+    watchdog.beat(0.0)
+    assert watchdog.ready(0.01)
+    assert not watchdog.ready(0.2) and watchdog.asleep and watchdog.trips == 1
+    engine.set_position(-320) #return spring closed the throttle while asleep
+    assert engine.position == -320 and engine.target == -320 and not engine.is_moving()
+    watchdog.beat(0.3)
+    assert not watchdog.asleep and watchdog.ready(0.31)
+    engine.stop()
+
+def test_proxy_halt_publishes_the_stop_target():
+    command = ShmRing(COMMAND_DTYPE, 8)
+    status = ShmRing(STATUS_DTYPE, 8)
+    try:
+        proxy = ShmMotionProxy(command, status, acceleration = 8000)
+        proxy.set_target(100*64)
+        status.write((0.0, 20*64, 100*64, 0, 800.0, 0, 0, 1)) #at 20 full steps, opening at 800 full steps/s, Full mode
+        proxy.halt()
+        assert proxy.target == 60*64 and int(command.latest()['target']) == 60*64 #800^2/(2*8000) = 40 full steps to stop
+        proxy.set_target(100*64)
+        proxy.set_limits(None, 30*64)
+        proxy.halt()
+        assert int(command.latest()['target']) == 30*64 #inside the travel limits
+    finally:
+        command.close()
+        status.close()
@@ -0,0 +1,54 @@
+#Simulated golf car: the throttle follows the STEP pulses, the speed follows the throttle, the sensors read it back through the calibration
+import calibration
+import hal
+import plant_sim
+from plant_sim import GolfCarPlant
+from sensor_frame import RESOLUTION, STEP_DIVISOR
+
+
+def pulse(gpio, direction, mode, n): #n STEP pulses on the simulator's pins, direction 1 opens
+    gpio.output(gpio.dir_pin, gpio.cw if direction > 0 else 1 - gpio.cw)
+    gpio.output(gpio.mode_pins, RESOLUTION[mode])
+    for i in range(n):
+        gpio.output(gpio.step_pin, 1)
+        gpio.output(gpio.step_pin, 0)
+
+def read(backend, ch):
+    return calibration.volts_from_code(backend.adc_channels[ch].value, backend.adc_gain)
+
+def test_tps_follows_commanded_steps():
+    plant = GolfCarPlant(pedal = plant_sim.step_pedal(0.5, 0.0), step_deg = 1.8)
+    backend = hal.SimBackend(plant, record_every = None)
+    expected = 0.0
+    for direction, mode, n in ((1, 'Full', 5), (1, '1/8', 12), (-1, 'Half', 3), (1, '1/64', 40)):
+        pulse(backend.gpio, direction, mode, n)
+        expected += direction*n*1.8/STEP_DIVISOR[mode]
+        backend.advance(0.2) #throttle plate settles behind the cable
+        assert abs(calibration.tps_v_to_deg(read(backend, 2), plant.cal) - expected) < 0.05
+    assert plant.pulses == 60 and plant.stepper_ticks == round(expected/1.8*64)
+    pulse(backend.gpio, -1, 'Full', 20) #past the stop, the cable goes slack and the throttle stays closed
+    backend.advance(0.2)
+    assert abs(calibration.tps_v_to_deg(read(backend, 2), plant.cal)) < 0.05
+
+def test_speed_rises_toward_the_throttle_speed():
+    plant = GolfCarPlant(pedal = plant_sim.step_pedal(0.5, 0.0), step_deg = 1.8)
+    backend = hal.SimBackend(plant, record_every = None)
+    pulse(backend.gpio, 1, 'Full', 6)
+    target = plant.speed_for_throttle(6*1.8)
+    speeds = []
+    for i in range(20):
+        backend.advance(1.0)
+        speeds.append(calibration.axle_v_to_veh_spd(read(backend, 1), plant.cal))
+    assert all(later >= earlier for earlier, later in zip(speeds, speeds[1:])) and speeds[5] > speeds[4] #rising, until the reading settles on the target
+    assert speeds[2] < 0.9*target and abs(speeds[-1] - target) < 0.05
+    assert calibration.psw_v_to_state(read(backend, 3), plant.cal) == 1
+
+def test_loop_holds_the_calibrated_desired_speed():
+    plant = GolfCarPlant(pedal = plant_sim.step_pedal(0.5))
+    backend, trace = plant_sim.simulate(25.0, plant)
+    des_spd = plant_sim.desired_speed(trace, plant)[-1]
+    pps_v_min, pps_v_max = calibration.pps_v_limits(plant.cal)
+    assert des_spd == calibration.pps_v_to_des_spd(pps_v_min + 0.5*(pps_v_max - pps_v_min), 12, plant.cal)
+    assert plant_sim.desired_speed(trace[:1], plant) == [0.0] and plant_sim.desired_speed(trace[-1:], plant, 14)[0] > des_spd #pedal up, and a higher cruise_spd
+    speeds = [speed for t, pedal, speed, deg in trace if t > 15.0]
+    assert trace[20][2] < des_spd - 2 and abs(sum(speeds)/len(speeds) - des_spd) < 0.5
@@ -0,0 +1,130 @@
+#Position observer: prediction from steps, fewer TPS reads, stall and lost step checks
+import plant_sim
+from mp_runtime import ShmRing, ShmMotionProxy, COMMAND_DTYPE, STATUS_DTYPE
+import ThrottleByWire as tbw
+from position_observer import PositionObserver, observer_for
+from sensor_frame import TICKS_PER_STEP
+
+DEG_PER_TICK = 1.8/TICKS_PER_STEP
+
+
+def make_observer(**settings):
+    return PositionObserver(DEG_PER_TICK, 0.0, 90.0, lag = 0.0, **settings)
+
+def step(observer, t, ticks, measured): #move, then read the TPS if a reading is due
+    observer.move(ticks, t)
+    if observer.due(t):
+        observer.correct(t, measured)
+
+
+def test_prediction_follows_steps_and_reads_less_often():
+    observer = make_observer()
+    observer.correct(0.0, 10.0)
+    observer.move(10*TICKS_PER_STEP, 0.0)
+    assert abs(observer.predict(0.0) - 28.0) < 1e-9
+    t = 0.0
+    for i in range(500): #throttle where the steps say it is, still
+        t += 0.002
+        if observer.due(t):
+            observer.correct(t, 28.0)
+    assert observer.reads < 50 and observer.stalls == 0 and observer.lost_ticks == 0
+
+def test_prediction_stops_at_the_throttle_stops():
+    observer = make_observer()
+    observer.correct(0.0, 1.0)
+    observer.move(-10*TICKS_PER_STEP, 0.0) #cable goes slack past closed
+    assert observer.predict(0.01) == 0.0
+    observer.move(10*TICKS_PER_STEP, 0.02) #taking the slack up again comes back to where it was
+    assert abs(observer.predict(0.02) - 1.0) < 1e-9
+
+def test_stall_opening():
+    observer = make_observer()
+    observer.correct(0.0, 20.0)
+    t = 0.0
+    for i in range(20): #steps opening, throttle stays at 20 degrees
+        t += 0.002
+        step(observer, t, TICKS_PER_STEP, 20.0)
+        if observer.stalled:
+            break
+    assert observer.stalled == 1 and observer.stalls == 1 and observer.lost_ticks == 0
+
+def stall(observer, t, measured = 20.0): #step opening until the observer flags the stall, returns the time
+    while not observer.stalled:
+        t += 0.002
+        step(observer, t, TICKS_PER_STEP, measured)
+    return t
+
+def test_stall_clears_when_stepping_back():
+    observer = make_observer()
+    observer.correct(0.0, 20.0)
+    t = stall(observer, 0.0)
+    observer.move(-TICKS_PER_STEP, t) #stepping closed
+    assert observer.stalled == 0
+
+def test_stall_is_retried_after_retry_after():
+    observer = make_observer(retry_after = 0.5)
+    observer.correct(0.0, 20.0)
+    stalled_at = t = stall(observer, 0.0)
+    while observer.stalled: #no steps, throttle holds still, readings agree
+        t += 0.01
+        if observer.due(t):
+            observer.correct(t, 20.0)
+    assert 0.5 <= t - stalled_at < 0.7 and observer.stalls == 1
+
+def test_lost_steps():
+    observer = make_observer()
+    observer.correct(0.0, 20.0)
+    observer.move(10*TICKS_PER_STEP, 0.0) #10 full steps commanded, the motor only made 6 (lost 4 against the spring)
+    t = 0.0
+    for i in range(3):
+        t += 0.01
+        observer.correct(t, 20.0 + 6*1.8)
+    assert observer.stalls == 0 and observer.stalled == 0
+    assert abs(observer.lost_ticks - 4*TICKS_PER_STEP) <= 1
+    assert abs(observer.predict(t) - (20.0 + 6*1.8)) < 1e-9 #starts again from the reading
+
+def test_noise_is_not_lost_steps():
+    observer = make_observer(tolerance_deg = 1.0)
+    observer.correct(0.0, 20.0)
+    t = 0.0
+    for i in range(200):
+        t += 0.002
+        if observer.due(t):
+            observer.correct(t, 20.0 + (0.8 if i % 2 else -0.8))
+    assert observer.stalls == 0 and observer.lost_ticks == 0
+
+def test_observer_for():
+    observer = observer_for(1.8, 2.0)
+    assert abs(observer.deg_per_tick - 1.8/TICKS_PER_STEP*2.0) < 1e-12
+
+def test_stall_in_the_loop_stops_stepping():
+    plant = plant_sim.GolfCarPlant(pedal = plant_sim.step_pedal(1.0, 1.0), stall_deg = 20.0)
+    backend, trace = plant_sim.simulate(10.0, plant, {'position_observer_enabled': True})
+    stalled_plant = plant.lost_pulses
+    assert tbw.observer.stalls >= 1
+    plant = plant_sim.GolfCarPlant(pedal = plant_sim.step_pedal(1.0, 1.0), stall_deg = 20.0)
+    plant_sim.simulate(10.0, plant, {'position_observer_enabled': False})
+    assert stalled_plant < plant.lost_pulses/2 #far fewer steps made into the stall
+
+def test_stall_through_the_multiprocess_proxy(monkeypatch): #control loop side of mp_runtime.py: the stall halts the move through the command ring
+    command = ShmRing(COMMAND_DTYPE, 8)
+    status = ShmRing(STATUS_DTYPE, 8)
+    try:
+        proxy = ShmMotionProxy(command, status, acceleration = 8000)
+        observer = make_observer()
+        observer.correct(0.0, 20.0)
+        stall(observer, 0.0)
+        monkeypatch.setattr(tbw, 'observer', observer)
+        monkeypatch.setattr(tbw, 'motion', proxy)
+        monkeypatch.setattr(tbw, 'step_stop', 0)
+        proxy.set_target(100*TICKS_PER_STEP) #batch still queued
+        proxy.set_limits(None, 50*TICKS_PER_STEP)
+        status.write((0.0, 20*TICKS_PER_STEP, 50*TICKS_PER_STEP, 0, 800.0, 0, 0, 1)) #actuation process: opening at full speed
+        tbw.check_stall()
+        assert tbw.step_stop == 1
+        assert int(command.latest()['target']) == 50*TICKS_PER_STEP #stop 40 full steps on, clamped to the travel limit
+        tbw.check_stall() #already stopped, nothing more is sent
+        assert command.head() == 3
+    finally:
+        command.close()
+        status.close()
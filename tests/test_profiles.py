@@ -0,0 +1,49 @@
+#Cart profiles: only the documented settings, with the right types, and Step_deg reaching the planner and simulator
+import pytest
+import profiles
+import plant_sim
+import ThrottleByWire as tbw
+
+
+@pytest.fixture
+def restore_settings():
+    saved = {name: getattr(tbw, name) for name in tbw.PROFILE_SETTINGS + ('profile',)}
+    cal = dict(tbw.cal)
+    yield
+    for name, value in saved.items():
+        setattr(tbw, name, value)
+    tbw.cal.clear()
+    tbw.cal.update(cal)
+
+
+def test_profile_settings_exist():
+    for name in tbw.PROFILE_SETTINGS:
+        assert hasattr(tbw, name) and not callable(getattr(tbw, name))
+
+def test_apply_profile(tmp_path, restore_settings):
+    profiles.save_profile('cart', {'tire_dia': 20}, {'cruise_spd': 10, 'Step_deg': 0.9, 'loop_period': 0.002, 'ads_schedule': [2, 0, 1, 2, 3]}, directory = str(tmp_path))
+    tbw.apply_profile('cart', str(tmp_path))
+    assert tbw.cruise_spd == 10 and tbw.Step_deg == 0.9 and tbw.loop_period == 0.002 and tbw.ads_schedule == (2, 0, 1, 2, 3)
+    assert tbw.cal['tire_dia'] == 20 and tbw.profile == 'cart'
+
+@pytest.mark.parametrize('settings', [{'cal': {}}, {'tables': None}, {'motion': None}, {'STEP': 5}, {'setup': 1}, {'no_such_setting': 1}])
+def test_settings_not_on_the_list_are_refused(tmp_path, restore_settings, settings):
+    profiles.save_profile('cart', settings = settings, directory = str(tmp_path))
+    with pytest.raises(KeyError):
+        tbw.apply_profile('cart', str(tmp_path))
+
+@pytest.mark.parametrize('settings', [{'cruise_spd': '10'}, {'use_step_batches': 1}, {'print_itr_reset_count': 2.5}, {'cruise_spd': True},
+                                      {'ads_schedule': [0, 'TPS']}, {'control_mode': None}, {'loop_period': 'fast'}])
+def test_wrong_types_are_refused(tmp_path, restore_settings, settings):
+    before = tbw.cruise_spd
+    profiles.save_profile('cart', settings = settings, directory = str(tmp_path))
+    with pytest.raises(TypeError):
+        tbw.apply_profile('cart', str(tmp_path))
+    assert tbw.cruise_spd == before and tbw.profile is None #nothing applied
+
+def test_step_deg_reaches_planner_and_plant(tmp_path, restore_settings):
+    profiles.save_profile('cart', settings = {'Step_deg': 0.9}, directory = str(tmp_path))
+    tbw.apply_profile('cart', str(tmp_path))
+    assert plant_sim.GolfCarPlant().step_deg == 0.9
+    backend, trace = plant_sim.simulate(0.2)
+    assert tbw.planner.step_deg == 0.9
@@ -0,0 +1,75 @@
+#Replay makes the same decisions the loop made
+import pytest
+import hal
+import plant_sim
+import replay
+import ThrottleByWire as tbw
+from ads_acquisition import Sample
+from stepper_motion import MotionEngine
+
+
+def record(tmp_path, plant, duration = 15.0, settings = None):
+    run_settings = {'record_telemetry': True, 'telemetry_dir': str(tmp_path)}
+    run_settings.update(settings or {})
+    plant_sim.simulate(duration, plant, run_settings, record_every = None)
+    return replay.load_trace(str(tmp_path))
+
+def test_replay_matches_loop_with_stall(tmp_path):
+    trace = record(tmp_path, plant_sim.GolfCarPlant(pedal = plant_sim.step_pedal(1.0, 1.0), stall_deg = 20.0))
+    assert trace['step_stop'].any() and trace['move_queued'].any()
+    result = replay.evaluate(trace)
+    assert replay.default_score(trace, result)['agreement'] == 1.0
+
+def test_replay_matches_loop_steps_in_loop(tmp_path):
+    trace = record(tmp_path, plant_sim.GolfCarPlant(), settings = {'use_motion_engine': False})
+    assert replay.default_score(trace, replay.evaluate(trace))['agreement'] == 1.0
+
+def test_angle_mode_refused(tmp_path):
+    trace = {'t': [0.0]}
+    with pytest.raises(ValueError, match = "control_mode"):
+        replay.evaluate(trace, {'control_mode': 'angle'})
+
+
+class SimSnapshots: #acts like the AcquisitionEngine on the simulated car, every snapshot has a fresh sample of each channel
+    def __init__(self, backend, schedule):
+        self.backend = backend
+        self.schedule = schedule
+        self.seq = 0
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def snapshot(self):
+        self.seq += 1
+        channels = self.backend.adc_channels
+        return tuple(Sample(ch, channels[ch].value, 0.0, self.backend.now(), self.seq) if ch in self.schedule else None for ch in range(4))
+
+
+class SimEngine(MotionEngine): #pulses are made by SimBackend.advance(), not a thread
+    def start(self):
+        return self
+
+
+class SnapshotSimBackend(hal.SimBackend): #simulated car read through acquisition engine snapshots (frame_from_snapshot), like the Pi
+    realtime = True
+
+    def acquisition(self, schedule, data_rate, ready_pin = None, filters = None):
+        return SimSnapshots(self, schedule)
+
+    def motion_engine(self, gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw):
+        self.motion = SimEngine(gpio, step_pin, dir_pin, mode_pins, max_velocity, acceleration, cw, ccw, self.clock)
+        return self.motion
+
+
+def test_replay_matches_loop_through_acquisition_snapshots(tmp_path, monkeypatch):
+    for name, value in {'print_enabled': False, 'record_telemetry': True, 'telemetry_dir': str(tmp_path), 'use_acquisition_engine': True}.items():
+        monkeypatch.setattr(tbw, name, value)
+    backend = SnapshotSimBackend(plant_sim.GolfCarPlant(pedal = plant_sim.step_pedal(1.0, 1.0), stall_deg = 20.0), record_every = None)
+    tbw.run(backend, duration = 10.0)
+    trace = replay.load_trace(str(tmp_path))
+    predicted = trace['tps_predicted'] != 0
+    assert predicted.any() and (trace['tps_code'][predicted] != 0).all() #the snapshot's tps sample is recorded even where the prediction was used
+    assert replay.default_score(trace, replay.evaluate(trace))['agreement'] == 1.0
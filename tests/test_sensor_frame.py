@@ -0,0 +1,85 @@
+#A frame can not be changed, works each value out once, and is captured with one read per scheduled channel
+import pytest
+import plant_sim
+import replay
+from calibration import CalibrationTables
+from sensor_frame import SensorFrame, capture_frame
+
+
+class CountingTables: #CalibrationTables that counts the conversions
+    def __init__(self):
+        self.tables = CalibrationTables()
+        self.calls = {}
+
+    def _count(self, name, code):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return getattr(self.tables, name)(code)
+
+    def veh_spd(self, code):
+        return self._count('veh_spd', code)
+
+    def des_spd(self, code):
+        return self._count('des_spd', code)
+
+    def tps_deg(self, code):
+        return self._count('tps_deg', code)
+
+    def psw_state(self, code):
+        return self._count('psw_state', code)
+
+class CountingPlant(plant_sim.GolfCarPlant): #counts the ADS1115 reads of each channel
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.reads = [0, 0, 0, 0]
+
+    def code(self, ch):
+        self.reads[ch] += 1
+        return super().code(ch)
+
+def counting_reader(codes):
+    reads = []
+    def read_code(ch):
+        reads.append(ch)
+        return codes[ch]
+    return read_code, reads
+
+CODES = {0: 12000, 1: 9000, 2: 7000, 3: 20000}
+
+def test_frame_can_not_be_changed():
+    frame = capture_frame(CODES.get, 1.0, CalibrationTables(), 0.5)
+    for name in ('pps_code', 'tps_predicted', 'tps_deg', '_tps_deg'):
+        with pytest.raises(AttributeError):
+            setattr(frame, name, 0)
+    with pytest.raises(AttributeError):
+        frame.extra = 1
+    with pytest.raises(AttributeError):
+        del frame.pps_code
+    assert frame.pps_code == 12000
+
+def test_values_worked_out_once():
+    tables = CountingTables()
+    frame = SensorFrame(1.0, 12000, 9000, 7000, 20000, tables, 0.5)
+    assert tables.calls == {} #nothing until it is asked for
+    for i in range(3):
+        frame.spd_error, frame.step_mode, frame.step_delay, frame.step_mode_pedal_up, frame.psw
+    assert tables.calls == {'veh_spd': 1, 'des_spd': 1, 'tps_deg': 1, 'psw_state': 1}
+    assert frame.spd_error == tables.tables.des_spd(12000) - tables.tables.veh_spd(9000)
+
+def test_capture_reads_each_scheduled_channel_once():
+    read_code, reads = counting_reader(CODES)
+    frame = capture_frame(read_code, 1.0, CalibrationTables(), 0.5)
+    assert sorted(reads) == [0, 1, 2, 3] and not frame.tps_predicted
+    read_code, reads = counting_reader(CODES)
+    frame = capture_frame(read_code, 1.0, CalibrationTables(), 0.5, act_spd = 7.5, tps_deg = 12.0) #speed from tooth edges, predicted opening
+    assert sorted(reads) == [0, 3]
+    assert (frame.axle_code, frame.tps_code, frame.act_spd, frame.tps_deg, frame.tps_predicted) == (0, 0, 7.5, 12.0, True)
+
+def test_loop_reads_each_channel_once_per_loop(tmp_path):
+    plant = CountingPlant(pedal = plant_sim.step_pedal(0.5, 0.1))
+    backend, trace = plant_sim.simulate(0.5, plant, {'position_observer_enabled': False}, record_every = None)
+    assert backend.cycles > 50 and plant.reads == [backend.cycles]*4
+    plant = CountingPlant(pedal = plant_sim.step_pedal(0.5, 0.1))
+    backend, trace = plant_sim.simulate(0.5, plant, {'record_telemetry': True, 'telemetry_dir': str(tmp_path)}, record_every = None)
+    read_tps = int((replay.load_trace(str(tmp_path))['tps_predicted'] == 0).sum())
+    assert 0 < read_tps < backend.cycles #the observer reads the TPS only when it is due
+    assert plant.reads == [backend.cycles, backend.cycles, read_tps, backend.cycles]
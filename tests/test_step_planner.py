@@ -0,0 +1,46 @@
+#Step batch sizing, and batches against one step per loop on the simulated golf car
+import plant_sim
+from plant_sim import GolfCarPlant
+from sensor_frame import STEP_DELAY
+from step_planner import StepBatchPlanner
+
+
+class SettledPlant(GolfCarPlant): #counts pulses and direction reversals once the speed has had 'settle' seconds to settle
+    def __init__(self, settle, **kwargs):
+        super().__init__(**kwargs)
+        self.settle = settle
+        self.settled_pulses = 0
+        self.reversals = 0
+        self.last_direction = 0
+
+    def step(self, direction, ticks):
+        if self.t >= self.settle:
+            self.settled_pulses += 1
+            if self.last_direction and direction != self.last_direction:
+                self.reversals += 1
+            self.last_direction = direction
+        super().step(direction, ticks)
+
+def steady_run(pedal, batches, duration = 30.0, settle = 15.0):
+    plant = SettledPlant(settle, pedal = plant_sim.step_pedal(pedal))
+    plant_sim.simulate(duration, plant, {'use_step_batches': batches})
+    return plant
+
+def test_one_step_near_desired_speed():
+    planner = StepBatchPlanner(STEP_DELAY, 1.8)
+    for spd_error in (0.1, 1.0, planner.batch_error_min):
+        assert planner.plan(1, 10.0, spd_error, '1/64').steps == 1
+        assert planner.plan(-1, 10.0, -spd_error, '1/64').steps == -1
+    assert planner.plan(1, 10.0, planner.batch_error_min + 1, '1/8').steps > 1
+
+def test_batch_stops_at_the_throttle_limits():
+    planner = StepBatchPlanner(STEP_DELAY, 1.8)
+    assert planner.plan(1, planner.tps_deg_stop_max - 1.8, 10, 'Full').steps == 1
+    assert planner.plan(-1, planner.tps_deg_stop_min + 3.6, -10, 'Full').steps == -2
+
+def test_batches_do_not_add_work_at_steady_speed():
+    for pedal in (0.3, 0.8):
+        one = steady_run(pedal, False)
+        batched = steady_run(pedal, True)
+        assert batched.settled_pulses <= one.settled_pulses*1.02 #the pull away leaves the hunting at a slightly different phase (batches sized on small errors made 4x the pulses)
+        assert batched.reversals <= one.reversals
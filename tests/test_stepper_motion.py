@@ -0,0 +1,90 @@
+#Motion engine ramps, reversals and travel limits on the simulated clock
+import math
+from conftest import make_engine
+from sensor_frame import TICKS_PER_STEP
+
+
+def signed_speeds(gpio, cw = 0): #speed each pulse was made at, from the time to the next pulse (full steps per second, Full step mode), positive opens
+    speeds = []
+    for (a, level), (b, _) in zip(gpio.pulses, gpio.pulses[1:]):
+        speeds.append((1 if level == cw else -1)/(b - a))
+    return speeds
+
+def assert_accel_limited(gpio, acceleration): #speed changes no faster than the acceleration (a stop/turn around from the start/stop speed is allowed)
+    start_speed = math.sqrt(2*acceleration)
+    speeds = signed_speeds(gpio)
+    for v0, v1 in zip(speeds, speeds[1:]):
+        if (v0 > 0) != (v1 > 0):
+            assert abs(v0) <= start_speed*1.01 and abs(v1) <= start_speed*1.01 #turned around only from the start/stop speed
+        else:
+            assert abs(v1*v1 - v0*v0) <= 2*acceleration*1.01 #v^2 changes by at most 2*a per full step
+
+
+def test_trapezoid_ramp():
+    engine, gpio, clock = make_engine()
+    engine.set_target(400*TICKS_PER_STEP)
+    assert engine.run_until_idle()
+    speeds = signed_speeds(gpio)
+    assert len(gpio.pulses) == 400 and engine.position == 400*TICKS_PER_STEP and not engine.is_moving()
+    assert abs(max(speeds) - 800) < 0.01
+    assert speeds[:3] == sorted(speeds[:3]) and speeds[-3:] == sorted(speeds[-3:], reverse = True)
+    assert abs(clock.now() - (400/800 + 800/8000)) < 0.03 #cruise time plus one ramp time
+    assert_accel_limited(gpio, 8000)
+
+def test_reversal_slows_down_first():
+    engine, gpio, clock = make_engine()
+    engine.set_target(400*TICKS_PER_STEP)
+    engine.run_until(0.2) #part way, at full speed
+    turn_at = engine.position
+    assert engine.velocity == 800
+    engine.set_target(0)
+    engine.run_until_idle()
+    assert engine.position == 0 and engine.velocity == 0.0
+    assert max(t for t, _ in gpio.pulses) > 0.2
+    assert max(_positions(gpio)) - turn_at >= (800*800/(2*8000) - 1)*TICKS_PER_STEP #went on by about the stopping distance before coming back
+    assert_accel_limited(gpio, 8000)
+
+def test_target_closer_than_stopping_distance_overshoots_and_returns():
+    engine, gpio, clock = make_engine()
+    engine.set_target(400*TICKS_PER_STEP)
+    engine.run_until(0.2)
+    engine.set_target(engine.position + TICKS_PER_STEP) #one step ahead, far less than the 40 steps it needs to stop
+    target = engine.target
+    engine.run_until_idle()
+    assert engine.position == target
+    assert max(_positions(gpio)) > target
+    assert_accel_limited(gpio, 8000)
+
+def test_travel_limits_clamp_targets():
+    engine, gpio, clock = make_engine(min_position = 0, max_position = 100*TICKS_PER_STEP)
+    engine.set_target(1000*TICKS_PER_STEP)
+    assert engine.target == 100*TICKS_PER_STEP
+    engine.move_by(-5000*TICKS_PER_STEP)
+    assert engine.target == 0
+    engine.set_limits(10*TICKS_PER_STEP, 20*TICKS_PER_STEP)
+    assert engine.target == 10*TICKS_PER_STEP
+    assert engine.wait_idle(1.0) and engine.position == 10*TICKS_PER_STEP
+
+
+def _positions(gpio): #position after each pulse, in ticks (Full step mode)
+    position = 0
+    positions = []
+    for _, level in gpio.pulses:
+        position += TICKS_PER_STEP if level == 0 else -TICKS_PER_STEP
+        positions.append(position)
+    return positions
+
+def test_halt_slows_down_inside_the_limits():
+    engine, gpio, clock = make_engine()
+    engine.set_target(400*TICKS_PER_STEP)
+    engine.run_until(clock.now() + 0.1) #at full speed
+    engine.halt()
+    stop_at = engine.target
+    assert stop_at - engine.position == 40*TICKS_PER_STEP #800^2/(2*8000) full steps
+    engine.run_until_idle()
+    assert engine.position == stop_at #no overshoot and coming back
+    engine.set_target(0)
+    engine.run_until(clock.now() + 0.05)
+    engine.set_limits(engine.position - 2*TICKS_PER_STEP, None)
+    engine.halt()
+    assert engine.target == engine.position - 2*TICKS_PER_STEP #clamped to the travel limit
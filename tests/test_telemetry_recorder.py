@@ -0,0 +1,53 @@
+#Telemetry records go to file in order, across file rotation, and the loop drops rather than waits
+import numpy as np
+from calibration import CalibrationTables
+from sensor_frame import STEP_MODES, capture_frame
+from telemetry_recorder import TelemetryRecorder, RECORD_DTYPE, read_telemetry
+
+
+def fake_record(i):
+    return (i, i*0.001, 1000 + i, 2000, 3000, 20000, 10.0, 12.0, 20.0, 1, 2, 0.5, i % 7 - 3, 0, 0, 0)
+
+def test_rotates_files_at_records_per_file(tmp_path):
+    recorder = TelemetryRecorder(str(tmp_path), records_per_file = 10, block_records = 4, blocks = 4) #not started, write_pending() does the writer's work
+    for i in range(1, 26):
+        recorder.record(fake_record(i))
+        if i % 8 == 0:
+            recorder.write_pending()
+    recorder.close()
+    assert len(recorder.files) == 3
+    sizes = [len(np.load(path)) for path in recorder.files]
+    assert sizes == [10, 10, 10] #fixed size files, the last one part used
+    assert [len(read_telemetry(path)) for path in recorder.files] == [10, 10, 5]
+    data = read_telemetry(str(tmp_path))
+    assert list(data['cycle']) == list(range(1, 26)) and recorder.dropped == 0
+
+def test_drops_records_when_writer_is_a_ring_behind(tmp_path):
+    recorder = TelemetryRecorder(str(tmp_path), records_per_file = 100, block_records = 4, blocks = 2)
+    for i in range(1, 13):
+        recorder.record(fake_record(i))
+    assert recorder.head == 8 and recorder.dropped == 4 #ring of 8 full, the newest 4 were dropped
+    assert recorder.write_pending() == 8
+    recorder.record(fake_record(13)) #room again
+    recorder.close()
+    assert list(read_telemetry(str(tmp_path))['cycle']) == list(range(1, 9)) + [13]
+
+def test_frame_round_trip(tmp_path):
+    tables = CalibrationTables()
+    codes = {0: 12000, 1: 9000, 2: 7000, 3: 20000}
+    frame = capture_frame(codes.get, 1.25, tables, 0.5)
+    predicted = capture_frame(codes.get, 1.5, tables, 0.5, tps_deg = 12.5)
+    recorder = TelemetryRecorder(str(tmp_path), records_per_file = 16)
+    recorder.record_frame(1, frame, 0.75, frame.step_mode, -3)
+    recorder.record_frame(2, predicted, -1.5, '1/64', 2, step_stop = 1, move_queued = True)
+    recorder.close()
+    data = read_telemetry(str(tmp_path))
+    assert data.dtype == RECORD_DTYPE and len(data) == 2
+    first, second = data
+    assert (first['cycle'], first['t']) == (1, 1.25)
+    assert (first['pps_code'], first['axle_code'], first['tps_code'], first['psw_code']) == (12000, 9000, 7000, 20000)
+    assert np.float32(frame.act_spd) == first['act_spd'] and np.float32(frame.des_spd) == first['des_spd'] and np.float32(frame.tps_deg) == first['tps_deg']
+    assert first['psw'] == frame.psw and STEP_MODES[first['step_mode']] == frame.step_mode
+    assert (first['accel_rate'], first['steps'], first['step_stop'], first['move_queued'], first['tps_predicted']) == (0.75, -3, 0, 0, 0)
+    assert (second['tps_code'], second['tps_deg'], second['tps_predicted']) == (0, 12.5, 1)
+    assert (STEP_MODES[second['step_mode']], second['steps'], second['step_stop'], second['move_queued']) == ('1/64', 2, 1, 1)
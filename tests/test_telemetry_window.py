@@ -0,0 +1,89 @@
+#Ring buffer windows give the same answers as the python lists the loop used to keep
+import numpy as np
+import plant_sim
+import replay
+from telemetry_window import RingBuffer, SpeedWindow, HistoryWindow
+
+
+def list_rates(t, v, mov_avg_itr_window): #the loop's old accel rate calculation, list appends and slices (None until it first calculates)
+    veh_spd_list = []
+    time_list = []
+    rates = []
+    accel_rate = None
+    for t_i, v_i in zip(t, v):
+        veh_spd_list.append(v_i)
+        time_list.append(t_i)
+        if len(veh_spd_list) >= mov_avg_itr_window:
+            veh_spd_list = veh_spd_list[1:]
+            time_list = time_list[1:]
+            accel_rate = (veh_spd_list[-1]-veh_spd_list[0])/(time_list[-1]-time_list[0])
+        rates.append(accel_rate)
+    return rates
+
+def drive(n, seed = 0): #times and speeds like a loop would see: uneven loop times from a large perf_counter value, noisy rising speed
+    rng = np.random.default_rng(seed)
+    t = 12345.0 + np.cumsum(rng.uniform(0.001, 0.003, n))
+    v = 5.0 + 2.0*(t - t[0]) + rng.normal(0, 0.05, n)
+    return t, v
+
+def test_ring_wraps_and_returns_dropped_value():
+    ring = RingBuffer(3)
+    assert [ring.push(x) for x in (1.0, 2.0, 3.0)] == [None, None, None]
+    assert ring.full() and ring.oldest() == 1.0 and ring.newest() == 3.0
+    assert ring.push(4.0) == 1.0
+    assert ring.push(5.0) == 2.0
+    assert list(ring.values()) == [3.0, 4.0, 5.0] and ring.head == 2
+    assert ring.oldest() == 3.0 and ring.newest() == 5.0 and len(ring) == 3
+    ring.clear()
+    assert len(ring) == 0 and ring.push(6.0) is None and list(ring.values()) == [6.0]
+
+def test_endpoint_rate_matches_list_slicing():
+    window = 25
+    t, v = drive(200)
+    spd_window = SpeedWindow(window - 1)
+    for i, expected in enumerate(list_rates(t, v, window)):
+        spd_window.push(t[i], v[i])
+        if expected is None:
+            assert not spd_window.rolled
+        else:
+            assert spd_window.rolled
+            assert abs(spd_window.endpoint_rate() - expected) < 1e-9
+
+def test_slope_rate_matches_polyfit_after_rebuilds():
+    size = 24
+    t, v = drive(size*10 + 7, seed = 1) #several _rebuild_sums, last one part way through the window
+    spd_window = SpeedWindow(size)
+    rebuilt = 0
+    for i in range(len(t)):
+        spd_window.push(t[i], v[i])
+        rebuilt += spd_window.pushes_since_rebuild == 0
+        if i + 1 >= size:
+            expected = np.polyfit(t[i + 1 - size:i + 1], v[i + 1 - size:i + 1], 1)[0]
+            assert abs(spd_window.slope_rate() - expected) < 1e-6
+            assert abs(spd_window.rate('slope') - expected) < 1e-6
+    assert rebuilt == len(t)//size and spd_window.pushes_since_rebuild > 0
+
+def test_history_all_same():
+    history = HistoryWindow(4, np.int8)
+    assert not history.all_same()
+    for x in (1, 1, 1):
+        history.push(x)
+        assert history.all_same()
+    history.push(-1)
+    assert not history.all_same() and history.step_sum == 2
+    for x in (-1, -1, -1):
+        history.push(x)
+    assert history.full() and history.all_same() and history.first() == -1 and history.step_sum == -4
+    history.push(0)
+    assert not history.all_same()
+
+def test_loop_first_accel_rate_on_the_old_loop_index(tmp_path):
+    plant = plant_sim.GolfCarPlant(pedal = lambda t: 0.0)
+    plant.speed = 8.0 #coasting down, so every window has a speed change
+    plant_sim.simulate(1.0, plant, {'record_telemetry': True, 'telemetry_dir': str(tmp_path), 'mov_avg_itr_window': 25}, record_every = None)
+    trace = replay.load_trace(str(tmp_path))
+    expected = list_rates(trace['t'], trace['act_spd'].astype(float), 25)
+    first = sum(rate is None for rate in expected)
+    assert first == 24 #the 25th loop
+    assert (trace['accel_rate'][:first] == 0).all() and trace['accel_rate'][first] != 0
+    assert np.allclose(trace['accel_rate'][first:], expected[first:], rtol = 1e-4, atol = 1e-3)
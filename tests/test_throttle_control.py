@@ -0,0 +1,40 @@
+#Angle controller feedforward, anti-windup and settling on the simulated golf car
+import calibration
+import throttle_control
+from throttle_control import ThrottleAngleController
+
+
+def make_controller(**kwargs):
+    cal = calibration.DEFAULT_CALIBRATION
+    return ThrottleAngleController(cal['ff_spd_mph'], cal['ff_throttle_deg'], **kwargs)
+
+def test_feedforward_map():
+    controller = make_controller()
+    assert controller.feedforward(10) == 12.8
+    assert abs(controller.feedforward(12.5) - (12.8 + 22.5)/2) < 1e-9
+    assert controller.feedforward(40) == 78 #held at the end of the map
+    assert controller.update(10, 10, 0.0) == 12.8 #no speed error, the map alone
+    assert controller.update(10, 9, 0.0) == 12.8 + controller.kp #plus kp per mph
+
+def test_integral_trims_and_winds_up_no_further_at_the_limit():
+    controller = make_controller(kp = 0.0, ki = 1.0)
+    controller.update(10, 9, 0.0)
+    assert abs(controller.update(10, 9, 2.0) - (12.8 + 2.0)) < 1e-9 #1 mph for 2 s
+    controller = make_controller(kp = 0.0, ki = 10.0, deg_max = 20.0)
+    for i in range(100):
+        target = controller.update(10, 0, i*0.1)
+    assert target == 20.0 and controller.integral <= 20.0 - 12.8 + 1.0 #held near the limit, not the full i_limit
+    assert controller.update(10, 12, 10.1) < 20.0 #comes off the limit as soon as the error turns round
+
+def test_no_opening_over_accel_cap():
+    controller = make_controller()
+    assert controller.update(10, 5, 0.0, tps_deg = 8.0, accel_rate = 5.0) == 8.0
+
+def test_angle_mode_settles_with_few_pulses():
+    r = throttle_control.step_response('angle', 0.5, duration = 12.0)
+    assert r['settle_time'] is not None and r['settle_time'] < 4.0
+    assert r['overshoot'] < 0.5 and r['pulses'] < 1000
+
+def test_step_mode_settles_one_step_per_loop():
+    r = throttle_control.step_response('step', 0.5, duration = 15.0, settings = {'use_step_batches': False})
+    assert r['settle_time'] is not None and r['settle_time'] < 10.0
@@ -0,0 +1,88 @@
+#Ticker deadlines, the hybrid sleep and the garbage collector pause, on a fake clock
+import gc
+import pytest
+import timing
+from timing import Ticker
+
+
+class FakeClock: #perf_counter/sleep stand in, every perf_counter() call takes 'spin' seconds (so a spin loop ends), sleep() wakes up 'oversleep' late
+    def __init__(self, t = 100.0, spin = 0.00001, oversleep = 0.0):
+        self.t = t
+        self.spin = spin
+        self.oversleep = oversleep
+        self.sleeps = []
+        self.reads = 0
+
+    def perf_counter(self):
+        self.reads += 1
+        self.t += self.spin
+        return self.t
+
+    def now(self): #time without the cost of a read, for the ticker
+        return self.t
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.t += seconds + self.oversleep
+
+def test_ticker_on_time():
+    clock = FakeClock()
+    ticker = Ticker(0.01, clock.now, clock.sleep)
+    starts = []
+    for i in range(5):
+        assert ticker.wait() == 0.0
+        starts.append(clock.t)
+        clock.t += 0.003 #loop work
+    assert starts == pytest.approx([100.0 + i*0.01 for i in range(5)])
+    assert clock.sleeps[1:] == pytest.approx([0.007]*4)
+    assert ticker.stats()['misses'] == 0 and ticker.stats()['late_max'] == 0.0
+
+def test_ticker_counts_misses_and_skipped_ticks():
+    clock = FakeClock()
+    ticker = Ticker(0.01, clock.now, clock.sleep)
+    ticker.wait()
+    clock.t += 0.025 #loop took 2.5 periods, the next tick was 0.015 s ago
+    assert ticker.wait() == pytest.approx(0.015)
+    assert ticker.misses == 1 and ticker.skipped == 1
+    restart = clock.t
+    clock.t += 0.004
+    assert ticker.wait() == 0.0 and clock.t == pytest.approx(restart + 0.01) #started again from the late tick, no catching up
+    clock.t += 0.012 #late, but by less than a period: not a miss
+    assert ticker.wait() == pytest.approx(0.002)
+    stats = ticker.stats()
+    assert (stats['ticks'], stats['misses'], stats['skipped']) == (4, 1, 1)
+    assert stats['late_max'] == pytest.approx(0.015) and stats['late_mean'] == pytest.approx(0.017/4)
+
+def test_ticker_period_must_be_positive():
+    with pytest.raises(ValueError):
+        Ticker(0)
+
+def test_hybrid_sleep_sleeps_then_spins(monkeypatch):
+    clock = FakeClock(oversleep = 0.0002)
+    monkeypatch.setattr(timing, 'time', clock)
+    timing.sleep_until(100.002)
+    assert clock.sleeps == pytest.approx([0.002 - 0.00001 - timing.SPIN_BELOW]) #one time.sleep for all but the last spin_below
+    assert 100.002 <= clock.t < 100.002 + 0.00002 #the late wake up was made up by spinning less
+    clock.sleeps.clear()
+    reads = clock.reads
+    timing.sleep(0.0002) #shorter than spin_below, spun
+    assert clock.sleeps == [] and clock.reads - reads > 10
+
+def test_gc_pause_restores_state():
+    was_enabled = gc.isenabled()
+    try:
+        for enabled in (True, False):
+            if enabled:
+                gc.enable()
+            else:
+                gc.disable()
+            state = timing.gc_pause()
+            assert not gc.isenabled() and gc.get_freeze_count() > 0
+            timing.gc_resume(state)
+            assert gc.isenabled() == enabled and gc.get_freeze_count() == 0
+        gc.enable()
+        with timing.gc_paused(freeze = False):
+            assert not gc.isenabled() and gc.get_freeze_count() == 0
+        assert gc.isenabled()
+    finally:
+        gc.enable() if was_enabled else gc.disable()
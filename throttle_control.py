@@ -0,0 +1,112 @@
+#Throttle angle controller for ThrottleByWire.py ('angle' control mode)
+#The original control ('step' mode) is bang-bang: every loop it steps toward more throttle if des_spd > act_spd and toward less if not,
+#with step_mode() picking the step size from the speed error. It never stops moving around the target speed (hunting): thousands of pulses with one step per loop,
+#tens of thousands with step batches (which settle faster).
+#
+#The 'angle' mode works out the throttle opening that should hold the desired speed instead:
+#    target_deg = feedforward(des_spd) + kp*speed_error + integral of ki*speed_error (+ kd*rate of change of speed, off by default)
+#The feedforward map (ff_spd_mph/ff_throttle_deg in calibration.py) gets the throttle close straight away, the PI part trims out what the map gets wrong (hills, load).
+#The integral stops adding up while the target is held at tps_deg_stop_min/tps_deg_stop_max (anti-windup), or while over accel_rate_cap,
+#so it does not hold the throttle open (or shut) long after the speed has come back.
+#The main loop then moves the stepper until the TPS reads the target angle, and holds still once it is within 'deadband_deg'.
+#
+#'python3 throttle_control.py' runs a pedal step on the simulated golf car in both control modes (step mode with and without step batches) and prints settle time and steps per second.
+
+
+#####Library Imports
+import numpy as np
+#####
+
+
+
+class ThrottleAngleController:
+    #ff_spd/ff_deg ---- feedforward map, vehicle speed (mph) to the throttle opening (deg) that holds it
+    #kp --------------- throttle degrees per mph of speed error
+    #ki --------------- throttle degrees per mph of speed error per second
+    #kd --------------- throttle degrees per mph/s of acceleration (acts against fast speed changes), 0 for PI control
+    #i_limit ---------- most degrees the integral part can add or take away
+    def __init__(self, ff_spd, ff_deg, kp = 3.0, ki = 0.3, kd = 0.0, deg_min = 0.2, deg_max = 78, accel_rate_cap = 2.5, i_limit = 20.0):
+        self.ff_spd = np.asarray(ff_spd, dtype = float)
+        self.ff_deg = np.asarray(ff_deg, dtype = float)
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.deg_min = deg_min
+        self.deg_max = deg_max
+        self.accel_rate_cap = accel_rate_cap
+        self.i_limit = i_limit
+        self.reset()
+
+    def reset(self): #forget the integral and last values (pedal up)
+        self.integral = 0.0
+        self.t_last = None
+        self.spd_last = None
+        self.target = self.deg_min
+
+    def feedforward(self, des_spd): #throttle opening expected to hold des_spd
+        return float(np.interp(des_spd, self.ff_spd, self.ff_deg))
+
+    def update(self, des_spd, act_spd, t, tps_deg = None, accel_rate = 0.0): #new target throttle opening (deg) from this loop's readings
+        if des_spd <= 0:
+            self.reset()
+            return self.target
+        dt = 0.0 if self.t_last is None else max(t - self.t_last, 0.0)
+        error = des_spd - act_spd
+        derivative = 0.0
+        if self.kd and dt > 0:
+            derivative = -(act_spd - self.spd_last)/dt #on the measured speed, so a pedal change does not kick the throttle
+        self.t_last = t
+        self.spd_last = act_spd
+        base = self.feedforward(des_spd) + self.kp*error + self.kd*derivative
+        integral = min(max(self.integral + self.ki*error*dt, -self.i_limit), self.i_limit)
+        target = base + integral
+        over_cap = self.accel_rate_cap > 0 and accel_rate > self.accel_rate_cap
+        #anti-windup: the integral only adds up to where the target reaches a limit, and does not add more opening while over the accel rate cap
+        if over_cap and error > 0:
+            pass
+        elif target > self.deg_max and error > 0:
+            self.integral = max(self.integral, min(integral, self.deg_max - base))
+        elif target < self.deg_min and error < 0:
+            self.integral = min(self.integral, max(integral, self.deg_min - base))
+        else:
+            self.integral = integral
+        target = min(max(base + self.integral, self.deg_min), self.deg_max)
+        if over_cap and tps_deg is not None:
+            target = min(target, tps_deg) #no more opening while accelerating too fast
+        self.target = target
+        return target
+
+
+
+def step_response(control_mode, level = 0.5, start = 1.0, duration = 30.0, band = 0.5, settings = None): #pedal step on the simulated golf car, returns dict of results
+    #settle time is from the pedal step until the speed stays within 'band' mph of the desired speed
+    import plant_sim
+    plant = plant_sim.GolfCarPlant(pedal = plant_sim.step_pedal(level, start))
+    run_settings = {'control_mode': control_mode}
+    run_settings.update(settings or {})
+    backend, trace = plant_sim.simulate(duration, plant, run_settings, record_every = 0.01)
+    des_spd = plant_sim.desired_speed(trace, plant, run_settings.get('cruise_spd'))[-1] #pedal held at 'level' from 'start' to the end
+    t = np.array([row[0] for row in trace])
+    speed = np.array([row[2] for row in trace])
+    outside = np.nonzero((t >= start) & (np.abs(speed - des_spd) > band))[0]
+    settled = len(outside) == 0 or outside[-1] < len(t) - 1
+    settle_time = (t[outside[-1] + 1] - start) if len(outside) and settled else 0.0
+    after = t >= start
+    return {'control_mode': control_mode, 'des_spd': float(des_spd), 'settle_time': float(settle_time) if settled else None,
+            'overshoot': float(max(speed[after].max() - des_spd, 0.0)), 'final_error': float(speed[-1] - des_spd),
+            'pulses': plant.pulses, 'steps_per_s': plant.pulses/duration, 'loops': backend.cycles}
+
+
+
+#Pedal step response in both control modes on the simulated golf car
+#Run with 'python3 throttle_control.py'
+if __name__ == "__main__":
+    print("pedal step at t = 1 s, 30 s simulated, settled = within 0.5 mph of desired speed")
+    print("pedal  mode                des_spd  settle_time_s  overshoot_mph  final_error_mph  stepper_pulses  pulses_per_s")
+    runs = (('step', 'step, 1 step/loop', {'use_step_batches': False}), ('step', 'step, batches', {'use_step_batches': True}), ('angle', 'angle', {}))
+    for level in (0.3, 0.5, 0.8):
+        for mode, name, settings in runs:
+            r = step_response(mode, level, settings = settings)
+            settle = 'not settled' if r['settle_time'] is None else str(round(r['settle_time'], 2))
+            print(str(level).ljust(6), name.ljust(18), str(round(r['des_spd'], 2)).rjust(8), settle.rjust(14), str(round(r['overshoot'], 2)).rjust(14), str(round(r['final_error'], 2)).rjust(16),
+                  str(r['pulses']).rjust(15), str(round(r['steps_per_s'])).rjust(13))
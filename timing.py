@@ -0,0 +1,164 @@
+#Loop timing for ThrottleByWire.py
+#delay() works out step delays down to delay_FullStep/64 (about 20 us), but time.sleep() on Linux usually sleeps 60-100 us or more for anything that short,
+#so the real step rates (and so the microstepping speeds) were slower than designed. The loop also ran as fast as it happened to go, with no fixed period,
+#so the accel rate window held samples with uneven time spacing.
+#
+#Here:
+#    sleep()/sleep_until() ---- time.sleep for most of the wait, then spin on time.perf_counter for the last 'spin_below' seconds
+#    Ticker ------------------- fixed rate control tick, waits for the next tick and counts ticks that were missed (deadline misses)
+#    set_realtime() ----------- optional SCHED_FIFO real time priority and CPU affinity (needs root, or CAP_SYS_NICE, on the Pi)
+#    gc_pause()/gc_paused() --- freezes the objects made during setup and turns the garbage collector off while the loop runs
+#    process_start() --------- time.perf_counter() value when this process started (for the key-on to first throttle command time)
+#'python3 timing.py' compares time.sleep with the hybrid sleep for short waits and runs a 1 kHz ticker.
+
+
+#####Library Imports
+import os
+import gc
+import time
+from contextlib import contextmanager
+#####
+
+
+
+SPIN_BELOW = 0.0005 #seconds of the wait that are spun instead of slept (time.sleep wakes up late by about this much or less)
+
+
+def sleep_until(t, spin_below = SPIN_BELOW): #wait until time.perf_counter() reaches t
+    remaining = t - time.perf_counter()
+    if remaining > spin_below:
+        time.sleep(remaining - spin_below)
+    while time.perf_counter() < t:
+        pass
+
+def sleep(seconds, spin_below = SPIN_BELOW): #accurate sleep, also for waits much shorter than time.sleep can do
+    sleep_until(time.perf_counter() + seconds, spin_below)
+
+_sleep = sleep #Ticker's default, its 'sleep' argument hides the name
+
+
+
+class Ticker: #fixed rate tick for the control loop
+    #period ------ seconds between ticks
+    #now/sleep --- time functions of the backend (so the simulator's time can be used), real time by default
+    #A tick is 'missed' when the loop comes back to wait() after the next tick was already due. The ticker then starts again from the current time
+    #(it does not run several loops back to back to catch up), and counts the ticks that were skipped.
+    def __init__(self, period, now = None, sleep = None):
+        if period <= 0:
+            raise ValueError("Ticker period must be more than 0")
+        self.period = period
+        self.now = now if now is not None else time.perf_counter
+        self.sleep = sleep if sleep is not None else _sleep
+        self.next_tick = None
+        self.ticks = 0
+        self.misses = 0 #number of times the loop took longer than a period
+        self.skipped = 0 #ticks skipped because of misses
+        self.late_max = 0.0 #longest time a tick was late by (how far past the deadline the loop was)
+        self.late_total = 0.0
+
+    def wait(self): #wait for the next tick, returns how late the loop was for it (0 if it was on time)
+        now = self.now()
+        if self.next_tick is None:
+            self.next_tick = now
+        late = now - self.next_tick
+        if late > 0:
+            if late >= self.period: #missed the deadline, start again from now
+                self.misses += 1
+                self.skipped += int(late/self.period)
+                self.next_tick = now
+            self.late_total += late
+            if late > self.late_max:
+                self.late_max = late
+        else:
+            self.sleep(-late)
+            late = 0.0
+        self.ticks += 1
+        self.next_tick += self.period
+        return late
+
+    def stats(self):
+        return {'ticks': self.ticks, 'misses': self.misses, 'skipped': self.skipped, 'late_max': self.late_max,
+                'late_mean': self.late_total/self.ticks if self.ticks else 0.0}
+
+
+
+def set_realtime(priority = 50, cpus = None): #real time (SCHED_FIFO) priority and/or CPU affinity for this process, returns list of what could not be set
+    #cpus is a set of CPU numbers, e.g. {3} (on the Pi, 'isolcpus=3' in /boot/cmdline.txt keeps everything else off that CPU)
+    failed = []
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except (AttributeError, PermissionError, OSError):
+            failed.append('priority')
+    if cpus is not None:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError):
+            failed.append('affinity')
+    return failed
+
+
+def gc_pause(freeze = True, disable = True): #no garbage collector pauses while the loop runs, returns state for gc_resume()
+    #freeze moves every object made so far (tables, engines...) out of the collector's way, disable stops automatic collections.
+    #The loop does not make reference cycles, so memory still gets freed normally (by reference counting) with the collector off.
+    gc.collect()
+    frozen = freeze and hasattr(gc, 'freeze')
+    if frozen:
+        gc.freeze()
+    was_enabled = gc.isenabled()
+    if disable:
+        gc.disable()
+    return (was_enabled, frozen)
+
+def gc_resume(state): #undo gc_pause()
+    was_enabled, frozen = state
+    if was_enabled:
+        gc.enable()
+    if frozen:
+        gc.unfreeze()
+
+@contextmanager
+def gc_paused(freeze = True, disable = True): #gc_pause()/gc_resume() around a 'with' block
+    state = gc_pause(freeze, disable)
+    try:
+        yield
+    finally:
+        gc_resume(state)
+
+
+
+def process_start(): #time.perf_counter() value when this process was started (from /proc, Linux only, to about 10 ms), None if not known
+    try:
+        with open('/proc/self/stat') as f:
+            stat = f.read()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return None
+    start_ticks = int(stat.rsplit(')', 1)[1].split()[19]) #field 22, process start time in clock ticks since boot (fields after the ')' of the name start at field 3)
+    return time.perf_counter() - (uptime - start_ticks/os.sysconf('SC_CLK_TCK'))
+
+
+
+#Compare time.sleep and the hybrid sleep for short waits, then run a 1 kHz ticker for 2 seconds
+#Run with 'python3 timing.py'
+if __name__ == "__main__":
+    from sensor_frame import STEP_DELAY
+    print("wanted       time.sleep     hybrid sleep   (mean actual wait, us)")
+    for mode in ('Full', '1/8', '1/64'):
+        wanted = STEP_DELAY[mode]
+        actual = []
+        for f in (time.sleep, sleep):
+            start = time.perf_counter()
+            for i in range(200):
+                f(wanted)
+            actual.append((time.perf_counter() - start)/200*1e6)
+        print(str(round(wanted*1e6, 1)).rjust(7), mode.ljust(5), str(round(actual[0], 1)).rjust(10), str(round(actual[1], 1)).rjust(15))
+    print("real time priority/affinity not set:", set_realtime(50, {0}) or "none (both set)")
+    ticker = Ticker(0.001)
+    with gc_paused():
+        end = time.perf_counter() + 2
+        while time.perf_counter() < end:
+            ticker.wait()
+    stats = ticker.stats()
+    print("1 kHz ticker for 2 s:", stats['ticks'], "ticks  misses:", stats['misses'], "  skipped:", stats['skipped'], "  latest:", round(stats['late_max']*1e6, 1), "us")